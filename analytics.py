@@ -0,0 +1,249 @@
+"""
+Thống kê hội thoại từ logs/conversations.log, cộng dồn vào SQLite (logs/analytics.sqlite).
+
+Mỗi lần chạy chỉ đọc phần log MỚI: vị trí byte đã đọc của từng file log được lưu
+trong bảng checkpoint, cùng transaction với số liệu -> chạy lại / crash giữa chừng
+không bị đếm trùng. Hỗ trợ log đã xoay vòng (conversations.log.1, .2.gz, ...):
+mỗi đoạn log nhận diện bằng hash dòng đầu tiên nên đổi tên không làm đọc lại.
+
+Số liệu:
+    daily_counts   (day, direction)      -> số tin
+    user_counts    (user_id, direction)  -> số tin, lần đầu / cuối
+    intent_counts  (day, intent)         -> số tin bot trả lời theo intent (meta.intent)
+    need_counts    (day, need)           -> số tin bot trả lời theo nhu cầu (meta.need)
+
+Chạy:
+    python analytics.py            # cập nhật số liệu
+    python analytics.py --report   # cập nhật + in top intent / TVV hoạt động nhiều nhất
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import sqlite3
+import sys
+from collections import Counter
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+LOG_DIR = BASE_DIR / "logs"
+LOG_NAME = "conversations.log"
+DB_PATH = LOG_DIR / "analytics.sqlite"
+
+# Ghi số liệu + checkpoint sau mỗi ngần này dòng (giới hạn RAM với file log lớn)
+BATCH_LINES = 50_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    segment TEXT PRIMARY KEY,      -- hash dòng đầu của đoạn log
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,       -- byte đã đọc (bản giải nén nếu .gz)
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    day TEXT NOT NULL, direction TEXT NOT NULL, n INTEGER NOT NULL,
+    PRIMARY KEY (day, direction)
+);
+CREATE TABLE IF NOT EXISTS user_counts (
+    user_id TEXT NOT NULL, direction TEXT NOT NULL, n INTEGER NOT NULL,
+    first_ts TEXT, last_ts TEXT,
+    PRIMARY KEY (user_id, direction)
+);
+CREATE TABLE IF NOT EXISTS intent_counts (
+    day TEXT NOT NULL, intent TEXT NOT NULL, n INTEGER NOT NULL,
+    PRIMARY KEY (day, intent)
+);
+CREATE TABLE IF NOT EXISTS need_counts (
+    day TEXT NOT NULL, need TEXT NOT NULL, n INTEGER NOT NULL,
+    PRIMARY KEY (day, need)
+);
+"""
+
+
+def connect(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+# ========= ĐOẠN LOG =========
+def _open(path: Path):
+    return gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+
+
+def list_segments(log_dir: Path = LOG_DIR) -> list[Path]:
+    """Các đoạn log, cũ trước mới sau: .N lớn nhất trước, file đang ghi sau cùng."""
+    def age(path: Path) -> int:
+        suffix = path.name[len(LOG_NAME):].removesuffix(".gz").lstrip(".")
+        return int(suffix) if suffix.isdigit() else 0
+
+    segments = [p for p in log_dir.glob(LOG_NAME + "*") if p.is_file()]
+    return sorted(segments, key=age, reverse=True)
+
+
+def segment_id(path: Path) -> str | None:
+    """Hash dòng đầu (đủ dài) -> giữ nguyên khi file bị đổi tên/nén lúc xoay vòng."""
+    with _open(path) as f:
+        first = f.readline()
+    if not first.endswith(b"\n"):
+        return None                 # file rỗng / dòng đầu chưa ghi xong
+    return hashlib.sha1(first).hexdigest()
+
+
+# ========= CỘNG DỒN =========
+class Batch:
+    def __init__(self):
+        self.daily: Counter = Counter()
+        self.users: Counter = Counter()
+        self.user_ts: dict[tuple[str, str], list[str]] = {}
+        self.intents: Counter = Counter()
+        self.needs: Counter = Counter()
+        self.lines = 0
+
+    def add(self, rec: dict):
+        ts = str(rec.get("ts") or "")
+        day = ts[:10]
+        direction = str(rec.get("direction") or "")
+        user_key = (str(rec.get("user_id")), direction)
+
+        self.daily[(day, direction)] += 1
+        self.users[user_key] += 1
+        span = self.user_ts.get(user_key)
+        if span is None:
+            self.user_ts[user_key] = [ts, ts]
+        else:
+            span[0] = min(span[0], ts)
+            span[1] = max(span[1], ts)
+
+        meta = rec.get("meta") or {}
+        if meta.get("intent"):
+            self.intents[(day, meta["intent"])] += 1
+        if meta.get("need"):
+            self.needs[(day, meta["need"])] += 1
+
+    def flush(self, conn: sqlite3.Connection):
+        conn.executemany(
+            "INSERT INTO daily_counts VALUES (?, ?, ?) "
+            "ON CONFLICT(day, direction) DO UPDATE SET n = n + excluded.n",
+            [(d, direction, n) for (d, direction), n in self.daily.items()],
+        )
+        conn.executemany(
+            "INSERT INTO user_counts VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id, direction) DO UPDATE SET n = n + excluded.n, "
+            "first_ts = min(first_ts, excluded.first_ts), last_ts = max(last_ts, excluded.last_ts)",
+            [(u, direction, n, *self.user_ts[(u, direction)]) for (u, direction), n in self.users.items()],
+        )
+        conn.executemany(
+            "INSERT INTO intent_counts VALUES (?, ?, ?) "
+            "ON CONFLICT(day, intent) DO UPDATE SET n = n + excluded.n",
+            [(d, intent, n) for (d, intent), n in self.intents.items()],
+        )
+        conn.executemany(
+            "INSERT INTO need_counts VALUES (?, ?, ?) "
+            "ON CONFLICT(day, need) DO UPDATE SET n = n + excluded.n",
+            [(d, need, n) for (d, need), n in self.needs.items()],
+        )
+
+
+def _save_checkpoint(conn: sqlite3.Connection, seg: str, path: Path, offset: int, done: bool):
+    conn.execute(
+        "INSERT INTO checkpoint VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(segment) DO UPDATE SET path = excluded.path, offset = excluded.offset, done = excluded.done",
+        (seg, path.name, offset, int(done)),
+    )
+
+
+def ingest_segment(conn: sqlite3.Connection, path: Path, active: bool) -> int:
+    """Đọc tiếp 1 đoạn log từ checkpoint. Trả về số dòng mới đã xử lý."""
+    seg = segment_id(path)
+    if seg is None:
+        return 0
+    row = conn.execute("SELECT offset, done FROM checkpoint WHERE segment = ?", (seg,)).fetchone()
+    offset, done = row if row else (0, 0)
+    if done:
+        return 0
+    if path.suffix != ".gz" and path.stat().st_size < offset:
+        offset = 0                  # file bị cắt ngắn (copytruncate) rồi ghi lại từ đầu
+
+    total = 0
+    batch = Batch()
+    with _open(path) as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break               # dòng cuối đang ghi dở -> để lần sau
+            offset += len(raw)
+            try:
+                batch.add(json.loads(raw))
+            except (ValueError, AttributeError):
+                pass                # dòng hỏng: bỏ qua nhưng vẫn tiến offset
+            batch.lines += 1
+            if batch.lines >= BATCH_LINES:
+                with conn:
+                    batch.flush(conn)
+                    _save_checkpoint(conn, seg, path, offset, False)
+                total += batch.lines
+                batch = Batch()
+
+    # Đoạn đã xoay vòng không ghi thêm -> đánh dấu xong, lần sau khỏi mở lại
+    with conn:
+        batch.flush(conn)
+        _save_checkpoint(conn, seg, path, offset, not active)
+    return total + batch.lines
+
+
+def ingest(conn: sqlite3.Connection, log_dir: Path = LOG_DIR) -> int:
+    total = 0
+    for path in list_segments(log_dir):
+        total += ingest_segment(conn, path, active=(path.name == LOG_NAME))
+    return total
+
+
+# ========= BÁO CÁO =========
+def report(conn: sqlite3.Connection, top: int = 10):
+    print("Top intent:")
+    for intent, n in conn.execute(
+        "SELECT intent, SUM(n) AS total FROM intent_counts GROUP BY intent ORDER BY total DESC LIMIT ?", (top,)
+    ):
+        print(f"  {intent}: {n}")
+
+    print("Nhu cầu:")
+    for need, n in conn.execute("SELECT need, SUM(n) AS total FROM need_counts GROUP BY need ORDER BY total DESC"):
+        print(f"  {need}: {n}")
+
+    print("TVV hỏi nhiều nhất:")
+    for user_id, n, last_ts in conn.execute(
+        "SELECT user_id, n, last_ts FROM user_counts WHERE direction = 'user' ORDER BY n DESC LIMIT ?", (top,)
+    ):
+        print(f"  {user_id}: {n} tin (gần nhất {last_ts})")
+
+    print("Theo ngày (user / bot):")
+    for day, user_n, bot_n in conn.execute(
+        "SELECT day, SUM(CASE WHEN direction = 'user' THEN n ELSE 0 END), "
+        "SUM(CASE WHEN direction = 'bot' THEN n ELSE 0 END) "
+        "FROM daily_counts GROUP BY day ORDER BY day DESC LIMIT ?",
+        (top,),
+    ):
+        print(f"  {day}: {user_n} / {bot_n}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Thống kê tăng dần từ logs/conversations.log")
+    parser.add_argument("--log-dir", type=Path, default=LOG_DIR)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--report", action="store_true", help="in báo cáo sau khi cập nhật")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        added = ingest(conn, args.log_dir)
+        print(f"Đã xử lý {added} dòng log mới")
+        if args.report:
+            report(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
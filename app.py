@@ -1,14 +1,46 @@
 import os
+import atexit
+import contextvars
+import csv
+import hashlib
+import io
 import json
 import re
-import unicodedata
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-import requests
-from flask import Flask, request
+from flask import Flask, Response, g, has_request_context, request, stream_with_context
 from openai import OpenAI
 
+import memory
+import metrics
+import profiler
+from broadcast import LEASE_SECONDS, Broadcaster, BroadcastStore, SendResult, post_message, progress
+from catalog import INTENT_PRIORITY_DEFAULT, CatalogData, Combo, Product, load_catalog
+from coaching import COMBO_SESSION, PRODUCT_SESSION, coaching_session, fingerprint, load_coaching_cache
+from delivery import answer_inline_query, join_chunks, make_http_session, send_chunks, split_message
+from lanes import Lane, ThreadBudget, UserBuckets, chat_lock
+from memstat import process_memory
+from prewarm import normalize_question, read_tail, top_questions
+from profile_index import top_key
+from prompts import (
+    BASE_SYSTEM_PROMPT,
+    COMBO_COACH_PROMPT,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    PRODUCT_COACH_PROMPT,
+    build_openai_messages,
+    build_summary_messages,
+)
+from reminders import MAX_PENDING_PER_CHAT, Reminder, ReminderStore, Scheduler
+from search_index import normalize_text
+from tenants import CURRENT as CURRENT_TENANT, DEFAULT_BOT_ID, Tenant, load_tenants
+
 app = Flask(__name__)
 
 # ========= ĐƯỜNG DẪN & DATA =========
@@ -16,110 +48,93 @@ BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
 
 
-def load_json(path, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Không load được {path}: {e}")
-        return default
-
-
-CATALOG_PATH = DATA_DIR / "welllab_catalog.json"       # danh mục combo
-SYMPTOMS_PATH = DATA_DIR / "symptoms_mapping.json"     # intent -> combo
-FAQ_PATH = DATA_DIR / "faq.json"                       # câu hỏi thường gặp
-OBJECTIONS_PATH = DATA_DIR / "objections.json"         # từ chối phổ biến
-USERS_PATH = DATA_DIR / "users_store.json"             # hồ sơ người dùng
-PRODUCTS_PATH = DATA_DIR / "welllab_products.json"     # danh mục sản phẩm lẻ
-
-WELLLAB_CATALOG = load_json(CATALOG_PATH, [])
-SYMPTOM_RULES = load_json(SYMPTOMS_PATH, [])
-FAQ_LIST = load_json(FAQ_PATH, [])
-OBJECTION_LIST = load_json(OBJECTIONS_PATH, [])
-WELLLAB_PRODUCTS = load_json(PRODUCTS_PATH, [])
+USERS_PATH = DATA_DIR / "users_store.json"             # hồ sơ người dùng (bot mặc định)
 
-
-# ========= TIỆN ÍCH CHUẨN HÓA =========
-def normalize_text(s: str) -> str:
-    """Bỏ dấu, về thường để so khớp linh hoạt hơn."""
-    if not s:
-        return ""
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-    return s.lower().strip()
+# Catalog, sản phẩm, rule, FAQ, objection + chỉ mục tìm kiếm (xem catalog.py)
+DATA = load_catalog(DATA_DIR)
 
 
-def search_combo_by_text(query: str, top_k: int = 1) -> list[dict]:
+# ========= TÌM COMBO / SẢN PHẨM =========
+def search_combo_by_text(query: str, top_k: int = 1) -> list[Combo]:
     """
     Tìm combo theo tên / alias trong welllab_catalog.json.
-    So khớp không dấu, không phân biệt hoa thường.
+    So khớp không dấu, không phân biệt hoa thường, chịu lỗi gõ nhẹ.
     """
-    q = normalize_text(query)
-    if not q or not WELLLAB_CATALOG:
-        return []
-
-    results: list[tuple[int, dict]] = []
-    for combo in WELLLAB_CATALOG:
-        name = normalize_text(combo.get("name", ""))
-        aliases = [normalize_text(a) for a in combo.get("aliases", [])]
-        haystack = " ".join([name] + aliases)
-
-        score = 0
-        for token in q.split():
-            if token and token in haystack:
-                score += 1
-
-        if score > 0:
-            results.append((score, combo))
+    data = current_data()
+    return [data.combos[i] for _, i in data.combo_index.search(query, top_k=top_k)]
 
-    results.sort(key=lambda x: x[0], reverse=True)
-    return [c for score, c in results[:top_k]]
 
-
-def search_product_by_text(query: str, top_k: int = 1) -> list[dict]:
+def search_product_by_text(query: str, top_k: int = 1) -> list[Product]:
     """
     Tìm sản phẩm theo tên / mã trong welllab_products.json.
     """
-    q = normalize_text(query)
-    if not q or not WELLLAB_PRODUCTS:
-        return []
-
-    results: list[tuple[int, dict]] = []
-    for prod in WELLLAB_PRODUCTS:
-        name = normalize_text(prod.get("name", ""))
-        code = normalize_text(prod.get("code", ""))
-        aliases = [name, code]
-        haystack = " ".join([a for a in aliases if a])
+    data = current_data()
+    return [data.products[i] for _, i in data.product_index.search(query, top_k=top_k)]
 
-        score = 0
-        for token in q.split():
-            if token and token in haystack:
-                score += 1
-        if score > 0:
-            results.append((score, prod))
 
-    results.sort(key=lambda x: x[0], reverse=True)
-    return [p for score, p in results[:top_k]]
+def match_product_or_combo(query: str) -> tuple[Product | None, Combo | None]:
+    """
+    (sản phẩm, combo) khớp nhất với câu của TVV; chỉ 1 trong 2 khác None.
+    Ưu tiên sản phẩm lẻ, trừ khi combo khớp tốt hơn hoặc TVV gõ rõ "combo".
+    """
+    data = current_data()
+    prod_hits = data.product_index.search(query, top_k=1)
+    combo_hits = data.combo_index.search(query, top_k=1)
+    if combo_hits and (
+        not prod_hits or combo_hits[0][0] > prod_hits[0][0] or "combo" in normalize_text(query)
+    ):
+        return None, data.combos[combo_hits[0][1]]
+    if prod_hits:
+        return data.products[prod_hits[0][1]], None
+    return None, None
 
 
 # ========= USER STORE =========
-def load_users_store():
+def load_users_store(path: Path = USERS_PATH):
     try:
-        with open(USERS_PATH, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
         return {}
 
 
-def save_users_store(store: dict):
+def save_users_store(store: dict | str, path: Path = USERS_PATH):
+    """store: dict hồ sơ hoặc JSON đã dump sẵn (bản chụp lấy dưới _USERS_LOCK)."""
+    payload = store if isinstance(store, str) else json.dumps(store, ensure_ascii=False, indent=2)
+    tmp_path = path.with_suffix(".json.tmp")
     try:
-        with open(USERS_PATH, "w", encoding="utf-8") as f:
-            json.dump(store, f, ensure_ascii=False, indent=2)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        return True
     except Exception as e:
-        print("Lỗi lưu users_store.json:", e)
+        print(f"Lỗi lưu {path.name}:", e)
+        return False
+
+
+# Ghi hồ sơ kiểu write-behind: touch_user_stats chỉ đánh dấu "bẩn",
+# luồng flush (xem WARM-UP & SHUTDOWN) ghi file tối đa mỗi USERS_FLUSH_SECONDS.
+# _USERS_LOCK: mọi chỗ sửa / đọc nhiều trường hồ sơ; flush chỉ giữ khoá lúc dump ra chuỗi,
+# ghi file ngoài khoá. _USERS_FLUSH_LOCK: không cho 2 lần flush ghi chồng file .tmp.
+USERS_FLUSH_SECONDS = float(os.environ.get("USERS_FLUSH_SECONDS", "5"))
+_USERS_LOCK = threading.Lock()
+_USERS_FLUSH_LOCK = threading.Lock()
 
 
-USERS_STORE = load_users_store()
+def mark_users_dirty():
+    current_tenant().users_dirty = True
+
+
+def flush_users_store():
+    with _USERS_FLUSH_LOCK:
+        for tenant in TENANTS.values():
+            with _USERS_LOCK:
+                if not tenant.users_dirty:
+                    continue
+                tenant.users_dirty = False
+                snapshot = json.dumps(tenant.users_store, ensure_ascii=False, indent=2)
+            if not save_users_store(snapshot, tenant.users_path):
+                tenant.users_dirty = True
 
 # ========= LOG HỘI THOẠI =========
 LOG_DIR = BASE_DIR / "logs"
@@ -144,56 +159,80 @@ def log_event(user_id: int, direction: str, text: str, extra: dict | None = None
     if extra:
         rec["meta"] = extra
     try:
-        with open(CONV_LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with _LOG_LOCK:
+            _get_log_file().write(line)
     except Exception as e:
         print("Lỗi ghi log hội thoại:", e)
 
 
+# File log mở 1 lần (có buffer), luồng flush đẩy xuống đĩa định kỳ và khi shutdown
+_LOG_LOCK = threading.Lock()
+_LOG_FILE = None
+
+
+def _get_log_file():
+    global _LOG_FILE
+    if _LOG_FILE is None or _LOG_FILE.closed:
+        _LOG_FILE = open(CONV_LOG_PATH, "a", encoding="utf-8")
+    return _LOG_FILE
+
+
+def flush_log():
+    with _LOG_LOCK:
+        if _LOG_FILE is not None and not _LOG_FILE.closed:
+            _LOG_FILE.flush()
+
+
 # ========= HỒ SƠ NGƯỜI DÙNG =========
 def get_or_create_user_profile(telegram_user_id: int, tg_user: dict) -> dict:
     uid = str(telegram_user_id)
-    profile = USERS_STORE.get(uid) or {
-        "telegram_id": telegram_user_id,
-        "first_seen": get_now_iso(),
-        "last_seen": get_now_iso(),
-        "name": "",
-        "username": "",
-        "main_needs": {},
-        "intents_count": {},
-        "total_messages": 0,
-        "notes": "",
-    }
-
+    store = current_tenant().users_store
+    uname = full_name = ""
     if tg_user:
         uname = (tg_user.get("username") or "").strip()
         fname = (tg_user.get("first_name") or "").strip()
         lname = (tg_user.get("last_name") or "").strip()
         full_name = (fname + " " + lname).strip()
+
+    with _USERS_LOCK:
+        profile = store.get(uid) or {
+            "telegram_id": telegram_user_id,
+            "first_seen": get_now_iso(),
+            "last_seen": get_now_iso(),
+            "name": "",
+            "username": "",
+            "main_needs": {},
+            "intents_count": {},
+            "total_messages": 0,
+            "notes": "",
+        }
         if full_name:
             profile["name"] = full_name
         if uname:
             profile["username"] = uname
-
-    profile["last_seen"] = get_now_iso()
-    USERS_STORE[uid] = profile
+        profile["last_seen"] = get_now_iso()
+        store[uid] = profile
+        current_tenant().profile_index.update(uid, profile)
     return profile
 
 
 def touch_user_stats(profile: dict, need: str | None = None, intent: str | None = None):
-    profile["total_messages"] = int(profile.get("total_messages") or 0) + 1
+    with _USERS_LOCK:
+        profile["total_messages"] = int(profile.get("total_messages") or 0) + 1
 
-    if need:
-        needs = profile.get("main_needs") or {}
-        needs[need] = int(needs.get(need) or 0) + 1
-        profile["main_needs"] = needs
+        if need:
+            needs = profile.get("main_needs") or {}
+            needs[need] = int(needs.get(need) or 0) + 1
+            profile["main_needs"] = needs
 
-    if intent:
-        intents = profile.get("intents_count") or {}
-        intents[intent] = int(intents.get(intent) or 0) + 1
-        profile["intents_count"] = intents
+        if intent:
+            intents = profile.get("intents_count") or {}
+            intents[intent] = int(intents.get(intent) or 0) + 1
+            profile["intents_count"] = intents
 
-    save_users_store(USERS_STORE)
+        current_tenant().profile_index.update(str(profile.get("telegram_id")), profile)
+        mark_users_dirty()
 
 
 # ========= TELEGRAM & OPENAI =========
@@ -205,15 +244,46 @@ if not TELEGRAM_TOKEN:
 if not OPENAI_API_KEY:
     raise RuntimeError("Chưa cấu hình OPENAI_API_KEY")
 
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
+TELEGRAM_HTTP = make_http_session()                   # keep-alive tới Telegram (dùng chung mọi bot)
 client = OpenAI(api_key=OPENAI_API_KEY)
 
-# ========= SESSION THEO CHAT =========
-SESSIONS: dict[int, dict] = {}
+# Token cho các endpoint quản trị (/metrics...). Không cấu hình = tắt các endpoint này.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# ========= BOT (TENANT) =========
+# Nhiều bot chung 1 tiến trình (xem tenants.py): token, system prompt, data ghi đè,
+# session + hồ sơ riêng từng bot; catalog, sản phẩm và chỉ mục dùng chung 1 bản.
+DEFAULT_TENANT = Tenant(
+    bot_id=DEFAULT_BOT_ID,
+    token=TELEGRAM_TOKEN,
+    system_prompt=BASE_SYSTEM_PROMPT,
+    data=DATA,
+    users_path=USERS_PATH,
+)
+TENANTS = load_tenants(DEFAULT_TENANT, DATA)
+for _tenant in TENANTS.values():
+    _tenant.users_store = load_users_store(_tenant.users_path)
+    _tenant.profile_index.rebuild(_tenant.users_store)
+
+
+def current_tenant() -> Tenant:
+    return CURRENT_TENANT.get(DEFAULT_TENANT)
+
+
+def current_data() -> CatalogData:
+    return current_tenant().data
+
+
+def bot_meta() -> dict:
+    """Ghi kèm bot_id vào log của các bot phụ (log bot mặc định giữ nguyên định dạng cũ)."""
+    tenant = current_tenant()
+    return {} if tenant is DEFAULT_TENANT else {"bot": tenant.bot_id}
 
 
+# ========= SESSION THEO CHAT =========
 def get_session(chat_id: int) -> dict:
-    s = SESSIONS.get(chat_id)
+    sessions = current_tenant().sessions
+    s = sessions.get(chat_id)
     if not s:
         s = {
             "mode": "tvv",          # default: hỗ trợ TƯ VẤN VIÊN
@@ -225,30 +295,13 @@ def get_session(chat_id: int) -> dict:
             "last_combo": None,
             "last_product": None,
             "clarify_rounds": 0,
+            "user_id": None,        # người gửi tin đang xử lý (hạn mức LLM)
         }
-        SESSIONS[chat_id] = s
+        memory.reset(s)             # history / summary / summary_pending (xem memory.py)
+        sessions[chat_id] = s
     return s
 
 
-# ========= PROMPT HỆ THỐNG =========
-BASE_SYSTEM_PROMPT = (
-    "Bạn là TRỢ LÝ AI NỘI BỘ cho đội ngũ TƯ VẤN VIÊN của công ty Con Đường Xanh (WELLLAB).\n"
-    "Người đang nhắn với bạn là TƯ VẤN VIÊN, không phải khách hàng cuối.\n\n"
-    "NHIỆM VỤ CHÍNH:\n"
-    "- Giúp tư vấn viên hiểu rõ từng combo/sản phẩm, đối tượng dùng, cách giải thích đơn giản cho khách.\n"
-    "- Hướng dẫn tư vấn viên đặt câu hỏi khai thác nhu cầu, gợi ý kịch bản tư vấn và kịch bản chốt đơn.\n"
-    "- Gợi ý cách xử lý từ chối/lo lắng của khách một cách tinh tế, tôn trọng, tuân thủ quy định.\n"
-    "- Chỉ sử dụng các combo/sản phẩm có trong ngữ cảnh nội bộ, không bịa thêm.\n\n"
-    "CÁCH TRẢ LỜI:\n"
-    "- Trả lời ngắn gọn, rõ ý, ưu tiên bullet.\n"
-    "- Thường chia thành 3–4 phần: (1) Tóm tắt case khách; "
-    "(2) Gợi ý câu hỏi tư vấn viên nên hỏi; "
-    "(3) Gợi ý combo/sản phẩm phù hợp và cách GIẢI THÍCH CHO KHÁCH; "
-    "(4) Gợi ý 1–2 câu chốt mềm.\n"
-    "- Xưng hô với người đang chat là 'anh/chị' (tư vấn viên). Không nói như đang chat trực tiếp với khách.\n"
-)
-
-
 # ========= LỜI CHÀO / MENU =========
 def build_welcome_message() -> str:
     return (
@@ -257,7 +310,8 @@ def build_welcome_message() -> str:
         "Anh/chị có thể dùng em để:\n"
         "- Phân tích case khách (triệu chứng, bệnh nền, nhu cầu...)\n"
         "- Hỏi về combo/sản phẩm cụ thể\n"
-        "- Hỏi cách xử lý từ chối, chính sách, kịch bản chốt đơn\n\n"
+        "- Hỏi cách xử lý từ chối, chính sách, kịch bản chốt đơn\n"
+        "- Hẹn nhắc follow-up khách: /nhac 7 ngày gọi lại KH\n\n"
         "Anh/chị cứ mô tả case khách hoặc gõ tên combo/sản phẩm, em sẽ hỗ trợ hết sức. 💚"
     )
 
@@ -271,38 +325,54 @@ def get_main_menu_keyboard():
 
 
 # ========= INTENT & NEED =========
-INTENT_PRIORITY_DEFAULT = 10
-
-
 def get_intent_priority(intent: str) -> int:
-    for rule in SYMPTOM_RULES:
-        if rule.get("intent") == intent:
-            return int(rule.get("priority", INTENT_PRIORITY_DEFAULT))
-    return INTENT_PRIORITY_DEFAULT
+    rule = current_data().rule_by_intent.get(intent)
+    return rule.priority if rule else INTENT_PRIORITY_DEFAULT
 
 
-def detect_intent_from_text(text: str) -> str | None:
+def rank_intents(text: str) -> list[tuple[int, int, str]]:
+    """Các intent khớp, điểm cao trước: (score, số keyword khớp, intent)."""
     t = text.lower()
-    best_intent = None
-    best_score = 0
+    ranked: dict[str, tuple[int, int, str]] = {}
 
-    for rule in SYMPTOM_RULES:
-        intent = rule.get("intent")
-        kws = rule.get("keywords", [])
+    for rule in current_data().rules:
         matches = 0
-        for kw in kws:
-            kw_l = kw.lower().strip()
-            if kw_l and kw_l in t:
+        for kw in rule.keywords:
+            if kw in t:
                 matches += 1
 
         if matches > 0:
+            intent = rule.intent
             priority = get_intent_priority(intent)
             score = matches * 10 + priority
-            if score > best_score:
-                best_score = score
-                best_intent = intent
+            if score > ranked.get(intent, (0,))[0]:
+                ranked[intent] = (score, matches, intent)
 
-    return best_intent
+    # sorted ổn định: cùng điểm thì rule đứng trước thắng (giống vòng lặp cũ)
+    return sorted(ranked.values(), key=lambda item: -item[0])
+
+
+def detect_intent_from_text(text: str) -> str | None:
+    ranked = rank_intents(text)
+    return ranked[0][2] if ranked else None
+
+
+PROFILE_FIELDS = ("age", "gender", "has_chronic")      # trường hồ sơ KH extract_profile nhận ra
+
+
+def intent_confidence(text: str, intent: str | None, profile: dict) -> float:
+    """
+    Độ chắc chắn 0..1 của intent cho đoạn mô tả case:
+    số keyword khớp (50%), cách biệt điểm với intent xếp thứ 2 (30%),
+    số trường hồ sơ KH đã biết - tuổi / giới tính / bệnh nền (20%).
+    """
+    ranked = rank_intents(text)
+    if not intent or not ranked or ranked[0][2] != intent:
+        return 0.0
+    score, matches, _ = ranked[0]
+    margin = score - ranked[1][0] if len(ranked) > 1 else 20
+    known = sum(1 for key in PROFILE_FIELDS if key in profile)
+    return round(min(matches, 3) / 3 * 0.5 + min(margin, 20) / 20 * 0.3 + known / 3 * 0.2, 3)
 
 
 def detect_need(text: str) -> str:
@@ -354,15 +424,15 @@ def is_no_health_intent(text: str) -> bool:
 
 
 # ========= CHỌN COMBO TỪ INTENT =========
-def choose_combo(intent: str | None) -> dict | None:
+def choose_combo(intent: str | None) -> Combo | None:
     if not intent:
         return None
-    rule = next((r for r in SYMPTOM_RULES if r.get("intent") == intent), None)
+    data = current_data()
+    rule = data.rule_by_intent.get(intent)
     if not rule:
         return None
-    preferred_names = rule.get("preferred_combos", [])
-    for name in preferred_names:
-        combo = next((c for c in WELLLAB_CATALOG if c.get("name") == name), None)
+    for name in rule.preferred_combos:
+        combo = data.combo_by_name.get(name)
         if combo:
             return combo
     return None
@@ -403,103 +473,29 @@ def match_keywords_any(text: str, keywords: list[str]) -> bool:
 
 
 def try_answer_faq(text: str) -> str | None:
-    for item in FAQ_LIST:
-        kws = item.get("keywords_any", [])
-        if kws and match_keywords_any(text, kws):
-            return item.get("answer")
+    for item in current_data().faq:
+        if match_keywords_any(text, item.keywords):
+            return item.answer
     return None
 
 
 def try_answer_objection(text: str) -> str | None:
-    for item in OBJECTION_LIST:
-        kws = item.get("keywords_any", [])
-        if kws and match_keywords_any(text, kws):
-            return item.get("answer")
+    for item in current_data().objections:
+        if match_keywords_any(text, item.keywords):
+            return item.answer
     return None
 
 
-# ========= CONTEXT GỬI OPENAI =========
-def build_combo_context(combo: dict | None) -> str:
-    if not combo:
-        return "Hiện chưa xác định được combo cụ thể."
-
-    lines: list[str] = []
-    lines.append(f"Combo: {combo.get('name', '')}")
-    header = combo.get("header_text", "")
-    if header:
-        lines.append("\n[Thông tin]:")
-        lines.append(header)
-
-    duration = combo.get("duration_text", "")
-    if duration:
-        lines.append("\n[Thời gian liệu trình khuyến nghị]:")
-        lines.append(duration)
-
-    prods = combo.get("products", [])
-    if prods:
-        lines.append("\n[Thành phần combo]:")
-        for idx, p in enumerate(prods, start=1):
-            name = p.get("name", "")
-            text = p.get("text", "")
-            code = p.get("code", "")
-            url_p = p.get("url") or p.get("link") or ""
-            line = f"{idx}. {name}"
-            if code:
-                line += f" ({code})"
-            if text:
-                line += f": {text}"
-            if url_p:
-                line += f" [LINK: {url_p}]"
-            lines.append(line)
-    return "\n".join(lines)
-
-
-def build_product_context(prod: dict | None) -> str:
-    if not prod:
-        return "Chưa có sản phẩm cụ thể."
-    name = prod.get("name", "")
-    code = prod.get("code", "")
-    price = prod.get("price", "")
-    ingredients = prod.get("ingredients", "")
-    usage = prod.get("usage", "")
-    benefits = prod.get("benefits", "")
-    link = prod.get("link", "")
-    lines = [
-        f"Tên: {name}",
-        f"Mã: {code}",
-        f"Giá: {price}",
-        f"Thành phần: {ingredients}",
-        f"Cách dùng: {usage}",
-        f"Lợi ích chính: {benefits}",
-        f"Link: {link}",
-    ]
-    return "\n".join(lines)
-
-
-def build_profile_context(profile: dict) -> str:
-    if not profile:
-        return "Chưa có thêm thông tin cụ thể về tuổi, giới tính hay bệnh nền."
-    parts: list[str] = []
-    if profile.get("age"):
-        parts.append(f"Tuổi khoảng: {profile['age']}.")
-    if profile.get("gender"):
-        parts.append(f"Giới tính: {profile['gender']}.")
-    if profile.get("has_chronic") is True:
-        parts.append("Có bệnh nền (chi tiết chưa rõ).")
-    elif profile.get("has_chronic") is False:
-        parts.append("Không có bệnh nền.")
-    return " ".join(parts)
-
-
-def format_combo_for_tvv(combo: dict) -> str:
+# ========= TEXT CỐ ĐỊNH CHO TVV =========
+def format_combo_for_tvv(combo: Combo | None) -> str:
     """Đoạn text cố định cho TVV: combo + link từng sản phẩm."""
     if not combo:
         return "Hiện chưa xác định được combo cụ thể ạ."
 
-    name = combo.get("name", "")
-    header = combo.get("header_text", "")
-    duration = combo.get("duration_text", "")
-    prods = combo.get("products", [])
+    name = combo.name
+    header = combo.header_text
+    duration = combo.duration_text
+    prods = combo.products
 
     lines: list[str] = []
     lines.append(f"*Combo đề xuất:* *{name}*")
@@ -511,10 +507,10 @@ def format_combo_for_tvv(combo: dict) -> str:
     if prods:
         lines.append("\n*Các sản phẩm trong combo (kèm link để gửi khách):*")
         for idx, p in enumerate(prods, start=1):
-            pname = p.get("name", "")
-            code = p.get("code", "")
-            url_p = p.get("url") or p.get("link") or ""
-            note = p.get("short_text") or p.get("text", "")
+            pname = p.name
+            code = p.code
+            url_p = p.url
+            note = p.short_text or p.text
             line = f"{idx}. *{pname}*"
             if code:
                 line += f" ({code})"
@@ -524,25 +520,25 @@ def format_combo_for_tvv(combo: dict) -> str:
                 line += f"\n   Link: {url_p}"
             lines.append(line)
 
-    combo_url = combo.get("combo_url") or combo.get("url") or combo.get("link") or ""
+    combo_url = combo.url
     if combo_url:
         lines.append(f"\n*Link combo tổng:* {combo_url}")
 
     return "\n".join(lines)
 
 
-def format_product_for_tvv(prod: dict) -> str:
+def format_product_for_tvv(prod: Product | None) -> str:
     """Đoạn text cố định: thông tin chi tiết sản phẩm + link."""
     if not prod:
         return "Hiện chưa xác định được sản phẩm cụ thể ạ."
 
-    name = prod.get("name", "")
-    code = prod.get("code", "")
-    price = prod.get("price", "")
-    ingredients = prod.get("ingredients", "")
-    usage = prod.get("usage", "")
-    benefits = prod.get("benefits", "")
-    link = prod.get("link", "")
+    name = prod.name
+    code = prod.code
+    price = prod.price
+    ingredients = prod.ingredients
+    usage = prod.usage
+    benefits = prod.benefits
+    link = prod.url
 
     lines = [
         f"*Sản phẩm:* *{name}* ({code})",
@@ -561,6 +557,47 @@ def format_product_for_tvv(prod: dict) -> str:
     return "\n".join(lines)
 
 
+# ========= CACHE TEXT ĐÃ DỰNG =========
+# Text combo/sản phẩm chỉ phụ thuộc data -> dựng 1 lần, chia sẵn theo giới hạn Telegram.
+# Khoá có DATA.version nên reload data là tự hết hạn; reload_data() xoá hẳn cache cũ.
+RENDER_CACHE: dict[tuple, tuple[str, ...]] = {}
+
+
+def catalog_item_key(item: Combo | Product) -> tuple:
+    """Định danh combo / sản phẩm cho cache và id inline. Mã sản phẩm có thể trùng trong data
+    (vd. 070737) nên sản phẩm khoá theo (mã, tên), không theo mã."""
+    if isinstance(item, Combo):
+        return ("combo", item.name)
+    return ("product", item.code, item.name)
+
+
+def render_combo(combo: Combo | None) -> tuple[str, ...]:
+    key = (*(catalog_item_key(combo) if combo else ("combo", None)), DATA.version)
+    chunks = RENDER_CACHE.get(key)
+    if chunks is None:
+        metrics.incr("render_cache_misses", kind="combo")
+        chunks = RENDER_CACHE[key] = split_message(format_combo_for_tvv(combo))
+    else:
+        metrics.incr("render_cache_hits", kind="combo")
+    return chunks
+
+
+def render_product(prod: Product | None) -> tuple[str, ...]:
+    key = (*(catalog_item_key(prod) if prod else ("product", None)), DATA.version)
+    chunks = RENDER_CACHE.get(key)
+    if chunks is None:
+        metrics.incr("render_cache_misses", kind="product")
+        chunks = RENDER_CACHE[key] = split_message(format_product_for_tvv(prod))
+    else:
+        metrics.incr("render_cache_hits", kind="product")
+    return chunks
+
+
+def with_coaching(info: tuple[str, ...], coach_block: str) -> tuple[str, ...]:
+    """Ghép text cố định + coaching (ngăn bởi ---), gộp vào cùng tin nhắn nếu vừa."""
+    return join_chunks([info, split_message(coach_block)], "\n\n---\n")
+
+
 # ========= CÂU HỎI LÀM RÕ =========
 CLARIFY_QUESTIONS = {
     "blood_pressure": (
@@ -614,50 +651,436 @@ def get_clarify_question(intent: str | None) -> str:
     return CLARIFY_QUESTIONS.get(intent, CLARIFY_QUESTIONS["default"])
 
 
+# ========= TRẢ LỜI MẪU (BỎ QUA LLM KHI CHẮC CHẮN) =========
+# Case khớp intent rõ ràng + có combo -> coaching gần như cố định: ghép tóm tắt case,
+# combo và câu chốt theo intent thay vì gọi OpenAI. LLM_BYPASS_THRESHOLD > 1 để tắt.
+# Chỉ áp dụng khi đã biết ít nhất LLM_BYPASS_MIN_PROFILE_FIELDS trường hồ sơ KH:
+# chỉ có keyword thì case còn quá chung, để LLM khai thác.
+LLM_BYPASS_THRESHOLD = float(os.environ.get("LLM_BYPASS_THRESHOLD", "0.8"))
+LLM_BYPASS_MIN_PROFILE_FIELDS = int(os.environ.get("LLM_BYPASS_MIN_PROFILE_FIELDS", "1"))
+
+CLOSING_LINES = {
+    "blood_pressure": [
+        "“Mình vẫn dùng thuốc bác sĩ kê đều nhé, combo này hỗ trợ thêm để huyết áp ổn định hơn.”",
+        "“Anh/chị dùng đủ liệu trình rồi đo huyết áp mỗi sáng, em theo dõi cùng mình.”",
+    ],
+    "diabetes": [
+        "“Combo hỗ trợ ổn định đường huyết, mình vẫn giữ thuốc/insulin theo chỉ định bác sĩ ạ.”",
+        "“Mình thử đủ liệu trình, em nhắc lịch đo đường huyết để cùng xem tiến triển nhé.”",
+    ],
+    "default": [
+        "“Anh/chị dùng đủ liệu trình để thấy rõ hiệu quả, em sẽ theo dõi và nhắc cách dùng cùng mình.”",
+        "“Mình bắt đầu với combo này trước, có gì thay đổi anh/chị báo em điều chỉnh ngay ạ.”",
+    ],
+}
+
+
+def build_template_coaching(intent: str, combo: Combo, profile: dict) -> str:
+    rule = current_data().rule_by_intent.get(intent)
+    title = rule.title if rule and rule.title else intent
+
+    facts = []
+    if profile.get("age"):
+        facts.append(f"{profile['age']} tuổi")
+    if profile.get("gender"):
+        facts.append(profile["gender"])
+    if "has_chronic" in profile:
+        facts.append("có bệnh nền" if profile["has_chronic"] else "không bệnh nền")
+
+    closings = CLOSING_LINES.get(intent, CLOSING_LINES["default"])
+
+    # Câu hỏi khai thác đã gửi ở bước clarify, không lặp lại ở đây
+    lines = [f"*Tóm tắt case:* KH gặp vấn đề *{title}*" + (f" ({', '.join(facts)})." if facts else ".")]
+    lines.append(f"\n*Gợi ý tư vấn:* đề xuất *{combo.name}*, gửi KH link từng sản phẩm ở trên")
+    if combo.duration_text:
+        lines[-1] += f", dùng đủ liệu trình {combo.duration_text}"
+    lines[-1] += "."
+    lines.append("\n*Câu chốt gợi ý:*")
+    lines.extend(f"- {line}" for line in closings)
+    return "\n".join(lines)
+
+
+def try_template_coaching(case_text: str, intent: str | None, combo: Combo | None, session: dict) -> str | None:
+    """Trả lời mẫu nếu đủ chắc chắn, ngược lại None (gọi LLM như cũ)."""
+    metrics.incr("llm_bypass_candidates")
+    if not intent or not combo:
+        return None
+    profile = session.get("profile") or {}
+    if sum(1 for key in PROFILE_FIELDS if key in profile) < LLM_BYPASS_MIN_PROFILE_FIELDS:
+        return None
+    confidence = intent_confidence(case_text, intent, profile)
+    if confidence < LLM_BYPASS_THRESHOLD:
+        return None
+    metrics.incr("llm_bypass", intent=intent)
+    # Ước lượng thời gian tiết kiệm bằng độ trễ LLM trung bình hiện tại
+    metrics.observe("llm_bypass_saved_ms", metrics.mean("llm_latency_ms"))
+    return build_template_coaching(intent, combo, profile)
+
+
 # ========= GỌI OPENAI =========
-def call_openai_for_answer(
+LLM_BUSY_REPLY = "Hiện hệ thống AI đang bận, anh/chị thử lại sau một chút giúp em nhé."
+
+# Coaching sinh sẵn bởi coaching.py (fingerprint messages -> text)
+COACHING_CACHE = load_coaching_cache()
+
+# Làn LLM (xem lanes.py): tối đa LLM_MAX_ACTIVE lời gọi đồng thời, LLM_MAX_WAITING chỗ chờ.
+# Bị từ chối -> trả LLM_BUSY_REPLY; các nhánh có combo vẫn gửi kèm text combo.
+FAST_LANE = Lane("fast")
+LLM_LANE = Lane(
+    "llm",
+    max_active=int(os.environ.get("LLM_MAX_ACTIVE", "4")),
+    max_waiting=int(os.environ.get("LLM_MAX_WAITING", "2")),
+    wait_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", "8")),
+)
+
+# Suất thread được chặn (gọi/chờ LLM, chờ lock chat, ngủ chờ token, chờ nháp prefetch, debounce
+# inline): GUNICORN_THREADS trừ FAST_RESERVED_THREADS thread luôn để dành cho trả lời tất định.
+# Hết suất: không chờ nữa mà trả lời bận / bỏ qua bước chờ.
+WORKER_THREADS = int(os.environ.get("GUNICORN_THREADS", "8"))
+FAST_RESERVED_THREADS = int(os.environ.get("FAST_RESERVED_THREADS", "2"))
+BLOCKING_BUDGET = ThreadBudget("blocking", max(WORKER_THREADS - FAST_RESERVED_THREADS, 1))
+
+# Hạn mức LLM theo TVV (token bucket). Ghi đè cho từng người trong hồ sơ:
+#   "llm_limit": {"rate_per_min": 20, "burst": 10}
+# Thiếu token: chờ tối đa LLM_USER_MAX_DELAY giây, lâu hơn thì trả LLM_RATE_LIMITED_REPLY
+# (các nhánh combo/sản phẩm vẫn gửi kèm text cố định).
+LLM_USER_RATE_PER_MIN = float(os.environ.get("LLM_USER_RATE_PER_MIN", "6"))
+LLM_USER_BURST = float(os.environ.get("LLM_USER_BURST", "5"))
+LLM_USER_MAX_DELAY = float(os.environ.get("LLM_USER_MAX_DELAY", "3"))
+LLM_RATE_LIMITED_REPLY = (
+    "Anh/chị đang hỏi AI hơi dồn dập, em tạm gửi thông tin có sẵn trước. "
+    "Khoảng 1 phút nữa anh/chị hỏi tiếp giúp em nhé."
+)
+USER_BUCKETS = UserBuckets()
+
+# Hàng đợi theo chat (lanes.chat_lock): ngoài update đang xử lý chỉ cho CHAT_MAX_WAITING update
+# cùng chat chờ, tối đa CHAT_WAIT_TIMEOUT giây -> 1 chat gửi dồn không giữ hết thread của worker.
+CHAT_MAX_WAITING = int(os.environ.get("CHAT_MAX_WAITING", "1"))
+CHAT_WAIT_TIMEOUT = float(os.environ.get("CHAT_WAIT_TIMEOUT", "20"))
+CHAT_BUSY_REPLY = "Em đang xử lý tin nhắn trước của anh/chị, anh/chị đợi em trả lời xong rồi gửi tiếp giúp em nhé."
+
+
+def user_llm_limit(user_id) -> tuple[float, float]:
+    override = (current_tenant().users_store.get(str(user_id)) or {}).get("llm_limit") or {}
+    try:
+        rate = float(override.get("rate_per_min", LLM_USER_RATE_PER_MIN))
+        burst = float(override.get("burst", LLM_USER_BURST))
+    except (TypeError, ValueError):
+        print("llm_limit không hợp lệ trong hồ sơ", user_id, override)
+        return LLM_USER_RATE_PER_MIN, LLM_USER_BURST
+    return rate, burst
+
+
+def admit_user_llm(user_id, background: bool = False) -> str | None:
+    """
+    Trừ 1 token của user rồi giữ chỗ làn LLM. None = được gọi (làn đã giữ, nhả bằng
+    LLM_LANE.release()); ngược lại là câu trả lời thay thế.
+    Thiếu token thì chỉ chờ ngắn khi làn còn nhận -> không ngủ rồi vẫn bị từ chối;
+    làn từ chối thì trả lại token vừa trừ. background: không chờ, chừa 1 slot cho TVV.
+    """
+    reserve, wait_lane = (1, False) if background else (0, True)
+    if user_id is not None:
+        user = str(user_id)
+        rate, burst = user_llm_limit(user_id)
+        wait = USER_BUCKETS.take(user, rate, burst)
+        if wait and not background and wait <= LLM_USER_MAX_DELAY:
+            if LLM_LANE.would_shed(reserve, wait_lane) or not BLOCKING_BUDGET.try_block():
+                metrics.incr("lane_shed", lane=LLM_LANE.name)
+                return LLM_BUSY_REPLY
+            metrics.observe("llm_user_delay_ms", wait * 1000, user=user_id)
+            time.sleep(wait)
+            wait = USER_BUCKETS.take(user, rate, burst)
+        if wait:
+            metrics.incr("llm_user_throttled", user=user_id)
+            return LLM_RATE_LIMITED_REPLY
+
+    if not BLOCKING_BUDGET.try_block() or not LLM_LANE.try_acquire(reserve=reserve, wait=wait_lane):
+        if user_id is not None:
+            USER_BUCKETS.refund(user, burst)
+            metrics.incr("llm_user_refunded", user=user_id)
+        return LLM_BUSY_REPLY
+    if user_id is not None:
+        metrics.incr("llm_user_calls", user=user_id)
+    return None
+
+
+def charge_user_llm(user_id):
+    """Nháp prefetch được dùng thay 1 lời gọi LLM: trừ token lúc này, không chờ (hết token vẫn dùng nháp)."""
+    if user_id is None:
+        return
+    rate, burst = user_llm_limit(user_id)
+    if not USER_BUCKETS.take(str(user_id), rate, burst):
+        metrics.incr("llm_user_calls", user=user_id)
+
+
+def is_llm_fallback(text: str) -> bool:
+    return text in (LLM_BUSY_REPLY, LLM_RATE_LIMITED_REPLY)
+
+
+# Cache câu trả lời LLM lúc chạy: khoá = messages dựng từ câu hỏi đã chuẩn hoá
+# (cùng intent/hồ sơ/combo + cùng câu hỏi -> cùng câu trả lời), LRU + hết hạn sau TTL.
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_MAX = int(os.environ.get("ANSWER_CACHE_MAX", "2000"))
+ANSWER_CACHE: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_ANSWER_LOCK = threading.Lock()
+
+
+def answer_cache_key(
     user_text: str,
     session: dict,
-    combo: dict | None = None,
-    product: dict | None = None,
+    combo: Combo | None,
+    product: Product | None,
 ) -> str:
-    mode = session.get("mode", "tvv")
-    intent = session.get("intent")
-    profile = session.get("profile", {})
+    """Không gồm history của chat: cùng câu hỏi + cùng case thì dùng chung câu trả lời (kể cả prewarm)."""
+    messages = build_openai_messages(
+        normalize_question(user_text),
+        session,
+        combo=combo,
+        product=product,
+        system_prompt=current_tenant().system_prompt,
+    )
+    return fingerprint(messages)
+
+
+def get_cached_answer(key: str) -> str | None:
+    with _ANSWER_LOCK:
+        item = ANSWER_CACHE.get(key)
+        if item is None:
+            return None
+        stored_at, text = item
+        if time.monotonic() - stored_at > ANSWER_CACHE_TTL:
+            del ANSWER_CACHE[key]
+            return None
+        ANSWER_CACHE.move_to_end(key)
+        return text
+
 
-    sys_prompt = BASE_SYSTEM_PROMPT
+def put_cached_answer(key: str, text: str):
+    with _ANSWER_LOCK:
+        ANSWER_CACHE[key] = (time.monotonic(), text)
+        ANSWER_CACHE.move_to_end(key)
+        while len(ANSWER_CACHE) > ANSWER_CACHE_MAX:
+            ANSWER_CACHE.popitem(last=False)
 
-    combo_ctx = build_combo_context(combo)
-    product_ctx = build_product_context(product)
-    profile_ctx = build_profile_context(profile)
-    intent_text = f"Intent hiện tại (ước đoán vấn đề sức khỏe): {intent or 'chưa rõ'}."
 
+def call_openai_for_answer(
+    user_text: str,
+    session: dict,
+    combo: Combo | None = None,
+    product: Product | None = None,
+    background: bool = False,
+    with_history: bool = False,
+) -> str:
+    """
+    background=True (prefetch): không xếp hàng, luôn chừa 1 slot làn LLM cho TVV.
+    with_history=True: gửi kèm tóm tắt + các lượt gần đây của chat (nhánh hội thoại nhiều lượt).
+    Câu trả lời có history là riêng của chat đó (case, KH cụ thể) -> không tra / không ghi
+    cache câu trả lời dùng chung; chỉ câu hỏi không kèm history mới dùng cache (kể cả prewarm).
+    """
+    system_prompt = current_tenant().system_prompt
+    messages = build_openai_messages(user_text, session, combo=combo, product=product, system_prompt=system_prompt)
+
+    # Câu hỏi đã được sinh sẵn (prompt + dữ liệu y hệt) -> trả ngay, không gọi OpenAI
+    cached = COACHING_CACHE.get(fingerprint(messages))
+    if cached:
+        metrics.incr("llm_precomputed_hits")
+        return cached
+
+    history = memory.history_messages(session) if with_history else []
+    cache_key = None
+    if history:
+        messages = build_openai_messages(
+            user_text, session, combo=combo, product=product, system_prompt=system_prompt, history=history
+        )
+    else:
+        cache_key = answer_cache_key(user_text, session, combo, product)
+        cached = get_cached_answer(cache_key)
+        if cached:
+            metrics.incr("llm_answer_cache_hits")
+            return cached
+
+    refused = admit_user_llm(session.get("user_id"), background=background)
+    if refused:
+        return refused
+
+    started = time.monotonic()
     try:
         completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.4,
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {
-                    "role": "system",
-                    "content": (
-                        "Dữ liệu nội bộ của WELLLAB cho case này:\n"
-                        + intent_text
-                        + "\n\n[HỒ SƠ KHÁCH HÀNG (nếu có)]: "
-                        + profile_ctx
-                        + "\n\n[COMBO LIÊN QUAN]:\n"
-                        + combo_ctx
-                        + "\n\n[SẢN PHẨM LIÊN QUAN]:\n"
-                        + product_ctx
-                    ),
-                },
-                {"role": "user", "content": user_text},
-            ],
+            model=OPENAI_MODEL,
+            temperature=OPENAI_TEMPERATURE,
+            messages=messages,
         )
-        return (completion.choices[0].message.content or "").strip()
+        metrics.observe("llm_latency_ms", (time.monotonic() - started) * 1000)
+        answer = (completion.choices[0].message.content or "").strip()
+        if answer and cache_key:
+            put_cached_answer(cache_key, answer)
+        return answer
     except Exception as e:
         print("Lỗi gọi OpenAI:", e)
-        return "Hiện hệ thống AI đang bận, anh/chị thử lại sau một chút giúp em nhé."
+        metrics.incr("llm_errors")
+        return LLM_BUSY_REPLY
+    finally:
+        LLM_LANE.release()
+
+
+# ========= TÓM TẮT HỘI THOẠI (NỀN) =========
+# Lượt cũ bị đẩy khỏi history được gộp vào session["summary"] ở luồng nền,
+# không nằm trên đường trả lời; làn LLM bận thì để dành lần sau.
+SUMMARY_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+
+def maybe_summarize(session: dict):
+    job = session.get("summary_job")
+    if job is not None and not job.done():
+        return
+    turns = memory.take_pending(session)
+    if not turns:
+        return
+    session["summary_job"] = SUMMARY_POOL.submit(_summarize, session, turns, session.get("summary") or "")
+
+
+def _summarize(session: dict, turns: list[tuple[str, str]], previous: str):
+    with LLM_LANE.admit(reserve=1, wait=False) as admitted:
+        if not admitted:
+            memory.restore_pending(session, turns)
+            metrics.incr("memory_summary_deferred")
+            return
+        started = time.monotonic()
+        try:
+            completion = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                temperature=0,
+                messages=build_summary_messages(previous, turns),
+            )
+            memory.apply_summary(session, completion.choices[0].message.content or previous)
+            metrics.incr("memory_summaries")
+            metrics.observe("memory_summary_ms", (time.monotonic() - started) * 1000)
+        except Exception as e:
+            print("Lỗi tóm tắt hội thoại:", e)
+            memory.restore_pending(session, turns)
+            metrics.incr("memory_summary_errors")
+
+
+# ========= PREFETCH SUY ĐOÁN (GIAI ĐOẠN CLARIFY) =========
+# Bật SPECULATIVE_PREFETCH=1: khi gửi câu hỏi làm rõ, bot soạn nháp tư vấn combo
+# ở nền; khi TVV trả lời thì dùng luôn nháp hoặc chỉ hỏi thêm phần bổ sung (delta).
+SPECULATIVE_PREFETCH = os.environ.get("SPECULATIVE_PREFETCH", "0") == "1"
+PREFETCH_WAIT_SECONDS = float(os.environ.get("PREFETCH_WAIT_SECONDS", "20"))
+PREFETCH_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PREFETCH_WORKERS", "2")),
+    thread_name_prefix="prefetch",
+)
+
+
+def build_case_prompt(issue: str, extra: str) -> str:
+    return (
+        "Tư vấn viên mô tả case khách như sau.\n"
+        "Mô tả ban đầu: " + issue + "\n\n"
+        "Thông tin bổ sung: " + extra + "\n\n"
+        "Hãy giúp tư vấn viên: (1) tóm tắt lại case, "
+        "(2) gợi ý thêm vài câu hỏi nếu cần, "
+        "(3) gợi ý combo + cách giải thích cho khách, "
+        "(4) gợi ý 1–2 câu chốt.\n"
+        "Nhớ: combo được chọn phải đúng với vấn đề sức khoẻ, và tư vấn viên cần có link từng sản phẩm trong combo (đã có sẵn trong dữ liệu)."
+    )
+
+
+def build_policy_prompt(text: str) -> str:
+    return (
+        "Đây là tư vấn viên đang hỏi về CHÍNH SÁCH hoặc CÁCH XỬ LÝ TỪ CHỐI để tư vấn lại cho khách.\n"
+        "Hãy trả lời như đang training nội bộ: giải thích rõ, sau đó gợi ý 2–3 câu có thể nói với khách.\n\n"
+        f"Câu hỏi/tình huống của tư vấn viên: {text}"
+    )
+
+
+def build_advise_prompt(text: str) -> str:
+    return (
+        "Tư vấn viên đang hỏi thêm về cùng 1 case khách ở trên. "
+        "Hãy tiếp tục hỗ trợ đào sâu (xử lý thắc mắc, từ chối, nhắc lại cách dùng, follow-up...).\n\n"
+        "Câu hỏi bổ sung của tư vấn viên: " + text
+    )
+
+
+def build_delta_prompt(draft: str, extra: str) -> str:
+    return (
+        "Dưới đây là BẢN NHÁP tư vấn đã soạn từ mô tả ban đầu của case khách.\n\n"
+        + draft
+        + "\n\nTư vấn viên vừa bổ sung thông tin: "
+        + extra
+        + "\n\nChỉ viết NGẮN phần cần bổ sung/điều chỉnh so với bản nháp (tối đa 5 bullet), "
+        "không lặp lại nội dung bản nháp."
+    )
+
+
+def _run_draft(prompt: str, session_snapshot: dict, combo: Combo | None) -> tuple[str, float]:
+    started = time.monotonic()
+    text = call_openai_for_answer(prompt, session_snapshot, combo=combo, product=None, background=True)
+    return text, time.monotonic() - started
+
+
+def start_prefetch(session: dict):
+    """Soạn nháp tư vấn combo ở nền ngay khi câu hỏi làm rõ được gửi đi."""
+    drop_prefetch(session)
+    intent = session.get("intent")
+    combo = choose_combo(intent)
+    snapshot = {
+        "intent": intent,
+        "profile": dict(session.get("profile") or {}),
+        # Nháp không trừ token của TVV (có thể bị bỏ); take_prefetch trừ khi nháp thực sự được dùng
+        "user_id": None,
+    }
+    prompt = build_case_prompt(session.get("first_issue") or "", "(chưa có)")
+    session["prefetch"] = {
+        # copy_context: luồng prefetch vẫn biết đang phục vụ bot nào
+        "future": PREFETCH_POOL.submit(contextvars.copy_context().run, _run_draft, prompt, snapshot, combo),
+        "intent": intent,
+    }
+    metrics.incr("prefetch_started")
+
+
+def drop_prefetch(session: dict):
+    """Bỏ nháp chưa dùng (đổi case, /start...) và tính là prefetch lãng phí."""
+    pending = session.pop("prefetch", None)
+    if pending:
+        pending["future"].cancel()
+        metrics.incr("prefetch_wasted")
+
+
+def take_prefetch(session: dict, intent: str | None) -> tuple[str, float] | None:
+    """Lấy nháp đã soạn cho đúng intent hiện tại; None nếu không dùng được."""
+    pending = session.pop("prefetch", None)
+    if not pending:
+        return None
+    if pending["intent"] != intent:
+        pending["future"].cancel()
+        metrics.incr("prefetch_wasted")
+        return None
+
+    if not pending["future"].done() and not BLOCKING_BUDGET.try_block():
+        # Hết suất thread để chờ nháp: bỏ nháp, nhánh gọi LLM (cũng sẽ bị từ chối -> báo bận)
+        pending["future"].cancel()
+        metrics.incr("prefetch_wasted")
+        return None
+    waited_from = time.monotonic()
+    try:
+        draft, duration = pending["future"].result(timeout=PREFETCH_WAIT_SECONDS)
+    except Exception as e:
+        print("Lỗi prefetch:", e)
+        metrics.incr("prefetch_wasted")
+        return None
+    waited = time.monotonic() - waited_from
+
+    if not draft or is_llm_fallback(draft):
+        metrics.incr("prefetch_wasted")
+        return None
+    metrics.observe("prefetch_saved_ms", max(duration - waited, 0) * 1000)
+    charge_user_llm(session.get("user_id"))
+    return draft, waited
+
+
+def is_trivial_followup(text: str) -> bool:
+    """Câu trả lời không thêm thông tin gì mới -> dùng thẳng bản nháp."""
+    return is_no_health_intent(text) or len(normalize_text(text)) < 4
 
 
 # ========= CÂU CHÀO ĐƠN GIẢN =========
@@ -675,32 +1098,492 @@ def greeting_reply_short() -> str:
 
 
 # ========= GỬI TIN =========
-def send_message(chat_id: int, text: str, keyboard=None):
+def send_message(chat_id: int, text: str | tuple[str, ...], keyboard=None) -> int:
+    """
+    text: chuỗi (tự chia nếu quá 4096) hoặc các đoạn đã chia sẵn (render_combo...).
+    Trả về số đoạn Telegram đã nhận (< số đoạn = gửi lỗi giữa chừng).
+    """
+    chunks = split_message(text) if isinstance(text, str) else text
+    tenant = current_tenant()
+    session = tenant.sessions.get(chat_id)
     try:
-        log_event(chat_id, "bot", text, extra={"source": "bot_reply"})
+        # need/intent của session lúc trả lời -> analytics.py thống kê phân bố
+        session = session or {}
+        extra = {"source": "bot_reply", "need": session.get("need"), "intent": session.get("intent")}
+        if has_request_context():
+            extra["branch"] = g.get("branch")       # prewarm.py chỉ làm nóng câu hỏi của nhánh gọi LLM
+        extra.update(bot_meta())
+        log_event(chat_id, "bot", "\n".join(chunks), extra=extra)
     except Exception as e:
         print("Lỗi log bot:", e)
 
-    payload: dict = {
-        "chat_id": chat_id,
-        "text": text,
-        "parse_mode": "Markdown",
-    }
+    if session:
+        memory.add_turn(session, "assistant", "\n".join(chunks))
+        maybe_summarize(session)
+
+    reply_markup = None
     if keyboard:
-        payload["reply_markup"] = {
+        reply_markup = {
             "keyboard": keyboard,
             "resize_keyboard": True,
             "one_time_keyboard": False,
         }
+    # Chờ 429 chiếm thread worker -> chỉ chờ khi còn suất trong BLOCKING_BUDGET
+    delivery = send_chunks(
+        TELEGRAM_HTTP, tenant.api_url, chat_id, chunks,
+        reply_markup=reply_markup, can_wait=BLOCKING_BUDGET.try_block,
+    )
+    if BROADCASTER is not None:
+        BROADCASTER.note_live(tenant.bot_id, delivery.sent)     # broadcast của bot này nhường lượt gửi
+        if delivery.retry_after is not None:
+            BROADCASTER.limiter(tenant.bot_id).pause(delivery.retry_after)  # bot đang bị 429: broadcast dừng theo
+    return delivery.sent
+
+
+# ========= INLINE QUERY (@bot mất ngủ) =========
+# TVV gõ "@bot <vấn đề / tên sản phẩm>" ngay trong chat với khách -> chọn card combo/sản phẩm để gửi.
+# Chỉ dùng chỉ mục tìm kiếm + card dựng sẵn, không gọi LLM. Cần bật inline mode cho bot (BotFather /setinline).
+# Mỗi phím gõ là 1 inline_query: chờ INLINE_DEBOUNCE_SECONDS, nếu người đó đã gõ tiếp thì bỏ query cũ.
+INLINE_MAX_RESULTS = 10
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))     # Telegram cache kết quả theo query
+INLINE_DEBOUNCE_SECONDS = float(os.environ.get("INLINE_DEBOUNCE_SECONDS", "0.25"))
+INLINE_RESULTS_MAX = 1000
+INLINE_CARDS: dict[tuple, dict] = {}
+INLINE_RESULTS: OrderedDict[tuple, list[dict]] = OrderedDict()
+_INLINE_LATEST: dict[tuple, str] = {}       # (bot_id, user_id) -> id query mới nhất
+_INLINE_LOCK = threading.Lock()
+
+
+def _inline_description(text: str) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= 100 else text[:99] + "…"
+
+
+def inline_card(item: Combo | Product) -> dict:
+    """InlineQueryResultArticle dựng 1 lần cho mỗi combo/sản phẩm (theo DATA.version)."""
+    is_combo = isinstance(item, Combo)
+    item_key = catalog_item_key(item)
+    key = (*item_key, DATA.version)
+    card = INLINE_CARDS.get(key)
+    if card is None:
+        chunks = render_combo(item) if is_combo else render_product(item)
+        card = INLINE_CARDS[key] = {
+            "type": "article",
+            "id": hashlib.sha1(":".join(item_key).encode("utf-8")).hexdigest()[:32],
+            "title": item.name if is_combo else f"{item.name} ({item.code})",
+            "description": _inline_description(item.header_text if is_combo else item.benefits or item.price),
+            # card dài quá 1 tin thì chỉ gửi đoạn đầu (đoạn đã chia sẵn theo giới hạn Telegram)
+            "input_message_content": {
+                "message_text": chunks[0],
+                "parse_mode": "Markdown",
+                "disable_web_page_preview": True,
+            },
+        }
+    return card
+
+
+def inline_results(query: str) -> list[dict]:
+    """Combo theo intent (nếu nhận ra) + combo/sản phẩm khớp tên, không trùng, tối đa INLINE_MAX_RESULTS."""
+    norm = normalize_question(query)
+    key = (current_tenant().bot_id, DATA.version, norm)
+    with _INLINE_LOCK:
+        results = INLINE_RESULTS.get(key)
+        if results is not None:
+            INLINE_RESULTS.move_to_end(key)
+            metrics.incr("inline_cache_hits")
+            return results
+
+    data = current_data()
+    if not norm:
+        items: list = list(data.combos[:INLINE_MAX_RESULTS])
+    else:
+        items = [choose_combo(detect_intent_from_text(query))]
+        items += search_combo_by_text(query, top_k=INLINE_MAX_RESULTS)
+        items += search_product_by_text(query, top_k=INLINE_MAX_RESULTS)
+    results, seen = [], set()
+    for item in items:
+        if item is None:
+            continue
+        card = inline_card(item)
+        if card["id"] not in seen:
+            seen.add(card["id"])
+            results.append(card)
+    results = results[:INLINE_MAX_RESULTS]
+
+    with _INLINE_LOCK:
+        INLINE_RESULTS[key] = results
+        while len(INLINE_RESULTS) > INLINE_RESULTS_MAX:
+            INLINE_RESULTS.popitem(last=False)
+    return results
+
+
+def is_superseded(user_key: tuple, query_id: str) -> bool:
+    """Người gõ đã gửi query mới hơn trong lúc chờ debounce -> query này bỏ qua."""
+    with _INLINE_LOCK:
+        if _INLINE_LATEST.get(user_key) != query_id:
+            return True
+        del _INLINE_LATEST[user_key]
+        return False
+
+
+def handle_inline_query(inline_query: dict):
+    started = time.monotonic()
+    tenant = current_tenant()
+    user_key = (tenant.bot_id, (inline_query.get("from") or {}).get("id"))
+    query_id = inline_query["id"]
+    with _INLINE_LOCK:
+        _INLINE_LATEST[user_key] = query_id
+    metrics.incr("inline_queries")
+
+    # Debounce cũng giữ thread: hết suất thì trả lời luôn, không chờ
+    if INLINE_DEBOUNCE_SECONDS and BLOCKING_BUDGET.try_block():
+        time.sleep(INLINE_DEBOUNCE_SECONDS)
+    if is_superseded(user_key, query_id):
+        metrics.incr("inline_superseded")
+        return
+
+    results = inline_results(inline_query.get("query") or "")
+    try:
+        answer_inline_query(TELEGRAM_HTTP, tenant.api_url, query_id, results, INLINE_CACHE_TIME)
+    except Exception as e:
+        print("Lỗi gửi inline answer về Telegram:", e)
+        metrics.incr("inline_failures")
+    metrics.incr("inline_results", len(results))
+    metrics.observe("inline_ms", (time.monotonic() - started) * 1000)
+
+
+# ========= NHẮC FOLLOW-UP =========
+# /nhac 7 ngày gọi lại KH  -> sau 7 ngày bot nhắn lại TVV kèm case + combo của chat lúc tạo nhắc.
+# /nhac -> xem các nhắc đang chờ; /huynhac <id> -> huỷ. Lưu bền + lịch gửi: xem reminders.py.
+# Store/scheduler tạo trong install_lifecycle (mỗi worker 1 kết nối SQLite, không dùng chung qua fork).
+REMINDERS_DB_PATH = Path(os.environ.get("REMINDERS_DB_PATH", str(DATA_DIR / "reminders.sqlite")))
+REMINDER_TZ = timezone(timedelta(hours=float(os.environ.get("REMINDER_UTC_OFFSET_HOURS", "7"))))
+REMINDER_UNITS = {
+    "phút": 60, "phut": 60, "p": 60,
+    "giờ": 3600, "gio": 3600, "h": 3600,
+    "ngày": 86400, "ngay": 86400, "d": 86400,
+    "tuần": 7 * 86400, "tuan": 7 * 86400, "w": 7 * 86400,
+}
+REMINDER_MAX_SECONDS = 180 * 86400
+REMINDER_RE = re.compile(r"^(\d+)\s*([^\W\d_]+)\s*(.*)$", re.S)
+REMINDER_USAGE = (
+    "Cú pháp nhắc follow-up:\n"
+    "- `/nhac 7 ngày gọi lại KH` (đơn vị: phút, giờ, ngày, tuần)\n"
+    "- `/nhac` để xem các nhắc đang chờ, `/huynhac <số>` để huỷ."
+)
+REMINDER_STORE: ReminderStore | None = None
+REMINDER_SCHEDULER: Scheduler | None = None
+
+
+def format_reminder_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts, REMINDER_TZ).strftime("%H:%M %d/%m/%Y")
+
+
+def parse_reminder(args: str) -> tuple[int, str] | None:
+    """"7 ngày gọi lại KH" -> (giây, ghi chú); None nếu sai cú pháp / quá xa."""
+    m = REMINDER_RE.match(args.strip())
+    if not m:
+        return None
+    unit = REMINDER_UNITS.get(m.group(2).lower())
+    if unit is None:
+        return None
+    seconds = int(m.group(1)) * unit
+    if not 0 < seconds <= REMINDER_MAX_SECONDS:
+        return None
+    return seconds, m.group(3).strip()
+
+
+def handle_reminder_command(chat_id: int, user_id, session: dict, text: str):
+    if REMINDER_STORE is None or REMINDER_SCHEDULER is None:
+        send_message(chat_id, "Chức năng nhắc follow-up hiện chưa bật ạ.")
+        return
+    bot_id = current_tenant().bot_id
+    command, _, args = text.partition(" ")
+    command = command.split("@", 1)[0].lower()
+
+    if command == "/huynhac":
+        try:
+            rid = int(args.strip().lstrip("#"))
+        except ValueError:
+            send_message(chat_id, REMINDER_USAGE)
+            return
+        ok = REMINDER_STORE.cancel(rid, bot_id, chat_id)
+        send_message(chat_id, f"Đã huỷ nhắc #{rid}." if ok else f"Không tìm thấy nhắc #{rid} đang chờ.")
+        return
+
+    pending = REMINDER_STORE.pending_for_chat(bot_id, chat_id)
+    if not args.strip():
+        if not pending:
+            send_message(chat_id, "Chưa có nhắc follow-up nào đang chờ.\n\n" + REMINDER_USAGE)
+            return
+        lines = ["*Các nhắc follow-up đang chờ:*"]
+        for r in pending:
+            lines.append(f"#{r.id} – {format_reminder_time(r.due_ts)}: {r.note or r.case_text or 'follow-up'}")
+        send_message(chat_id, "\n".join(lines))
+        return
+
+    parsed = parse_reminder(args)
+    if parsed is None:
+        send_message(chat_id, REMINDER_USAGE)
+        return
+    if len(pending) >= MAX_PENDING_PER_CHAT:
+        send_message(chat_id, "Chat này đã có quá nhiều nhắc đang chờ, anh/chị huỷ bớt (`/huynhac <số>`) giúp em nhé.")
+        return
+
+    seconds, note = parsed
+    combo = session.get("last_combo")
+    now = REMINDER_SCHEDULER.clock()
+    reminder = REMINDER_STORE.add(
+        bot_id,
+        chat_id,
+        user_id,
+        now + seconds,
+        note=note,
+        case_text=session.get("first_issue"),
+        combo=combo.name if combo else None,
+        intent=session.get("intent"),
+        now=now,
+    )
+    REMINDER_SCHEDULER.schedule(reminder)
+    metrics.incr("reminders_created")
+    send_message(chat_id, f"Đã hẹn nhắc #{reminder.id} lúc {format_reminder_time(reminder.due_ts)} ✅")
+
+
+def format_reminder_message(reminder: Reminder) -> str:
+    lines = ["⏰ *Nhắc follow-up khách hàng*"]
+    if reminder.note:
+        lines.append(f"- Ghi chú: {reminder.note}")
+    if reminder.case_text:
+        lines.append(f"- Case: {reminder.case_text}")
+    if reminder.combo:
+        lines.append(f"- Combo đã tư vấn: {reminder.combo}")
+    lines.append("Anh/chị hỏi thăm tình trạng KH, cách dùng sản phẩm và nhu cầu tiếp theo nhé. Cần kịch bản thì nhắn em ạ.")
+    return "\n".join(lines)
+
 
+def fire_reminder(reminder: Reminder) -> bool:
+    """False = Telegram không nhận đủ tin -> scheduler hẹn gửi lại (reminders.RETRY_DELAYS)."""
+    tenant = TENANTS.get(reminder.bot_id)
+    if tenant is None:
+        print(f"Nhắc #{reminder.id}: bot {reminder.bot_id} không còn cấu hình, bỏ qua")
+        return True
+    token = CURRENT_TENANT.set(tenant)
     try:
-        requests.post(
-            f"{TELEGRAM_API_URL}/sendMessage",
-            json=payload,
-            timeout=10,
-        )
+        chunks = split_message(format_reminder_message(reminder))
+        if send_message(reminder.chat_id, chunks) < len(chunks):
+            metrics.incr("reminders_failed")
+            return False
+        metrics.incr("reminders_fired")
+        return True
+    finally:
+        CURRENT_TENANT.reset(token)
+
+
+def start_reminders():
+    global REMINDER_STORE, REMINDER_SCHEDULER
+    try:
+        REMINDER_STORE = ReminderStore(REMINDERS_DB_PATH)
+    except Exception as e:
+        print("Không mở được DB nhắc follow-up:", e)
+        return
+    REMINDER_SCHEDULER = Scheduler(REMINDER_STORE, fire_reminder)
+    REMINDER_SCHEDULER.start()
+
+
+# ========= BROADCAST TỚI TVV =========
+# Thông báo đổi catalog / chính sách tới mọi TVV (hoặc 1 nhóm theo last_seen / nhu cầu chính),
+# qua /admin/broadcast. Job lưu bền + gửi giới hạn tốc độ: xem broadcast.py.
+BROADCASTS_DB_PATH = Path(os.environ.get("BROADCASTS_DB_PATH", str(DATA_DIR / "broadcasts.sqlite")))
+BROADCAST_RATE_PER_SECOND = float(os.environ.get("BROADCAST_RATE_PER_SECOND", "25"))
+BROADCAST_SEGMENT_KEYS = ("last_seen_from", "last_seen_to", "need", "intent", "min_messages", "max_messages")
+BROADCAST_STORE: BroadcastStore | None = None
+BROADCASTER: Broadcaster | None = None
+
+
+def broadcast_recipients(tenant: Tenant, segment: dict) -> list[int]:
+    """chat_id (= telegram_id, chat riêng với bot) của các TVV khớp bộ lọc, đi theo chỉ mục hồ sơ."""
+    chat_ids, cursor = [], None
+    while True:
+        uids, cursor = tenant.profile_index.query(EXPORT_PAGE_MAX, cursor=cursor, **segment)
+        for uid in uids:
+            profile = tenant.users_store.get(uid)
+            if profile and profile.get("telegram_id") is not None:
+                chat_ids.append(int(profile["telegram_id"]))
+        if not cursor:
+            return chat_ids
+
+
+def send_broadcast_message(bot_id: str, chat_id: int, text: str) -> SendResult:
+    tenant = TENANTS.get(bot_id)
+    if tenant is None:
+        return SendResult(False, 404, f"bot {bot_id} không còn cấu hình")
+    started = time.monotonic()
+    result = post_message(TELEGRAM_HTTP, tenant.api_url, chat_id, text)
+    metrics.observe("broadcast_send_ms", (time.monotonic() - started) * 1000)
+    return result
+
+
+def _broadcast_resume_loop():
+    # Job "running" chưa có ai chạy (restart, worker cũ chết khi còn giữ lease) -> nhận chạy tiếp
+    while True:
+        resumed = BROADCASTER.resume_all()
+        if resumed:
+            print("Chạy tiếp broadcast:", resumed)
+        if DRAINING.wait(LEASE_SECONDS):
+            return
+
+
+def start_broadcasts():
+    global BROADCAST_STORE, BROADCASTER
+    try:
+        BROADCAST_STORE = BroadcastStore(BROADCASTS_DB_PATH)
     except Exception as e:
-        print("Lỗi gửi message về Telegram:", e)
+        print("Không mở được DB broadcast:", e)
+        return
+    BROADCASTER = Broadcaster(BROADCAST_STORE, send_broadcast_message, rate=BROADCAST_RATE_PER_SECOND)
+    threading.Thread(target=_broadcast_resume_loop, name="broadcast-resume", daemon=True).start()
+
+
+# ========= WARM-UP & SHUTDOWN =========
+# Sau cold start: dựng sẵn chỉ mục/cache + mở trước kết nối TLS, /ready chỉ báo sẵn sàng khi xong.
+# SIGTERM (redeploy): ngừng nhận update (503 -> Telegram gửi lại sau), huỷ prefetch, flush hồ sơ + log.
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "1") == "1"
+# Chạy dưới gunicorn.conf.py (preload): master chỉ dựng data, thread/kết nối tạo trong worker (init_worker)
+PRELOAD_APP = os.environ.get("PRELOAD_APP", "0") == "1"
+READY = threading.Event()
+DRAINING = threading.Event()
+_SHUTDOWN_DONE = threading.Event()
+
+
+def warm_data():
+    """Dựng sẵn card + chỉ mục (không cần mạng). Preload: chạy ở master để mọi worker dùng chung."""
+    try:
+        data = current_data()
+        for combo in data.combos:
+            render_combo(combo)
+        for prod in data.products:
+            render_product(prod)
+        match_product_or_combo("combo")
+        detect_intent_from_text("khởi động")
+        for item in (*data.combos, *data.products):
+            inline_card(item)
+    except Exception as e:
+        print("Lỗi warm-up data:", e)
+
+
+def warm_up():
+    started = time.monotonic()
+    warm_data()
+    for tenant in TENANTS.values():
+        try:
+            TELEGRAM_HTTP.get(f"{tenant.api_url}/getMe", timeout=5)
+        except Exception as e:
+            print(f"Warm-up: bot {tenant.bot_id} không mở được kết nối Telegram:", e)
+    try:
+        client.with_options(timeout=5, max_retries=0).models.list()
+    except Exception as e:
+        print("Warm-up: không mở được kết nối OpenAI:", e)
+
+    metrics.observe("warmup_ms", (time.monotonic() - started) * 1000)
+    READY.set()
+
+
+# Sau warm-up: làm nóng cache câu trả lời bằng các câu hỏi hay gặp trong log gần đây.
+# Chỉ gọi LLM khi làn llm rảnh, cách nhau PREWARM_INTERVAL_SECONDS -> không tranh với TVV thật.
+PREWARM_ON_START = os.environ.get("PREWARM_ON_START", "1") == "1"
+PREWARM_LIMIT = int(os.environ.get("PREWARM_LIMIT", "30"))
+PREWARM_INTERVAL_SECONDS = float(os.environ.get("PREWARM_INTERVAL_SECONDS", "3"))
+
+# Nhánh (g.branch trong meta log) gọi LLM với câu lệnh chỉ phụ thuộc câu hỏi + intent
+# -> (câu hỏi, intent) dựng lại đúng (prompt, combo) mà nhánh đó gửi. Nhánh clarify không có ở đây:
+# câu lệnh của nó gồm cả mô tả case ở tin trước.
+PREWARM_PROMPTS = {
+    "policy": lambda q, intent: (build_policy_prompt(q), None),
+    "health_advise": lambda q, intent: (build_advise_prompt(q), choose_combo(intent)),
+    "health_fallback": lambda q, intent: (q, choose_combo(intent)),
+    "fallback": lambda q, intent: (q, choose_combo(intent)),
+}
+
+
+def prewarm_answers():
+    READY.wait()
+    questions = top_questions(read_tail(CONV_LOG_PATH), branches=set(PREWARM_PROMPTS), limit=PREWARM_LIMIT)
+    for _, intent, branch, question, _ in questions:
+        if DRAINING.wait(PREWARM_INTERVAL_SECONDS):
+            return
+        while LLM_LANE.active or LLM_LANE.waiting:
+            if DRAINING.wait(PREWARM_INTERVAL_SECONDS):
+                return
+
+        session = {"intent": intent, "profile": {}}
+        prompt, combo = PREWARM_PROMPTS[branch](question, intent)
+        if get_cached_answer(answer_cache_key(prompt, session, combo, None)):
+            continue
+        answer = call_openai_for_answer(prompt, session, combo=combo, product=None, background=True)
+        metrics.incr("prewarm_skipped" if is_llm_fallback(answer) else "prewarm_answers")
+
+
+def _flush_loop():
+    while not DRAINING.wait(USERS_FLUSH_SECONDS):
+        flush_users_store()
+        flush_log()
+
+
+def shutdown():
+    """Gọi 1 lần khi tiến trình dừng: xử lý nốt việc đang dở rồi flush."""
+    if _SHUTDOWN_DONE.is_set():
+        return
+    _SHUTDOWN_DONE.set()
+    DRAINING.set()
+    READY.clear()
+    PREFETCH_POOL.shutdown(wait=False, cancel_futures=True)
+    SUMMARY_POOL.shutdown(wait=False, cancel_futures=True)
+    if REMINDER_SCHEDULER is not None:
+        REMINDER_SCHEDULER.stop()
+    if BROADCASTER is not None:
+        BROADCASTER.stop()
+    flush_users_store()
+    flush_log()
+    print("Đã flush hồ sơ + log, dừng bot.")
+
+
+def _on_sigterm(signum, frame, previous=None):
+    # Flask/gunicorn vẫn chờ các request đang chạy xong; ta chỉ chặn update mới
+    DRAINING.set()
+    READY.clear()
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        shutdown()
+        raise SystemExit(0)
+
+
+def install_lifecycle():
+    if threading.current_thread() is threading.main_thread():
+        previous = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, lambda signum, frame: _on_sigterm(signum, frame, previous))
+    atexit.register(shutdown)
+    threading.Thread(target=_flush_loop, name="flush", daemon=True).start()
+    start_reminders()
+    start_broadcasts()
+    if WARMUP_ON_START:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    else:
+        READY.set()
+    if PREWARM_ON_START:
+        threading.Thread(target=prewarm_answers, name="prewarm", daemon=True).start()
+
+
+def init_worker():
+    """
+    Preload: gọi 1 lần trong mỗi worker sau khi fork (gunicorn post_worker_init).
+    Pool kết nối/file log kế thừa từ master không được dùng chung giữa các tiến trình -> tạo lại.
+    """
+    global TELEGRAM_HTTP, client, _LOG_FILE
+    TELEGRAM_HTTP = make_http_session()
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    _LOG_FILE = None
+    install_lifecycle()
 
 
 # ========= ROUTES =========
@@ -709,15 +1592,286 @@ def index():
     return "Bot is running.", 200
 
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
+@app.route("/ready", methods=["GET"])
+def ready():
+    if READY.is_set() and not DRAINING.is_set():
+        return {"ready": True}, 200
+    return {"ready": False, "draining": DRAINING.is_set()}, 503
+
+
+def is_admin_request() -> bool:
+    token = request.headers.get("X-Admin-Token") or request.args.get("token")
+    return bool(ADMIN_TOKEN) and token == ADMIN_TOKEN
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_view():
+    if not is_admin_request():
+        return "forbidden", 403
+    snapshot = metrics.snapshot()
+    snapshot["process"] = {"pid": os.getpid(), **process_memory()}
+    return snapshot, 200
+
+
+def reload_data():
+    """Nạp lại data/*.json + coaching sinh sẵn mà không cần restart."""
+    global DATA, COACHING_CACHE
+    DATA = load_catalog(DATA_DIR)
+    for tenant in TENANTS.values():
+        tenant.refresh_data(DATA)
+    COACHING_CACHE = load_coaching_cache()
+    RENDER_CACHE.clear()
+    INLINE_CARDS.clear()
+    with _INLINE_LOCK:
+        INLINE_RESULTS.clear()
+    metrics.incr("data_reloads")
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    if not is_admin_request():
+        return "forbidden", 403
+    reload_data()
+    return {"version": DATA.version, "problems": len(DATA.problems)}, 200
+
+
+EXPORT_PAGE_DEFAULT = 500
+EXPORT_PAGE_MAX = 5000
+EXPORT_COLUMNS = (
+    "telegram_id", "name", "username", "first_seen", "last_seen",
+    "total_messages", "top_need", "top_intent", "main_needs", "intents_count",
+)
+
+
+def export_row(profile: dict) -> dict:
+    # Chụp dưới khoá: luồng xử lý tin có thể đang cộng main_needs / intents_count
+    with _USERS_LOCK:
+        return {
+            "telegram_id": profile.get("telegram_id"),
+            "name": profile.get("name") or "",
+            "username": profile.get("username") or "",
+            "first_seen": profile.get("first_seen") or "",
+            "last_seen": profile.get("last_seen") or "",
+            "total_messages": int(profile.get("total_messages") or 0),
+            "top_need": top_key(profile.get("main_needs")),
+            "top_intent": top_key(profile.get("intents_count")),
+            "main_needs": dict(profile.get("main_needs") or {}),
+            "intents_count": dict(profile.get("intents_count") or {}),
+        }
+
+
+@app.route("/admin/users", methods=["GET"])
+def admin_users():
+    """
+    Export hồ sơ theo trang (thứ tự last_seen tăng dần), stream NDJSON (mặc định) hoặc CSV.
+    ?format=ndjson|csv&limit=500&cursor=...&bot=default
+    &last_seen_from=2025-01-01&last_seen_to=2025-01-31&min_messages=&max_messages=&need=&intent=
+    Trang sau: lấy header X-Next-Cursor (không có = hết).
+    """
+    if not is_admin_request():
+        return "forbidden", 403
+    args = request.args
+    tenant = TENANTS.get(args.get("bot", DEFAULT_BOT_ID))
+    if tenant is None:
+        return {"error": "bot không tồn tại"}, 404
+    fmt = args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return {"error": "format phải là ndjson hoặc csv"}, 400
+    try:
+        limit = min(int(args.get("limit", EXPORT_PAGE_DEFAULT)), EXPORT_PAGE_MAX)
+        min_messages = int(args["min_messages"]) if args.get("min_messages") else None
+        max_messages = int(args["max_messages"]) if args.get("max_messages") else None
+        uids, next_cursor = tenant.profile_index.query(
+            max(limit, 1),
+            cursor=args.get("cursor") or None,
+            last_seen_from=args.get("last_seen_from") or None,
+            last_seen_to=args.get("last_seen_to") or None,
+            min_messages=min_messages,
+            max_messages=max_messages,
+            need=args.get("need") or None,
+            intent=args.get("intent") or None,
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    store = tenant.users_store
+
+    def ndjson_rows():
+        for uid in uids:
+            profile = store.get(uid)
+            if profile is not None:
+                yield json.dumps(export_row(profile), ensure_ascii=False) + "\n"
+
+    def csv_rows():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        yield buf.getvalue()
+        for uid in uids:
+            buf.seek(0)
+            buf.truncate()
+            profile = store.get(uid)
+            if profile is None:
+                continue
+            row = export_row(profile)
+            row["main_needs"] = json.dumps(row["main_needs"], ensure_ascii=False)
+            row["intents_count"] = json.dumps(row["intents_count"], ensure_ascii=False)
+            writer.writerow(row)
+            yield buf.getvalue()
+
+    rows = csv_rows() if fmt == "csv" else ndjson_rows()
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """
+    POST ?requests=N&seconds=T&mode=cprofile|sample&memory=1 -> bật profile cho N request kế tiếp / T giây.
+    GET -> báo cáo phiên gần nhất (pstats hoặc collapsed stack + top cấp phát, theo nhánh webhook).
+    """
+    if not is_admin_request():
+        return "forbidden", 403
+    if request.method == "POST":
+        mode = request.args.get("mode", "cprofile")
+        if mode not in ("cprofile", "sample"):
+            return {"error": "mode phải là cprofile hoặc sample"}, 400
+        try:
+            max_requests = int(request.args.get("requests", "50"))
+            seconds = float(request.args.get("seconds", "60"))
+        except ValueError:
+            return {"error": "requests/seconds không hợp lệ"}, 400
+        profiler.start(max_requests, seconds, mode=mode, memory=request.args.get("memory") == "1")
+        return {"started": True, "requests": max_requests, "seconds": seconds, "mode": mode}, 200
+
+    if profiler.LAST is None:
+        return {"active": False, "branches": {}}, 200
+    return profiler.LAST.report(), 200
+
+
+@app.route("/admin/broadcast", methods=["GET", "POST"])
+def admin_broadcast():
+    """
+    POST JSON {"text": "...", "bot": "default", "last_seen_from": "2025-01-01", "last_seen_to": "...",
+               "need": "health", "intent": "...", "min_messages": 5, "dry_run": true}
+      -> tạo job gửi tới các TVV khớp bộ lọc (dry_run: chỉ đếm số người nhận).
+    GET -> các job gần nhất kèm tiến độ.
+    """
+    if not is_admin_request():
+        return "forbidden", 403
+    if BROADCAST_STORE is None or BROADCASTER is None:
+        return {"error": "broadcast chưa bật"}, 503
+    if request.method == "GET":
+        now = time.time()
+        return {"jobs": [progress(job, now) for job in BROADCAST_STORE.jobs()]}, 200
+
+    body = request.get_json(force=True, silent=True) or {}
+    text = str(body.get("text") or "").strip()
+    if not text:
+        return {"error": "thiếu text"}, 400
+    tenant = TENANTS.get(body.get("bot") or DEFAULT_BOT_ID)
+    if tenant is None:
+        return {"error": "bot không tồn tại"}, 404
+    segment = {k: body[k] for k in BROADCAST_SEGMENT_KEYS if body.get(k) not in (None, "")}
+    try:
+        for key in ("min_messages", "max_messages"):
+            if key in segment:
+                segment[key] = int(segment[key])
+        chat_ids = broadcast_recipients(tenant, segment)
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 400
+    if body.get("dry_run"):
+        return {"dry_run": True, "recipients": len(chat_ids), "segment": segment}, 200
+
+    job_id = BROADCAST_STORE.create(tenant.bot_id, text, segment, chat_ids, time.time())
+    BROADCASTER.start(job_id)
+    metrics.incr("broadcast_jobs")
+    return progress(BROADCAST_STORE.get(job_id), time.time()), 201
+
+
+@app.route("/admin/broadcast/<int:job_id>", methods=["GET"])
+@app.route("/admin/broadcast/<int:job_id>/<action>", methods=["POST"])
+def admin_broadcast_job(job_id: int, action: str | None = None):
+    """GET -> tiến độ job; POST .../pause | resume | cancel."""
+    if not is_admin_request():
+        return "forbidden", 403
+    if BROADCAST_STORE is None or BROADCASTER is None:
+        return {"error": "broadcast chưa bật"}, 503
+    if BROADCAST_STORE.get(job_id) is None:
+        return {"error": "job không tồn tại"}, 404
+
+    if action == "pause":
+        BROADCAST_STORE.set_status(job_id, "paused")
+        BROADCASTER.stop(job_id)
+    elif action == "resume":
+        if BROADCAST_STORE.set_status(job_id, "running"):
+            BROADCASTER.start(job_id)
+    elif action == "cancel":
+        BROADCAST_STORE.set_status(job_id, "cancelled", time.time())
+        BROADCASTER.stop(job_id)
+    elif action is not None:
+        return {"error": "action phải là pause, resume hoặc cancel"}, 400
+    return progress(BROADCAST_STORE.get(job_id), time.time()), 200
+
+
+@app.route("/webhook", methods=["POST"], defaults={"bot_id": DEFAULT_BOT_ID})
+@app.route("/webhook/<bot_id>", methods=["POST"])
+def webhook(bot_id: str):
+    tenant = TENANTS.get(bot_id)
+    if tenant is None:
+        return "unknown bot", 404
+    if tenant.secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != tenant.secret_token:
+        return "forbidden", 403
+    if DRAINING.is_set():
+        # Telegram sẽ gửi lại update này cho tiến trình mới
+        return "shutting down", 503
+
+    token = CURRENT_TENANT.set(tenant)
+    try:
+        with BLOCKING_BUDGET.scope():
+            return handle_update(tenant)
+    finally:
+        CURRENT_TENANT.reset(token)
+
+
+def handle_update(tenant: Tenant):
+
     update = request.get_json(force=True, silent=True) or {}
     print("Update:", update)
 
+    inline_query = update.get("inline_query")
+    if inline_query:
+        with FAST_LANE.admit():
+            g.branch = "inline"
+            handle_inline_query(inline_query)
+        return "ok", 200
+
     message = update.get("message")
     if not message:
         return "no message", 200
 
+    # Mọi update vào làn fast; chỉ đoạn gọi OpenAI mới chiếm làn llm
+    with FAST_LANE.admit():
+        started = time.monotonic()
+        chat_id = message["chat"]["id"]
+        chat_key = (tenant.bot_id, chat_id)
+        with chat_lock(chat_key, CHAT_MAX_WAITING, CHAT_WAIT_TIMEOUT, BLOCKING_BUDGET.try_block) as ok:
+            metrics.observe("chat_lock_wait_ms", (time.monotonic() - started) * 1000)
+            if not ok:
+                # Chat đã có đủ update đang chờ / hết suất thread để chờ: báo bận thay vì xếp hàng
+                g.branch = "chat_busy"
+                metrics.incr("chat_lock_shed")
+                send_message(chat_id, CHAT_BUSY_REPLY)
+                return "ok", 200
+            g.branch = "unknown"            # handle_message ghi lại nhánh đã xử lý
+            handled_at = time.monotonic()
+            result = profiler.profiled(lambda: handle_message(message), lambda: g.branch)
+            metrics.observe("webhook_ms", (time.monotonic() - handled_at) * 1000, branch=g.branch)
+            return result
+
+
+def handle_message(message: dict):
     chat_id = message["chat"]["id"]
     text = message.get("text") or ""
     text_stripped = text.strip()
@@ -730,13 +1884,19 @@ def webhook():
         user_id,
         "user",
         text_stripped,
-        extra={"username": profile.get("username"), "name": profile.get("name")},
+        # chat_id: prewarm.py ghép tin TVV với tin bot trả lời theo chat (nhóm: chat_id != user_id)
+        extra={"username": profile.get("username"), "name": profile.get("name"), "chat_id": chat_id, **bot_meta()},
     )
 
     session = get_session(chat_id)
+    session["user_id"] = user_id
+    if not text_stripped.startswith("/"):
+        memory.add_turn(session, "user", text_stripped)
 
     # ----- LỆNH CƠ BẢN -----
+    g.branch = "command"
     if text_stripped.startswith("/start"):
+        drop_prefetch(session)
         session["mode"] = "tvv"
         session["intent"] = None
         session["profile"] = {}
@@ -745,6 +1905,7 @@ def webhook():
         session["need"] = None
         session["last_combo"] = None
         session["last_product"] = None
+        memory.reset(session)
 
         send_message(
             chat_id,
@@ -753,6 +1914,10 @@ def webhook():
         )
         return "ok", 200
 
+    if text_stripped.lower().startswith(("/nhac", "/huynhac")):
+        handle_reminder_command(chat_id, user_id, session, text_stripped)
+        return "ok", 200
+
     if text_stripped.lower() == "/tvv":
         session["mode"] = "tvv"
         send_message(
@@ -772,7 +1937,9 @@ def webhook():
         return "ok", 200
 
     # ----- MENU NHANH -----
+    g.branch = "menu"
     if "Phân tích case khách" in text_stripped:
+        drop_prefetch(session)
         session["need"] = "health"
         session["stage"] = "start"
         session["intent"] = None
@@ -789,6 +1956,7 @@ def webhook():
         return "ok", 200
 
     if "Hỏi combo / sản phẩm" in text_stripped:
+        drop_prefetch(session)
         session["need"] = "product"
         session["stage"] = "product_clarify"
         session["intent"] = None
@@ -804,6 +1972,7 @@ def webhook():
         return "ok", 200
 
     if "Chính sách & xử lý từ chối" in text_stripped:
+        drop_prefetch(session)
         session["need"] = "policy"
         session["stage"] = "start"
         session["intent"] = None
@@ -819,6 +1988,7 @@ def webhook():
         return "ok", 200
 
     # ----- CHÀO HỎI -----
+    g.branch = "greeting"
     if is_simple_greeting(text_stripped):
         if not session.get("need"):
             session["stage"] = "await_need"
@@ -832,7 +2002,9 @@ def webhook():
         return "ok", 200
 
     # ----- NÓI “KHÔNG CÓ VẤN ĐỀ SỨC KHOẺ” -----
+    g.branch = "no_health"
     if is_no_health_intent(text_stripped):
+        drop_prefetch(session)
         session["need"] = "other"
         session["intent"] = None
         session["stage"] = "start"
@@ -856,6 +2028,7 @@ def webhook():
         session["profile"] = {**session.get("profile", {}), **prof_update}
 
     # ----- FAQ / OBJECTION (KHÔNG TỐN TOKEN) -----
+    g.branch = "faq"
     faq_answer = try_answer_faq(text_stripped)
     if faq_answer:
         send_message(chat_id, faq_answer)
@@ -864,6 +2037,7 @@ def webhook():
         touch_user_stats(profile, need=need_auto, intent=None)
         return "ok", 200
 
+    g.branch = "objection"
     obj_answer = try_answer_objection(text_stripped)
     if obj_answer:
         send_message(chat_id, obj_answer)
@@ -937,20 +2111,21 @@ def webhook():
     need = session.get("need") or "other"
 
     # ====== NHÁNH CHÍNH SÁCH ======
+    g.branch = "policy"
     if need == "policy":
         faq_answer = try_answer_faq(text_stripped)
         if faq_answer:
+            g.branch = "policy_faq"
             send_message(chat_id, faq_answer)
             touch_user_stats(profile, need=need, intent=None)
             return "ok", 200
 
         reply = call_openai_for_answer(
-            "Đây là tư vấn viên đang hỏi về CHÍNH SÁCH hoặc CÁCH XỬ LÝ TỪ CHỐI để tư vấn lại cho khách.\n"
-            "Hãy trả lời như đang training nội bộ: giải thích rõ, sau đó gợi ý 2–3 câu có thể nói với khách.\n\n"
-            f"Câu hỏi/tình huống của tư vấn viên: {text_stripped}",
+            build_policy_prompt(text_stripped),
             session,
             combo=None,
             product=None,
+            with_history=True,
         )
         send_message(chat_id, reply)
         touch_user_stats(profile, need=need, intent=None)
@@ -962,13 +2137,16 @@ def webhook():
         last_product = session.get("last_product")
 
         # 0. Hỏi link của sản phẩm gần nhất
+        g.branch = "product_link"
         if last_product and any(
             kw in lower for kw in ["link", "đường link", "duong link", "url", "website", "trang web"]
         ):
-            link = last_product.get("link", "")
-            base = format_product_for_tvv(last_product)
+            link = last_product.url
+            base = render_product(last_product)
             if not link:
-                base += "\n\n(Sản phẩm này hiện chưa có link trong dữ liệu nội bộ.)"
+                base = join_chunks(
+                    [base, ("(Sản phẩm này hiện chưa có link trong dữ liệu nội bộ.)",)], "\n\n"
+                )
             send_message(chat_id, base)
             touch_user_stats(profile, need=need, intent=session.get("intent"))
             return "ok", 200
@@ -977,55 +2155,50 @@ def webhook():
         if last_combo and any(
             kw in lower for kw in ["link", "đường link", "duong link", "url", "website", "trang web"]
         ):
-            combo_text = format_combo_for_tvv(last_combo)
-            send_message(chat_id, combo_text)
+            send_message(chat_id, render_combo(last_combo))
             touch_user_stats(profile, need=need, intent=session.get("intent"))
             return "ok", 200
 
         # 2. TVV gõ tên / mã sản phẩm cụ thể
-        prod_matches = search_product_by_text(text_stripped, top_k=1)
-        if prod_matches:
-            prod = prod_matches[0]
+        g.branch = "product_info"
+        prod, combo = match_product_or_combo(text_stripped)
+        if prod:
             session["last_product"] = prod
             session["intent"] = "product_info"
 
-            info_block = format_product_for_tvv(prod)
+            info_block = render_product(prod)
             coach_block = call_openai_for_answer(
-                "Tư vấn viên đang hỏi về *một sản phẩm cụ thể* dưới đây.\n"
-                "Hãy hướng dẫn cách GIẢI THÍCH đơn giản cho khách (đối tượng dùng, lợi ích chính, cách dùng), "
-                "và gợi ý 1–2 câu chốt đơn mềm, không lặp lại toàn bộ thông tin chi tiết y nguyên.\n",
-                session,
+                PRODUCT_COACH_PROMPT,
+                coaching_session(session, PRODUCT_SESSION),
                 combo=None,
                 product=prod,
             )
-            final_reply = info_block + "\n\n---\n" + coach_block
+            final_reply = with_coaching(info_block, coach_block)
             send_message(chat_id, final_reply)
             touch_user_stats(profile, need=need, intent=session.get("intent"))
             return "ok", 200
 
         # 3. TVV gõ tên combo / bộ sản phẩm cụ thể
-        matches = search_combo_by_text(text_stripped, top_k=1)
-        if matches:
-            combo = matches[0]
+        g.branch = "product_combo"
+        if combo:
             session["last_combo"] = combo
             if not session.get("intent"):
                 session["intent"] = "product_combo"
 
-            combo_info = format_combo_for_tvv(combo)
+            combo_info = render_combo(combo)
             coach_block = call_openai_for_answer(
-                "Tư vấn viên đang hỏi về *một combo/bộ sản phẩm cụ thể*.\n"
-                "Hãy hướng dẫn cách giải thích cho khách: vấn đề sức khoẻ nào phù hợp, "
-                "ưu điểm của combo, cách dùng tổng quát, và gợi ý 1–2 câu chốt.\n",
-                session,
+                COMBO_COACH_PROMPT,
+                coaching_session(session, COMBO_SESSION),
                 combo=combo,
                 product=None,
             )
-            final_reply = combo_info + "\n\n---\n" + coach_block
+            final_reply = with_coaching(combo_info, coach_block)
             send_message(chat_id, final_reply)
             touch_user_stats(profile, need=need, intent=session.get("intent"))
             return "ok", 200
 
         # 4. Không nhận diện được -> hỏi rõ thêm
+        g.branch = "product_clarify"
         session["stage"] = "product_clarify"
         ask = (
             "Để em hỗ trợ đúng hơn, anh/chị cho em biết:\n"
@@ -1038,6 +2211,7 @@ def webhook():
         return "ok", 200
 
     # ====== OTHER (CHƯA RÕ) ======
+    g.branch = "other"
     if need == "other" and not detect_intent_from_text(text_stripped):
         reply = (
             "Anh/chị đang muốn:\n"
@@ -1062,34 +2236,40 @@ def webhook():
         touch_user_stats(profile, need=need, intent=intent)
 
         # 1. ĐANG CLARIFY -> coi đây là thông tin bổ sung, tư vấn combo
+        g.branch = "health_clarify"
         if stage == "clarify":
             issue = session.get("first_issue") or ""
             if not issue:
                 session["first_issue"] = text_stripped
                 issue = text_stripped
 
-            combined_user_text = (
-                "Tư vấn viên mô tả case khách như sau.\n"
-                "Mô tả ban đầu: " + issue + "\n\n"
-                "Thông tin bổ sung: " + text_stripped + "\n\n"
-                "Hãy giúp tư vấn viên: (1) tóm tắt lại case, "
-                "(2) gợi ý thêm vài câu hỏi nếu cần, "
-                "(3) gợi ý combo + cách giải thích cho khách, "
-                "(4) gợi ý 1–2 câu chốt.\n"
-                "Nhớ: combo được chọn phải đúng với vấn đề sức khoẻ, và tư vấn viên cần có link từng sản phẩm trong combo (đã có sẵn trong dữ liệu)."
-            )
-
             combo = choose_combo(intent)
             session["last_combo"] = combo
             session["stage"] = "advise"
 
-            combo_info = format_combo_for_tvv(combo) if combo else "Hiện chưa map được combo rõ ràng cho case này."
-            coach_block = call_openai_for_answer(combined_user_text, session, combo=combo, product=None)
-            final_reply = combo_info + "\n\n---\n" + coach_block
+            combo_info = render_combo(combo) if combo else ("Hiện chưa map được combo rõ ràng cho case này.",)
+            prefetched = take_prefetch(session, intent)
+            if prefetched and is_trivial_followup(text_stripped):
+                coach_block = prefetched[0]
+                metrics.incr("prefetch_used_direct")
+            elif prefetched:
+                delta = call_openai_for_answer(
+                    build_delta_prompt(prefetched[0], text_stripped), session, combo=combo, product=None
+                )
+                coach_block = prefetched[0] + "\n\n*Cập nhật theo thông tin bổ sung:*\n" + delta
+                metrics.incr("prefetch_used_delta")
+            else:
+                coach_block = try_template_coaching(
+                    issue + "\n" + text_stripped, intent, combo, session
+                ) or call_openai_for_answer(
+                    build_case_prompt(issue, text_stripped), session, combo=combo, product=None, with_history=True
+                )
+            final_reply = with_coaching(combo_info, coach_block)
             send_message(chat_id, final_reply)
             return "ok", 200
 
         # 2. CHƯA CÓ INTENT RÕ
+        g.branch = "health_no_intent"
         if not intent:
             question = get_clarify_question(None)
             session["stage"] = "clarify"
@@ -1099,47 +2279,57 @@ def webhook():
             return "ok", 200
 
         # 3. CÓ INTENT, ĐANG Ở START
+        g.branch = "health_start"
         if stage in ("start", None):
             session["first_issue"] = text_stripped
             session["stage"] = "clarify"
             question = get_clarify_question(intent)
             send_message(chat_id, question)
+            if SPECULATIVE_PREFETCH:
+                start_prefetch(session)
             return "ok", 200
 
         # 4. GIAI ĐOẠN ADVISE -> câu hỏi bổ sung sau khi đã tư vấn combo
+        g.branch = "health_advise"
         if stage == "advise":
             combo = choose_combo(intent)
             session["last_combo"] = combo
             coach_block = call_openai_for_answer(
-                "Tư vấn viên đang hỏi thêm về cùng 1 case khách ở trên. "
-                "Hãy tiếp tục hỗ trợ đào sâu (xử lý thắc mắc, từ chối, nhắc lại cách dùng, follow-up...).\n\n"
-                "Câu hỏi bổ sung của tư vấn viên: " + text_stripped,
+                build_advise_prompt(text_stripped),
                 session,
                 combo=combo,
                 product=None,
+                with_history=True,
             )
             # Ở giai đoạn này không cần lặp lại full combo, chỉ cần câu trả lời coaching
             send_message(chat_id, coach_block)
             return "ok", 200
 
         # Fallback trong health
+        g.branch = "health_fallback"
         combo = choose_combo(intent)
         session["last_combo"] = combo
-        combo_info = format_combo_for_tvv(combo) if combo else ""
-        coach_block = call_openai_for_answer(text_stripped, session, combo=combo, product=None)
-        final_reply = (combo_info + "\n\n---\n" + coach_block) if combo_info else coach_block
+        coach_block = call_openai_for_answer(text_stripped, session, combo=combo, product=None, with_history=True)
+        final_reply = with_coaching(render_combo(combo), coach_block) if combo else coach_block
         send_message(chat_id, final_reply)
         return "ok", 200
 
     # ====== FALLBACK CHUNG ======
+    g.branch = "fallback"
     intent = session.get("intent")
     combo = choose_combo(intent)
     session["last_combo"] = combo
-    reply = call_openai_for_answer(text_stripped, session, combo=combo, product=None)
+    reply = call_openai_for_answer(text_stripped, session, combo=combo, product=None, with_history=True)
     send_message(chat_id, reply)
     touch_user_stats(profile, need=need, intent=intent)
     return "ok", 200
 
 
+if PRELOAD_APP:
+    warm_data()
+else:
+    install_lifecycle()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
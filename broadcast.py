@@ -0,0 +1,441 @@
+"""
+Gửi thông báo hàng loạt (đổi catalog / chính sách) tới các TVV trong users_store, qua /admin/broadcast.
+
+- Job lưu trong SQLite (data/broadcasts.sqlite): danh sách người nhận chốt lúc tạo job +
+  trạng thái từng người (chờ / đã gửi / lỗi / chặn bot) -> tạm dừng, restart đều chạy tiếp
+  đúng phần còn lại, không gửi trùng người đã nhận.
+- Tốc độ: mỗi bot 1 RateLimiter chia đều RATE_PER_SECOND tin/giây (mặc định 25, dưới giới hạn
+  ~30 tin/s của Telegram), tính cả tin trả lời thường của bot đó (note_live) -> broadcast nhường
+  chỗ cho hội thoại đang diễn ra. CONCURRENCY luồng gửi song song để che độ trễ mạng.
+  Các đoạn của cùng 1 tin tới 1 chat cách nhau ≥ CHAT_INTERVAL_SECONDS (giới hạn ~1 tin/s/chat).
+- 429: cả job dừng đúng retry_after rồi gửi lại tin đó (tối đa MAX_RETRIES lần).
+  403 (TVV chặn bot / xoá tài khoản) -> "blocked", không thử lại.
+- Mỗi job có lease (có chủ) trong DB, gia hạn mỗi LEASE_RENEW_SECONDS: nhiều worker gunicorn
+  không chạy cùng 1 job; pause/cancel từ worker khác làm gia hạn thất bại -> job dừng gửi.
+- Tin dài nhiều đoạn: lưu số đoạn đã gửi của từng người, chạy tiếp thì gửi từ đoạn kế tiếp.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+import requests
+
+import metrics
+from delivery import split_message
+
+RATE_PER_SECOND = 25.0
+CHAT_INTERVAL_SECONDS = 1.0
+CONCURRENCY = 8
+MAX_RETRIES = 5
+LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = 5
+BATCH = 500
+
+PENDING, SENT, FAILED, BLOCKED = 0, 1, 2, 3
+_COUNTER = {SENT: "sent", FAILED: "failed", BLOCKED: "blocked"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bot_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    segment TEXT NOT NULL,              -- bộ lọc người nhận lúc tạo (JSON)
+    status TEXT NOT NULL,               -- running / paused / cancelled / done
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    created_ts REAL NOT NULL,
+    started_ts REAL,
+    finished_ts REAL,
+    lease_until REAL,
+    lease_owner TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,   -- 0 chờ, 1 đã gửi, 2 lỗi, 3 chặn bot
+    chunks_sent INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (job_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS broadcast_pending ON broadcast_recipients (job_id, chat_id) WHERE state = 0;
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class SendResult:
+    ok: bool
+    status: int
+    description: str = ""
+    retry_after: float | None = None        # có giá trị = nên gửi lại sau ngần này giây
+
+
+def post_message(http: requests.Session, api_url: str, chat_id: int, text: str) -> SendResult:
+    """sendMessage 1 lần (Markdown lỗi thì gửi lại dạng text thường), không tự chờ 429."""
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
+    for _ in range(2):
+        try:
+            resp = http.post(f"{api_url}/sendMessage", json=payload, timeout=10)
+        except requests.RequestException as e:
+            return SendResult(False, 0, str(e), retry_after=1.0)
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        if resp.status_code == 200 and body.get("ok", True):
+            return SendResult(True, 200)
+        description = str(body.get("description") or "")
+        if resp.status_code == 400 and "parse" in description.lower() and "parse_mode" in payload:
+            payload.pop("parse_mode")
+            continue
+        retry_after = None
+        if resp.status_code == 429:
+            retry_after = float((body.get("parameters") or {}).get("retry_after", 1))
+        elif resp.status_code >= 500:
+            retry_after = 1.0
+        return SendResult(False, resp.status_code, description, retry_after)
+    return SendResult(False, 400, description)
+
+
+class RateLimiter:
+    """Chia đều tin theo thời gian (không dồn cụm); pause() dừng mọi luồng tới 1 thời điểm."""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                slot = max(self._next, now, self._paused_until)
+                self._next = slot + self.interval
+            if slot > now:
+                self.sleep(slot - now)
+            # Trong lúc chờ lượt có luồng khác nhận 429 -> xếp lại lượt sau khi hết pause
+            with self._lock:
+                if self.clock() >= self._paused_until:
+                    return
+
+    def note(self, count: int = 1):
+        """Tính thêm count tin đã gửi ngoài limiter (trả lời thường): các lượt sau lùi lại, không chờ."""
+        with self._lock:
+            self._next = max(self._next, self.clock()) + count * self.interval
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+            self._next = max(self._next, self._paused_until)
+
+
+class BroadcastStore:
+    def __init__(self, path: Path | str):
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def create(self, bot_id: str, text: str, segment: dict, chat_ids: list[int], now: float) -> int:
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                cur = self._db.execute(
+                    "INSERT INTO broadcasts (bot_id, text, segment, status, total, created_ts)"
+                    " VALUES (?, ?, ?, 'running', ?, ?)",
+                    (bot_id, text, json.dumps(segment, ensure_ascii=False), len(chat_ids), now),
+                )
+                job_id = cur.lastrowid
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO broadcast_recipients (job_id, chat_id) VALUES (?, ?)",
+                    ((job_id, chat_id) for chat_id in chat_ids),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM broadcasts WHERE id = ?", (job_id,))
+            row = cur.fetchone()
+            names = [d[0] for d in cur.description]
+        return dict(zip(names, row)) if row else None
+
+    def jobs(self, status: str | None = None, limit: int = 20) -> list[dict]:
+        where, args = ("WHERE status = ?", (status,)) if status else ("", ())
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                f"SELECT id FROM broadcasts {where} ORDER BY id DESC LIMIT ?", (*args, limit)
+            )]
+        return [job for job in map(self.get, ids) if job]
+
+    def pending(self, job_id: int, after: int | None, limit: int = BATCH) -> list[tuple[int, int]]:
+        """(chat_id, số đoạn đã gửi) của người chưa xong, theo chat_id tăng dần sau after."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id, chunks_sent FROM broadcast_recipients WHERE job_id = ? AND state = 0 AND chat_id > ?"
+                " ORDER BY chat_id LIMIT ?",
+                (job_id, after if after is not None else -(2 ** 63), limit),
+            ).fetchall()
+        return [(r[0], r[1]) for r in rows]
+
+    def save_chunks(self, job_id: int, chat_id: int, chunks_sent: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE broadcast_recipients SET chunks_sent = ? WHERE job_id = ? AND chat_id = ? AND state = 0",
+                (chunks_sent, job_id, chat_id),
+            )
+
+    def mark(self, job_id: int, chat_id: int, state: int, retries: int = 0, error: str | None = None):
+        column = _COUNTER[state]
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                cur = self._db.execute(
+                    "UPDATE broadcast_recipients SET state = ?, error = ? WHERE job_id = ? AND chat_id = ? AND state = 0",
+                    (state, error, job_id, chat_id),
+                )
+                if cur.rowcount:
+                    self._db.execute(
+                        f"UPDATE broadcasts SET {column} = {column} + 1, retries = retries + ? WHERE id = ?",
+                        (retries, job_id),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def set_status(self, job_id: int, status: str, now: float | None = None) -> bool:
+        finished = now if status in ("done", "cancelled") else None
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE broadcasts SET status = ?, finished_ts = COALESCE(?, finished_ts)"
+                " WHERE id = ? AND status NOT IN ('done', 'cancelled')",
+                (status, finished, job_id),
+            )
+        return cur.rowcount == 1
+
+    def lease(self, job_id: int, owner: str, now: float, renew: bool = False) -> bool:
+        """
+        Giữ quyền chạy job tới now + LEASE_SECONDS; False nếu tiến trình khác đang giữ.
+        renew=True: owner đang giữ gia hạn tiếp; False nếu đã mất lease hoặc job không còn running.
+        """
+        if renew:
+            held, args = " AND lease_owner = ?", (owner,)
+        else:
+            held, args = " AND (lease_until IS NULL OR lease_until < ?)", (now,)
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE broadcasts SET lease_until = ?, lease_owner = ?, started_ts = COALESCE(started_ts, ?)"
+                f" WHERE id = ? AND status = 'running'{held}",
+                (now + LEASE_SECONDS, owner, now, job_id, *args),
+            )
+        return cur.rowcount == 1
+
+    def finish(self, job_id: int, owner: str, now: float) -> bool:
+        """running -> done, chỉ khi owner còn giữ lease (không ghi đè paused / cancelled)."""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE broadcasts SET status = 'done', finished_ts = ?"
+                " WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (now, job_id, owner),
+            )
+        return cur.rowcount == 1
+
+    def release(self, job_id: int, owner: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE broadcasts SET lease_until = NULL, lease_owner = NULL WHERE id = ? AND lease_owner = ?",
+                (job_id, owner),
+            )
+
+
+def progress(job: dict, now: float) -> dict:
+    """Số liệu cho /admin/broadcast/<id>: đã xử lý, tốc độ, thời gian còn lại ước tính."""
+    done = job["sent"] + job["failed"] + job["blocked"]
+    elapsed = (job["finished_ts"] or now) - job["started_ts"] if job["started_ts"] else 0.0
+    rate = done / elapsed if elapsed > 0 else 0.0
+    pending = job["total"] - done
+    report = {k: job[k] for k in ("id", "bot_id", "status", "total", "sent", "failed", "blocked", "retries")}
+    report["segment"] = json.loads(job["segment"])
+    report["pending"] = pending
+    report["rate_per_second"] = round(rate, 2)
+    report["eta_seconds"] = round(pending / rate) if rate and job["status"] == "running" else None
+    return report
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        store: BroadcastStore,
+        send,
+        rate: float = RATE_PER_SECOND,
+        concurrency: int = CONCURRENCY,
+        clock=time.time,
+        chat_interval: float = CHAT_INTERVAL_SECONDS,
+    ):
+        """send(bot_id, chat_id, text) -> SendResult."""
+        self.store = store
+        self.send = send
+        self.rate = rate
+        self.concurrency = concurrency
+        self.chat_interval = chat_interval
+        self._limiters: dict[str, RateLimiter] = {}
+        self.clock = clock
+        self.owner = uuid.uuid4().hex
+        self._running: dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, bot_id: str) -> RateLimiter:
+        """Limiter của 1 bot, dùng chung cho mọi job của bot đó."""
+        with self._lock:
+            limiter = self._limiters.get(bot_id)
+            if limiter is None:
+                limiter = self._limiters[bot_id] = RateLimiter(self.rate)
+            return limiter
+
+    def note_live(self, bot_id: str, count: int):
+        """Bot vừa gửi count tin trả lời thường -> job broadcast của bot đó gửi chậm lại tương ứng."""
+        if count:
+            self.limiter(bot_id).note(count)
+
+    def start(self, job_id: int) -> bool:
+        """Chạy job ở nền; False nếu đang chạy (ở đây hoặc ở tiến trình khác) / không ở trạng thái running."""
+        with self._lock:
+            if job_id in self._running or not self.store.lease(job_id, self.owner, self.clock()):
+                return False
+            stop = self._running[job_id] = threading.Event()
+        threading.Thread(target=self._run, args=(job_id, stop), name=f"broadcast-{job_id}", daemon=True).start()
+        return True
+
+    def resume_all(self) -> list[int]:
+        """Sau restart: chạy tiếp các job còn ở trạng thái running."""
+        return [job["id"] for job in self.store.jobs("running", limit=100) if self.start(job["id"])]
+
+    def stop(self, job_id: int | None = None):
+        with self._lock:
+            events = [self._running[job_id]] if job_id in self._running else []
+            if job_id is None:
+                events = list(self._running.values())
+        for event in events:
+            event.set()
+
+    def _renew_loop(self, job_id: int, stop: threading.Event, done: threading.Event):
+        # Gia hạn theo giờ (không theo lô): pause 429 dài cũng không để lease hết hạn.
+        # Mất lease / job bị pause, cancel (kể cả từ worker khác) -> dừng gửi.
+        while not done.wait(LEASE_RENEW_SECONDS):
+            if not self.store.lease(job_id, self.owner, self.clock(), renew=True):
+                metrics.incr("broadcast_lease_lost")
+                stop.set()
+                return
+
+    def _run(self, job_id: int, stop: threading.Event):
+        job = self.store.get(job_id)
+        chunks = split_message(job["text"])
+        work: queue.Queue = queue.Queue(maxsize=self.concurrency * 4)
+        workers = [
+            threading.Thread(target=self._worker, args=(job, chunks, work, stop), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew_loop, args=(job_id, stop, done), daemon=True)
+        for thread in (*workers, renewer):
+            thread.start()
+        try:
+            last = None
+            while not stop.is_set():
+                batch = self.store.pending(job_id, last)
+                if not batch:
+                    break
+                for item in batch:
+                    while not stop.is_set():
+                        try:
+                            work.put(item, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                last = batch[-1][0]
+        finally:
+            for _ in workers:
+                work.put(None)
+            for worker in workers:
+                worker.join()
+            done.set()
+            renewer.join()
+            if not stop.is_set() and self.store.finish(job_id, self.owner, self.clock()):
+                metrics.incr("broadcast_jobs_done")
+            self.store.release(job_id, self.owner)
+            with self._lock:
+                self._running.pop(job_id, None)
+
+    def _worker(self, job: dict, chunks: tuple[str, ...], work: queue.Queue, stop: threading.Event):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            if stop.is_set():
+                continue
+            chat_id, chunks_sent = item
+            state, sent, retries, error = self._deliver(job["bot_id"], chat_id, chunks, chunks_sent, stop)
+            if state != PENDING:
+                self.store.mark(job["id"], chat_id, state, retries, error)
+                metrics.incr("broadcast_messages", state=_COUNTER[state])
+            elif sent > chunks_sent:
+                self.store.save_chunks(job["id"], chat_id, sent)
+
+    def _deliver(
+        self,
+        bot_id: str,
+        chat_id: int,
+        chunks: tuple[str, ...],
+        start: int,
+        stop: threading.Event,
+    ) -> tuple[int, int, int, str | None]:
+        """
+        Gửi chunks[start:] -> (state, số đoạn đã gửi, số lần thử lại, lỗi).
+        PENDING = job bị dừng giữa chừng; lần chạy sau gửi tiếp từ đoạn chưa gửi.
+        """
+        limiter = self.limiter(bot_id)
+        retries = 0
+        sent = start
+        last_sent_at = None
+        for chunk in chunks[start:]:
+            while True:
+                if last_sent_at is not None:
+                    # Giới hạn theo chat: đoạn kế tiếp tới cùng chat chờ đủ chat_interval
+                    gap = self.chat_interval - (time.monotonic() - last_sent_at)
+                    if gap > 0 and stop.wait(gap):
+                        return PENDING, sent, retries, None
+                if stop.is_set():
+                    return PENDING, sent, retries, None
+                limiter.acquire()
+                if stop.is_set():
+                    return PENDING, sent, retries, None
+                result = self.send(bot_id, chat_id, chunk)
+                last_sent_at = time.monotonic()
+                if result.ok:
+                    sent += 1
+                    break
+                if result.retry_after is not None and retries < MAX_RETRIES:
+                    retries += 1
+                    metrics.incr("broadcast_retries", status=result.status)
+                    if result.status == 429:
+                        limiter.pause(result.retry_after)
+                    else:
+                        time.sleep(result.retry_after)
+                    continue
+                return (BLOCKED if result.status == 403 else FAILED), sent, retries, result.description[:200]
+        return SENT, sent, retries, None
@@ -0,0 +1,392 @@
+"""
+Mô hình dữ liệu WELLLAB đã được "đóng băng" trong bộ nhớ.
+
+data/*.json được đọc 1 lần, kiểm tra và chuyển thành dataclass frozen + __slots__:
+URL chuẩn (url/link/combo_url), tên không dấu và mã sản phẩm (intern) được
+tính sẵn, nên code xử lý tin nhắn không còn phải .get() với fallback khắp nơi.
+
+Đo bộ nhớ so với dict thô:
+    python catalog.py --mem
+"""
+import hashlib
+import json
+import sys
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from search_index import FuzzyIndex, normalize_text
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+
+INTENT_PRIORITY_DEFAULT = 10
+
+DATA_FILES = {
+    "catalog": "welllab_catalog.json",      # danh mục combo
+    "symptoms": "symptoms_mapping.json",    # intent -> combo
+    "faq": "faq.json",                      # câu hỏi thường gặp
+    "objections": "objections.json",        # từ chối phổ biến
+    "products": "welllab_products.json",    # danh mục sản phẩm lẻ
+}
+
+
+@dataclass(frozen=True, slots=True)
+class ComboItem:
+    name: str
+    code: str
+    text: str
+    short_text: str
+    url: str
+
+
+@dataclass(frozen=True, slots=True)
+class Combo:
+    name: str
+    norm_name: str
+    aliases: tuple[str, ...]
+    header_text: str
+    duration_text: str
+    products: tuple[ComboItem, ...]
+    url: str
+
+
+@dataclass(frozen=True, slots=True)
+class Product:
+    name: str
+    norm_name: str
+    code: str
+    price: str
+    ingredients: str
+    usage: str
+    benefits: str
+    url: str
+
+
+@dataclass(frozen=True, slots=True)
+class SymptomRule:
+    intent: str
+    title: str
+    priority: int
+    keywords: tuple[str, ...]           # đã về chữ thường
+    preferred_combos: tuple[str, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class KeywordAnswer:
+    id: str
+    keywords: tuple[str, ...]           # đã về chữ thường
+    answer: str
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogData:
+    combos: tuple[Combo, ...]
+    products: tuple[Product, ...]
+    rules: tuple[SymptomRule, ...]
+    faq: tuple[KeywordAnswer, ...]
+    objections: tuple[KeywordAnswer, ...]
+    combo_by_name: dict[str, Combo]
+    rule_by_intent: dict[str, SymptomRule]
+    combo_index: FuzzyIndex
+    product_index: FuzzyIndex
+    version: str                        # sha256 rút gọn của các file data
+    problems: tuple[str, ...]           # cảnh báo khi kiểm tra dữ liệu
+
+
+# ========= CHUYỂN ĐỔI + KIỂM TRA =========
+def _str(raw: dict, key: str) -> str:
+    # intern: tên, mô tả, link của cùng 1 sản phẩm lặp lại ở nhiều combo chỉ giữ 1 bản
+    value = raw.get(key)
+    return sys.intern(value.strip()) if isinstance(value, str) else ""
+
+
+def _url(raw: dict, *keys: str) -> str:
+    for key in keys:
+        value = _str(raw, key)
+        if value:
+            return value
+    return ""
+
+
+def _code(raw: dict) -> str:
+    value = raw.get("code")
+    if isinstance(value, int):
+        value = str(value)
+    return sys.intern(value.strip()) if isinstance(value, str) else ""
+
+
+def _check_url(url: str, where: str, problems: list[str]):
+    if url and not url.startswith(("http://", "https://")):
+        problems.append(f"{where}: URL không hợp lệ '{url}'")
+
+
+def build_combo(raw: dict, problems: list[str]) -> Combo | None:
+    name = _str(raw, "name")
+    if not name:
+        problems.append(f"combo thiếu 'name': {str(raw)[:60]}")
+        return None
+    items: list[ComboItem] = []
+    for p in raw.get("products") or []:
+        if not isinstance(p, dict) or not _str(p, "name"):
+            problems.append(f"combo '{name}': sản phẩm thiếu 'name'")
+            continue
+        item = ComboItem(
+            name=_str(p, "name"),
+            code=_code(p),
+            text=_str(p, "text"),
+            short_text=_str(p, "short_text"),
+            url=_url(p, "url", "link"),
+        )
+        _check_url(item.url, f"combo '{name}' / {item.name}", problems)
+        items.append(item)
+    if not items:
+        problems.append(f"combo '{name}' không có sản phẩm")
+    combo = Combo(
+        name=name,
+        norm_name=sys.intern(normalize_text(name)),
+        aliases=tuple(a.strip() for a in raw.get("aliases") or [] if isinstance(a, str) and a.strip()),
+        header_text=_str(raw, "header_text"),
+        duration_text=_str(raw, "duration_text"),
+        products=tuple(items),
+        url=_url(raw, "combo_url", "url", "link"),
+    )
+    _check_url(combo.url, f"combo '{name}'", problems)
+    return combo
+
+
+def build_product(raw: dict, problems: list[str]) -> Product | None:
+    name = _str(raw, "name")
+    code = _code(raw)
+    if not name or not code:
+        problems.append(f"sản phẩm thiếu 'name'/'code': {str(raw)[:60]}")
+        return None
+    prod = Product(
+        name=name,
+        norm_name=sys.intern(normalize_text(name)),
+        code=code,
+        price=_str(raw, "price"),
+        ingredients=_str(raw, "ingredients"),
+        usage=_str(raw, "usage"),
+        benefits=_str(raw, "benefits"),
+        url=_url(raw, "link", "url"),
+    )
+    _check_url(prod.url, f"sản phẩm {code}", problems)
+    return prod
+
+
+def build_rule(raw: dict, problems: list[str]) -> SymptomRule | None:
+    intent = _str(raw, "intent")
+    if not intent:
+        problems.append(f"rule thiếu 'intent': {str(raw)[:60]}")
+        return None
+    try:
+        priority = int(raw.get("priority", INTENT_PRIORITY_DEFAULT))
+    except (TypeError, ValueError):
+        problems.append(f"rule '{intent}': priority không phải số")
+        priority = INTENT_PRIORITY_DEFAULT
+    return SymptomRule(
+        intent=sys.intern(intent),
+        title=_str(raw, "title"),
+        priority=priority,
+        keywords=tuple(k.lower().strip() for k in raw.get("keywords") or [] if isinstance(k, str) and k.strip()),
+        preferred_combos=tuple(n.strip() for n in raw.get("preferred_combos") or [] if isinstance(n, str)),
+    )
+
+
+def build_keyword_answer(raw: dict, problems: list[str]) -> KeywordAnswer | None:
+    answer = _str(raw, "answer")
+    keywords = tuple(k.lower() for k in raw.get("keywords_any") or [] if isinstance(k, str) and k)
+    if not answer or not keywords:
+        problems.append(f"FAQ/objection '{raw.get('id')}' thiếu 'answer'/'keywords_any'")
+        return None
+    return KeywordAnswer(id=_str(raw, "id"), keywords=keywords, answer=answer)
+
+
+def _typed(raw_list, builder, label: str, problems: list[str]) -> tuple:
+    if not isinstance(raw_list, list):
+        problems.append(f"{label}: dữ liệu không phải danh sách")
+        return ()
+    out = []
+    for raw in raw_list:
+        obj = builder(raw, problems) if isinstance(raw, dict) else None
+        if obj is not None:
+            out.append(obj)
+    return tuple(out)
+
+
+def build_catalog(raw: dict, version: str = "") -> CatalogData:
+    """raw: {"catalog": [...], "symptoms": [...], "faq": [...], "objections": [...], "products": [...]}"""
+    problems: list[str] = []
+    combos = _typed(raw.get("catalog", []), build_combo, "catalog", problems)
+    products = _typed(raw.get("products", []), build_product, "products", problems)
+    rules = _typed(raw.get("symptoms", []), build_rule, "symptoms", problems)
+    faq = _typed(raw.get("faq", []), build_keyword_answer, "faq", problems)
+    objections = _typed(raw.get("objections", []), build_keyword_answer, "objections", problems)
+
+    combo_by_name: dict[str, Combo] = {}
+    for combo in combos:
+        if combo.name in combo_by_name:
+            problems.append(f"combo trùng tên: '{combo.name}'")
+            continue
+        combo_by_name[combo.name] = combo
+
+    seen_codes: set[str] = set()
+    for prod in products:
+        if prod.code in seen_codes:
+            problems.append(f"sản phẩm trùng mã: {prod.code}")
+        seen_codes.add(prod.code)
+
+    rule_by_intent: dict[str, SymptomRule] = {}
+    for rule in rules:
+        rule_by_intent.setdefault(rule.intent, rule)
+        for name in rule.preferred_combos:
+            if name not in combo_by_name:
+                problems.append(f"rule '{rule.intent}': combo '{name}' không có trong catalog")
+
+    return CatalogData(
+        combos=combos,
+        products=products,
+        rules=rules,
+        faq=faq,
+        objections=objections,
+        combo_by_name=combo_by_name,
+        rule_by_intent=rule_by_intent,
+        combo_index=FuzzyIndex([[c.name, *c.aliases] for c in combos]),
+        product_index=FuzzyIndex([[p.name, p.code] for p in products]),
+        version=version,
+        problems=tuple(problems),
+    )
+
+
+def read_raw(data_dir: Path = DATA_DIR) -> tuple[dict, str]:
+    """Đọc các file data, trả về (dict thô theo loại, version)."""
+    raw: dict = {}
+    digest = hashlib.sha256()
+    for key, filename in DATA_FILES.items():
+        path = data_dir / filename
+        try:
+            content = path.read_bytes()
+            raw[key] = json.loads(content.decode("utf-8"))
+            digest.update(content)
+        except Exception as e:
+            print(f"Không load được {path}: {e}")
+            raw[key] = []
+    return raw, digest.hexdigest()[:16]
+
+
+def load_catalog(data_dir: Path = DATA_DIR) -> CatalogData:
+    raw, version = read_raw(data_dir)
+    data = build_catalog(raw, version=version)
+    for problem in data.problems:
+        print("Cảnh báo data:", problem)
+    return data
+
+
+# Loại data mà từng bot được phép ghi đè; catalog/sản phẩm + chỉ mục luôn dùng chung
+OVERRIDABLE = ("symptoms", "faq", "objections")
+
+
+def with_overrides(base: CatalogData, data_dir: Path) -> CatalogData:
+    """
+    Bản data cho 1 bot: file symptoms/faq/objections có trong data_dir thay bản gốc,
+    còn combo, sản phẩm, chỉ mục tìm kiếm dùng lại đúng object của base (không tốn thêm RAM).
+    """
+    problems: list[str] = []
+    digest = hashlib.sha256(base.version.encode())
+    changes: dict = {}
+    for key in OVERRIDABLE:
+        path = data_dir / DATA_FILES[key]
+        if not path.exists():
+            continue
+        try:
+            content = path.read_bytes()
+            raw_list = json.loads(content.decode("utf-8"))
+        except Exception as e:
+            print(f"Không load được {path}: {e}")
+            continue
+        digest.update(content)
+        if key == "symptoms":
+            rules = _typed(raw_list, build_rule, key, problems)
+            rule_by_intent: dict[str, SymptomRule] = {}
+            for rule in rules:
+                rule_by_intent.setdefault(rule.intent, rule)
+                for name in rule.preferred_combos:
+                    if name not in base.combo_by_name:
+                        problems.append(f"rule '{rule.intent}': combo '{name}' không có trong catalog")
+            changes.update(rules=rules, rule_by_intent=rule_by_intent)
+        else:
+            changes[key] = _typed(raw_list, build_keyword_answer, key, problems)
+
+    if not changes:
+        return base
+    for problem in problems:
+        print(f"Cảnh báo data ({data_dir.name}):", problem)
+    return replace(base, version=digest.hexdigest()[:16], problems=tuple(problems), **changes)
+
+
+# ========= ĐO BỘ NHỚ =========
+def _footprint(root) -> tuple[int, int]:
+    """(byte của container: dict/list/tuple/dataclass, byte của chuỗi) – mỗi object tính 1 lần."""
+    seen: set[int] = set()
+    containers = strings = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (int, float, bool, type(None), FuzzyIndex)):
+            continue
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if isinstance(obj, str):
+            strings += size
+            continue
+        containers += size
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, "__slots__"):
+            stack.extend(getattr(obj, name) for name in obj.__slots__)
+    return containers, strings
+
+
+def _measure_memory(scale: int):
+    raw, _ = read_raw()
+    if scale > 1:
+        raw["catalog"] = [dict(c, name=f"{c['name']} #{i}") for i in range(scale) for c in raw["catalog"]]
+        raw["products"] = [dict(p, code=f"{p['code']}{i}") for i in range(scale) for p in raw["products"]]
+    payload = json.dumps(raw, ensure_ascii=False)
+
+    as_dicts = json.loads(payload)
+    typed = build_catalog(json.loads(payload))
+    # Chỉ so phần dữ liệu (không tính 2 chỉ mục tìm kiếm, dict tra cứu dùng chung object)
+    typed_part = (typed.combos, typed.products, typed.rules, typed.faq, typed.objections)
+
+    dict_c, dict_s = _footprint(as_dicts)
+    typed_c, typed_s = _footprint(typed_part)
+    print(f"scale={scale} combos={len(typed.combos)} products={len(typed.products)}")
+    print(f"{'':14s}{'container':>12s}{'chuỗi':>12s}{'tổng':>12s}")
+    print(f"{'dict thô':14s}{dict_c / 1024:10.1f}KB{dict_s / 1024:10.1f}KB{(dict_c + dict_s) / 1024:10.1f}KB")
+    print(f"{'CatalogData':14s}{typed_c / 1024:10.1f}KB{typed_s / 1024:10.1f}KB{(typed_c + typed_s) / 1024:10.1f}KB")
+    print(
+        f"container: {typed_c / dict_c:.0%}, tổng: {(typed_c + typed_s) / (dict_c + dict_s):.0%} so với dict "
+        f"(chuỗi gồm cả tên không dấu tính sẵn)"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Kiểm tra data WELLLAB và đo bộ nhớ")
+    parser.add_argument("--mem", action="store_true", help="so sánh bộ nhớ dict thô và dataclass")
+    parser.add_argument("--scale", type=int, default=1, help="nhân bản catalog để đo ở quy mô lớn")
+    args = parser.parse_args()
+    if args.mem:
+        _measure_memory(args.scale)
+    else:
+        loaded = load_catalog()
+        print(
+            f"version={loaded.version} combos={len(loaded.combos)} products={len(loaded.products)} "
+            f"rules={len(loaded.rules)} faq={len(loaded.faq)} objections={len(loaded.objections)} "
+            f"cảnh báo={len(loaded.problems)}"
+        )
@@ -0,0 +1,171 @@
+"""
+Sinh sẵn đoạn COACHING cho từng combo (welllab_catalog.json) và sản phẩm lẻ
+(welllab_products.json).
+
+Nhánh combo/sản phẩm của bot luôn gửi OpenAI cùng một câu lệnh cố định + dữ liệu
+catalog, nên câu trả lời có thể sinh trước. Artifact lưu ở data/coaching_cache.json:
+
+    {
+      "artifact_version": 1,
+      "model": "gpt-4o-mini",
+      "generated_at": "...",
+      "entries": {"<fingerprint>": {"label": "combo:...", "text": "..."}}
+    }
+
+Khóa là fingerprint (sha256) của model + toàn bộ messages gửi OpenAI, nên khi
+prompt hay dữ liệu của 1 combo/sản phẩm đổi thì entry đó tự "stale" và bot
+quay về gọi OpenAI trực tiếp.
+
+Chạy job:
+    python coaching.py            # gọi OpenAI thật (cần OPENAI_API_KEY)
+    python coaching.py --stub     # LLM giả, dùng cho test / CI
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from catalog import CatalogData, load_catalog
+from prompts import (
+    COMBO_COACH_PROMPT,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    PRODUCT_COACH_PROMPT,
+    build_openai_messages,
+)
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+COACHING_PATH = DATA_DIR / "coaching_cache.json"
+
+ARTIFACT_VERSION = 1
+
+# Phần session đưa vào prompt coaching combo / sản phẩm. Coaching chỉ phụ thuộc combo / sản phẩm,
+# không phụ thuộc case đang tư vấn -> webhook() luôn thay intent + hồ sơ KH bằng bản chuẩn này
+# (coaching_session) để messages, và fingerprint, khớp đúng entry sinh sẵn.
+PRODUCT_SESSION = {"intent": "product_info", "profile": {}}
+COMBO_SESSION = {"intent": "product_combo", "profile": {}}
+
+
+def coaching_session(session: dict, canonical: dict) -> dict:
+    """Bản sao nông của session (giữ user_id... cho hạn mức LLM) với intent / hồ sơ KH chuẩn."""
+    return {**session, **canonical}
+
+
+def fingerprint(messages: list[dict]) -> str:
+    raw = json.dumps(
+        {"model": OPENAI_MODEL, "temperature": OPENAI_TEMPERATURE, "messages": messages},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def coaching_jobs(data: CatalogData) -> list[tuple[str, list[dict]]]:
+    """Danh sách (label, messages) cần sinh sẵn, đúng như webhook() sẽ gửi."""
+    jobs: list[tuple[str, list[dict]]] = []
+    for prod in data.products:
+        messages = build_openai_messages(PRODUCT_COACH_PROMPT, PRODUCT_SESSION, product=prod)
+        jobs.append((f"product:{prod.code}", messages))
+    for combo in data.combos:
+        messages = build_openai_messages(COMBO_COACH_PROMPT, COMBO_SESSION, combo=combo)
+        jobs.append((f"combo:{combo.name}", messages))
+    return jobs
+
+
+def build_artifact(data: CatalogData, llm, previous: dict | None = None) -> dict:
+    """
+    Sinh artifact mới. Entry nào đã có trong `previous` với cùng fingerprint
+    thì giữ nguyên, không gọi lại LLM.
+    """
+    old_entries = (previous or {}).get("entries", {})
+    entries: dict[str, dict] = {}
+    for label, messages in coaching_jobs(data):
+        fp = fingerprint(messages)
+        if fp in entries:
+            continue
+        old = old_entries.get(fp)
+        if old and old.get("text"):
+            entries[fp] = {"label": label, "text": old["text"]}
+            continue
+        text = (llm(messages) or "").strip()
+        if text:
+            entries[fp] = {"label": label, "text": text}
+        else:
+            print(f"Bỏ qua {label}: LLM trả về rỗng")
+
+    return {
+        "artifact_version": ARTIFACT_VERSION,
+        "model": OPENAI_MODEL,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "entries": entries,
+    }
+
+
+def read_artifact(path: Path = COACHING_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Không load được {path}: {e}")
+        return {}
+    if artifact.get("artifact_version") != ARTIFACT_VERSION:
+        print(f"Bỏ qua {path}: artifact_version không khớp")
+        return {}
+    return artifact
+
+
+def load_coaching_cache(path: Path = COACHING_PATH) -> dict[str, str]:
+    """fingerprint -> đoạn coaching, dùng trực tiếp khi trả lời."""
+    entries = read_artifact(path).get("entries", {})
+    return {fp: e["text"] for fp, e in entries.items() if e.get("text")}
+
+
+def save_artifact(artifact: dict, path: Path = COACHING_PATH):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# ========= LLM =========
+def openai_llm(messages: list[dict]) -> str:
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    completion = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        temperature=OPENAI_TEMPERATURE,
+        messages=messages,
+    )
+    return completion.choices[0].message.content or ""
+
+
+def stub_llm(messages: list[dict]) -> str:
+    """LLM giả: trả về text cố định theo fingerprint, không gọi mạng."""
+    return f"[stub coaching {fingerprint(messages)[:12]}]"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Sinh sẵn coaching cho combo / sản phẩm WELLLAB")
+    parser.add_argument("--stub", action="store_true", help="dùng LLM giả (test)")
+    parser.add_argument("--force", action="store_true", help="sinh lại toàn bộ, bỏ qua artifact cũ")
+    parser.add_argument("--output", type=Path, default=COACHING_PATH)
+    args = parser.parse_args(argv)
+
+    data = load_catalog(DATA_DIR)
+    previous = None if args.force else read_artifact(args.output)
+    llm = stub_llm if args.stub else openai_llm
+    artifact = build_artifact(data, llm, previous=previous)
+    save_artifact(artifact, args.output)
+    print(f"Đã ghi {len(artifact['entries'])} đoạn coaching vào {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
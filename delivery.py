@@ -0,0 +1,277 @@
+"""
+Chia tin nhắn dài thành các đoạn vừa giới hạn 4096 ký tự của Telegram.
+
+Bot gửi với parse_mode=Markdown (bản cũ): *đậm*, _nghiêng_, `code`, ```pre```,
+[text](url). Điểm cắt luôn nằm ngoài các cặp đánh dấu này, ưu tiên
+đoạn trống > xuống dòng > hết câu > khoảng trắng.
+
+send_chunks() gửi các đoạn theo thứ tự qua 1 kết nối keep-alive, tự lùi về
+text thường khi Telegram không parse được Markdown. Bị 429 quá lâu để chờ thì
+dừng và trả retry_after cho nơi gọi (không bỏ rơi các đoạn còn lại trong im lặng).
+"""
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import requests
+import requests.adapters
+
+import metrics
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+# Ưu tiên điểm cắt: số càng nhỏ càng tốt
+_BREAK_RANK = (("\n\n", 0), ("\n", 1), (". ", 2), (" ", 3))
+
+
+def tg_len(text: str) -> int:
+    """Telegram đếm độ dài theo UTF-16 (emoji = 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _scan(text: str) -> tuple[list[tuple[int, int]], str]:
+    """
+    Trả về (các điểm cắt an toàn (vị trí, hạng), cặp Markdown còn mở ở cuối text).
+    Cắt tại vị trí an toàn không làm vỡ cặp Markdown nào.
+    """
+    breaks: list[tuple[int, int]] = []
+    open_mark = ""          # "*", "_", "`", "```" hoặc "[" (đang trong link)
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if open_mark == "```":
+            if text.startswith("```", i):
+                open_mark = ""
+                i += 3
+                continue
+        elif open_mark == "`":
+            if ch == "`":
+                open_mark = ""
+        elif open_mark == "[":
+            if ch == ")":
+                open_mark = ""
+        elif open_mark:
+            if ch == open_mark:
+                open_mark = ""
+        elif text.startswith("```", i):
+            open_mark = "```"
+            i += 3
+            continue
+        elif ch in "*_`":
+            open_mark = ch
+        elif ch == "[" and "](" in text[i:i + 300]:
+            open_mark = "["
+        else:
+            for sep, rank in _BREAK_RANK:
+                if text.startswith(sep, i):
+                    breaks.append((i + len(sep), rank))
+                    break
+        i += 1
+    return breaks, open_mark
+
+
+def _pick_break(breaks: list[tuple[int, int]], size: int) -> int:
+    """Điểm cắt tốt nhất nằm ở nửa sau đoạn; không có thì lấy điểm cắt cuối cùng."""
+    for wanted, _ in enumerate(_BREAK_RANK):
+        for pos, rank in reversed(breaks):
+            if pos < size // 2:
+                break
+            if rank == wanted:
+                return pos
+    return breaks[-1][0] if breaks else 0
+
+
+def split_message(text: str, limit: int = TELEGRAM_TEXT_LIMIT) -> tuple[str, ...]:
+    """Chia text thành các đoạn ≤ limit (theo UTF-16), không cắt giữa cặp Markdown."""
+    if tg_len(text) <= limit:
+        return (text,) if text else ()
+
+    chunks: list[str] = []
+    rest = text
+    while rest:
+        if tg_len(rest) <= limit:
+            chunks.append(rest)
+            break
+        window = rest[:limit]
+        while tg_len(window) > limit - 1:   # chừa 1 ký tự để đóng * / _ nếu phải cắt cứng
+            window = window[: len(window) - max(1, (tg_len(window) - limit + 1) // 2)]
+
+        breaks, _ = _scan(window)
+        cut = _pick_break(breaks, len(window))
+        reopen = ""
+        if cut:
+            chunk = rest[:cut].rstrip()
+        else:
+            # Không có điểm cắt an toàn (1 cặp Markdown dài hơn cả tin): cắt cứng,
+            # đóng *đậm*/_nghiêng_ ở cuối đoạn và mở lại ở đoạn sau
+            cut = len(window)
+            chunk = window
+            _, open_mark = _scan(window)
+            if open_mark in ("*", "_"):
+                chunk += open_mark
+                reopen = open_mark
+        if chunk:
+            chunks.append(chunk)
+        rest = reopen + rest[cut:].lstrip("\n")
+    return tuple(chunks)
+
+
+def join_chunks(parts: list[tuple[str, ...]], sep: str, limit: int = TELEGRAM_TEXT_LIMIT) -> tuple[str, ...]:
+    """
+    Ghép các phần đã chia sẵn thành 1 tin nhắn (nối bằng sep) khi còn vừa giới hạn;
+    phần không vừa thì sang tin nhắn mới.
+    """
+    out: list[str] = []
+    for part in parts:
+        for idx, chunk in enumerate(part):
+            if out and idx == 0 and tg_len(out[-1]) + tg_len(sep) + tg_len(chunk) <= limit:
+                out[-1] = out[-1] + sep + chunk
+            else:
+                out.append(chunk)
+    return tuple(out)
+
+
+# ========= GỬI THEO ĐOẠN =========
+# Dùng chung 1 requests.Session -> giữ kết nối keep-alive tới api.telegram.org,
+# các đoạn sau không phải bắt tay TCP/TLS lại.
+MAX_RETRY_AFTER_SECONDS = 5
+
+
+def make_http_session() -> requests.Session:
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    http.mount("https://", adapter)
+    return http
+
+
+def _describe(resp) -> tuple[bool, str, dict]:
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {}
+    ok = resp.status_code == 200 and body.get("ok", True)
+    return ok, str(body.get("description") or ""), body.get("parameters") or {}
+
+
+def _retry_after(resp, params: dict) -> float | None:
+    if resp.status_code != 429:
+        return None
+    return float(params.get("retry_after", 1))
+
+
+def post_chunk(http: requests.Session, api_url: str, payload: dict) -> tuple[bool, float | None]:
+    """
+    Gửi 1 đoạn -> (ok, retry_after). Telegram từ chối Markdown ("can't parse entities") ->
+    gửi lại dạng text thường. Bị 429 thì không tự chờ: trả retry_after để nơi gọi quyết định.
+    """
+    resp = http.post(f"{api_url}/sendMessage", json=payload, timeout=10)
+    ok, description, params = _describe(resp)
+    if ok:
+        return True, None
+
+    if resp.status_code == 400 and "parse" in description.lower() and payload.get("parse_mode"):
+        metrics.incr("delivery_resends", reason="markdown")
+        payload = {k: v for k, v in payload.items() if k != "parse_mode"}
+        resp = http.post(f"{api_url}/sendMessage", json=payload, timeout=10)
+        ok, description, params = _describe(resp)
+        if ok:
+            return True, None
+
+    retry_after = _retry_after(resp, params)
+    if retry_after is None:
+        print("Telegram từ chối tin nhắn:", resp.status_code, description)
+    return False, retry_after
+
+
+@dataclass
+class Delivery:
+    sent: int                               # số đoạn đã gửi (theo thứ tự)
+    retry_after: float | None = None        # dừng vì 429: gửi tiếp phần còn lại sau ngần này giây
+
+
+def send_chunks(
+    http: requests.Session,
+    api_url: str,
+    chat_id: int,
+    chunks: tuple[str, ...],
+    reply_markup: dict | None = None,
+    parse_mode: str | None = "Markdown",
+    can_wait: Callable[[], bool] | None = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Delivery:
+    """
+    Gửi lần lượt các đoạn (giữ thứ tự), reply_markup gắn vào đoạn cuối.
+    Bị 429 với retry_after ≤ MAX_RETRY_AFTER_SECONDS (và can_wait() cho phép) -> chờ đủ
+    retry_after rồi gửi lại đoạn đó 1 lần; lâu hơn -> dừng, trả retry_after cho nơi gọi.
+    Dừng ở đoạn lỗi đầu tiên để khách không nhận tin bị hụt giữa chừng.
+    """
+    started = time.monotonic()
+    sent = 0
+    retry_after = None
+    for idx, chunk in enumerate(chunks):
+        payload: dict = {"chat_id": chat_id, "text": chunk}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        if reply_markup and idx == len(chunks) - 1:
+            payload["reply_markup"] = reply_markup
+        try:
+            ok, retry_after = post_chunk(http, api_url, payload)
+            if (
+                not ok
+                and retry_after is not None
+                and retry_after <= MAX_RETRY_AFTER_SECONDS
+                and (can_wait is None or can_wait())
+            ):
+                metrics.incr("delivery_resends", reason="rate_limit")
+                sleep(retry_after)
+                ok, retry_after = post_chunk(http, api_url, payload)
+        except requests.RequestException as e:
+            print("Lỗi gửi message về Telegram:", e)
+            break
+        if not ok:
+            break
+        sent += 1
+
+    metrics.incr("delivery_messages")
+    metrics.incr("delivery_chunks", sent)
+    metrics.observe("delivery_ms", (time.monotonic() - started) * 1000)
+    if sent < len(chunks):
+        metrics.incr("delivery_failures")
+        if retry_after is not None:
+            metrics.incr("delivery_rate_limited")
+            print(f"Telegram giới hạn tốc độ chat {chat_id}: còn {len(chunks) - sent} đoạn, thử lại sau {retry_after:g}s")
+    return Delivery(sent, retry_after if sent < len(chunks) else None)
+
+
+def answer_inline_query(
+    http: requests.Session,
+    api_url: str,
+    inline_query_id: str,
+    results: list[dict],
+    cache_time: int,
+) -> bool:
+    """
+    answerInlineQuery; Markdown lỗi -> gửi lại dạng text thường. Không chờ 429: query inline
+    hết hạn rất nhanh, TVV gõ tiếp sẽ có query mới.
+    """
+    payload = {"inline_query_id": inline_query_id, "results": results, "cache_time": cache_time}
+    resp = http.post(f"{api_url}/answerInlineQuery", json=payload, timeout=5)
+    ok, description, _ = _describe(resp)
+    if not ok and resp.status_code == 400 and "parse" in description.lower():
+        metrics.incr("delivery_resends", reason="inline_markdown")
+        payload["results"] = [
+            {
+                **r,
+                "input_message_content": {
+                    k: v for k, v in r["input_message_content"].items() if k != "parse_mode"
+                },
+            }
+            for r in results
+        ]
+        resp = http.post(f"{api_url}/answerInlineQuery", json=payload, timeout=5)
+        ok, description, _ = _describe(resp)
+    if not ok:
+        print("Telegram từ chối inline answer:", resp.status_code, description)
+        metrics.incr("inline_failures")
+    return ok
@@ -0,0 +1,38 @@
+"""
+Cấu hình gunicorn:  gunicorn app:app -c gunicorn.conf.py
+
+Preload (PRELOAD_APP=1, mặc định): master import app.py 1 lần (catalog, chỉ mục tìm kiếm,
+card combo/sản phẩm render sẵn) rồi mới fork worker -> các worker dùng chung các trang nhớ
+đó theo copy-on-write thay vì mỗi worker tự dựng 1 bản.
+- when_ready: gc.freeze() toàn bộ object đã có ở master trước khi fork, để GC của worker
+  không ghi vào header các object đó (ghi = trang bị copy sang worker).
+- post_worker_init: thread nền, pool kết nối Telegram/OpenAI, file log, signal SIGTERM
+  chỉ tạo trong worker (app.init_worker) – thread và socket không dùng chung qua fork được.
+
+Số worker: WEB_CONCURRENCY (mặc định 1). Session hội thoại vẫn nằm trong RAM từng worker,
+nên chỉ tăng worker khi các update cùng 1 chat được định tuyến về cùng 1 worker.
+Đo RSS/PSS từng worker: python memstat.py <pid master>
+"""
+import gc
+import os
+
+os.environ.setdefault("PRELOAD_APP", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+preload_app = os.environ["PRELOAD_APP"] == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    if preload_app:
+        import app
+
+        app.init_worker()
@@ -0,0 +1,208 @@
+"""
+Làn xử lý (admission control) cho webhook.
+
+- Làn "fast": mọi update đi vào đây; trả lời tất định (/start, menu, chào, FAQ,
+  objection, text combo/sản phẩm) chạy hết trong làn này, không giới hạn.
+- Làn "llm": chỉ phần gọi OpenAI, giới hạn số lời gọi đồng thời + số chỗ chờ.
+  Đầy thì từ chối ngay (shed) để người gọi trả lời "bận" hoặc chỉ gửi combo.
+
+Chạy gunicorn nhiều thread (gthread). Làn llm không phải chỗ duy nhất giữ thread: chờ lock
+của chat, ngủ chờ token, chờ nháp prefetch, debounce inline cũng vậy. ThreadBudget đếm chung
+mọi chỗ chặn đó: thread của update chỉ được chặn khi còn suất, hết suất thì trả lời ngay
+(bận / bỏ chờ) -> luôn chừa FAST_RESERVED_THREADS thread cho /start, menu, FAQ...
+
+UserBuckets: token bucket theo từng TVV để 1 người không chiếm hết làn llm.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+class ThreadBudget:
+    """
+    Số thread xử lý request được phép chặn (chờ / ngủ / gọi LLM) cùng lúc.
+    Thread xin suất lần đầu cần chặn (try_block) và giữ tới hết update (scope) – update
+    đã chậm 1 lần thì thường còn chậm tiếp (vd. chờ lock chat rồi gọi LLM).
+    Thread ngoài scope (pool prefetch, tóm tắt...) không tính: luôn được chặn.
+    """
+
+    def __init__(self, name: str, limit: int | None):
+        self.name = name
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def try_block(self) -> bool:
+        if not getattr(self._local, "in_scope", False) or getattr(self._local, "held", False):
+            return True
+        with self._lock:
+            if self.limit is not None and self.used >= self.limit:
+                metrics.incr("thread_budget_shed", budget=self.name)
+                return False
+            self.used += 1
+        self._local.held = True
+        metrics.incr("thread_budget_used", budget=self.name)
+        return True
+
+    @contextmanager
+    def scope(self):
+        """Bao 1 update; suất đã xin trong update được trả khi update xong."""
+        self._local.in_scope = True
+        try:
+            yield
+        finally:
+            self._local.in_scope = False
+            if getattr(self._local, "held", False):
+                self._local.held = False
+                with self._lock:
+                    self.used -= 1
+                metrics.incr("thread_budget_used", -1, budget=self.name)
+
+
+class Lane:
+    def __init__(
+        self,
+        name: str,
+        max_active: int | None = None,
+        max_waiting: int = 0,
+        wait_timeout: float = 0.0,
+    ):
+        self.name = name
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def _has_slot(self, reserve: int) -> bool:
+        return self.max_active is None or self.active < self.max_active - reserve
+
+    def _would_shed(self, reserve: int, wait: bool) -> bool:
+        return not self._has_slot(reserve) and (not wait or reserve or self.waiting >= self.max_waiting)
+
+    def would_shed(self, reserve: int = 0, wait: bool = True) -> bool:
+        """Xem trước (không giữ chỗ): lúc này try_acquire có bị từ chối ngay không."""
+        with self._cond:
+            return self._would_shed(reserve, wait)
+
+    def try_acquire(self, reserve: int = 0, wait: bool = True) -> bool:
+        """
+        reserve: chừa lại bấy nhiêu slot cho việc ưu tiên cao hơn (vd. prefetch chừa 1 slot
+        cho TVV đang chờ). wait=False: không xếp hàng, hết slot là từ chối luôn.
+        """
+        started = time.monotonic()
+        with self._cond:
+            if not self._has_slot(reserve):
+                if self._would_shed(reserve, wait):
+                    metrics.incr("lane_shed", lane=self.name)
+                    return False
+                self.waiting += 1
+                metrics.incr("lane_waiting", lane=self.name)
+                try:
+                    admitted = self._cond.wait_for(lambda: self._has_slot(0), timeout=self.wait_timeout)
+                finally:
+                    self.waiting -= 1
+                    metrics.incr("lane_waiting", -1, lane=self.name)
+                if not admitted:
+                    metrics.incr("lane_shed", lane=self.name)
+                    metrics.incr("lane_wait_timeouts", lane=self.name)
+                    return False
+            self.active += 1
+        metrics.incr("lane_active", lane=self.name)
+        metrics.incr("lane_admitted", lane=self.name)
+        metrics.observe("lane_wait_ms", (time.monotonic() - started) * 1000, lane=self.name)
+        return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+        metrics.incr("lane_active", -1, lane=self.name)
+
+    @contextmanager
+    def admit(self, reserve: int = 0, wait: bool = True):
+        """with lane.admit() as ok: ... -- ok=False nghĩa là bị từ chối, không được chạy."""
+        ok = self.try_acquire(reserve=reserve, wait=wait)
+        try:
+            yield ok
+        finally:
+            if ok:
+                self.release()
+
+
+# Khoá theo chat: nhiều thread nhưng tin của cùng 1 chat vẫn xử lý tuần tự (session dùng chung)
+_CHAT_LOCKS: dict[object, list] = {}          # key -> [lock, số update đang giữ/chờ]
+_CHAT_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def chat_lock(key, max_waiting: int | None = None, wait_timeout: float | None = None, can_wait=None):
+    """
+    Tuần tự hoá update của cùng 1 chat; yield True khi đã giữ lock.
+    key: định danh chat, vd. (bot_id, chat_id).
+    max_waiting: số update cùng chat được chờ sau update đang chạy; vượt -> yield False ngay
+    (không chiếm thêm thread). wait_timeout: chờ quá lâu -> yield False.
+    can_wait(): gọi khi lock đang bị giữ, False -> không chờ, yield False (vd. ThreadBudget.try_block).
+    Lock của chat bị xoá khi không còn ai giữ/chờ -> không tích luỹ theo số chat.
+    """
+    with _CHAT_LOCKS_GUARD:
+        slot = _CHAT_LOCKS.get(key)
+        if slot is None:
+            slot = _CHAT_LOCKS[key] = [threading.Lock(), 0]
+        shed = max_waiting is not None and slot[1] > max_waiting
+        if not shed:
+            slot[1] += 1
+    if shed:
+        yield False
+        return
+
+    acquired = slot[0].acquire(blocking=False)
+    if not acquired and (can_wait is None or can_wait()):
+        acquired = slot[0].acquire(timeout=-1 if wait_timeout is None else wait_timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            slot[0].release()
+        with _CHAT_LOCKS_GUARD:
+            slot[1] -= 1
+            if slot[1] == 0 and _CHAT_LOCKS.get(key) is slot:
+                del _CHAT_LOCKS[key]
+
+
+# ========= TOKEN BUCKET THEO NGƯỜI DÙNG =========
+class UserBuckets:
+    """
+    Mỗi user 1 bucket: tối đa `burst` token, hồi `rate_per_min` token/phút.
+    rate/burst truyền vào mỗi lần take() -> đổi cấu hình (vd. override trong hồ sơ) có hiệu lực ngay.
+    clock thay được khi test.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets: dict[str, tuple[float, float]] = {}     # user -> (token, thời điểm cập nhật)
+        self._lock = threading.Lock()
+
+    def take(self, user: str, rate_per_min: float, burst: float) -> float:
+        """Lấy 1 token. Trả về 0 nếu lấy được, ngược lại số giây phải chờ tới khi có token."""
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(user, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate_per_min / 60)
+            if tokens >= 1:
+                self._buckets[user] = (tokens - 1, now)
+                return 0.0
+            self._buckets[user] = (tokens, now)
+        if rate_per_min <= 0:
+            return float("inf")
+        return (1 - tokens) * 60 / rate_per_min
+
+    def refund(self, user: str, burst: float):
+        """Trả lại token đã take() khi lời gọi không được chạy (vd. làn LLM từ chối)."""
+        with self._lock:
+            tokens, updated = self._buckets.get(user, (burst, self.clock()))
+            self._buckets[user] = (min(burst, tokens + 1), updated)
@@ -0,0 +1,106 @@
+"""
+Bộ nhớ hội thoại có giới hạn cho từng chat (lưu trong session).
+
+- session["history"]: deque tối đa HISTORY_TURNS lượt gần nhất (role, text đã cắt ngắn).
+- Lượt bị đẩy ra khỏi deque dồn vào session["summary_pending"]; đủ SUMMARY_BATCH lượt
+  thì app gom thành 1 job nền cập nhật session["summary"] (tóm tắt cuốn chiếu).
+- history_messages() dựng phần ngữ cảnh gửi LLM: tóm tắt + các lượt mới nhất,
+  cắt theo ngân sách token cố định -> RAM và chi phí mỗi chat đều bị chặn trên.
+- Mọi thao tác giữ session["memory_lock"]: thread request (add_turn) và job tóm tắt nền
+  (take/restore_pending, apply_summary) chạy song song trên cùng session.
+"""
+import threading
+from collections import deque
+
+HISTORY_TURNS = 8
+TURN_MAX_CHARS = 600
+SUMMARY_BATCH = 4
+SUMMARY_MAX_CHARS = 1200
+PENDING_MAX_TURNS = 16          # job tóm tắt chậm/lỗi: bỏ bớt lượt cũ nhất thay vì phình RAM
+HISTORY_TOKEN_BUDGET = 1200
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng thô cho tiếng Việt: ~3 ký tự / token."""
+    return len(text) // 3 + 1
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _lock(session: dict) -> threading.Lock:
+    # setdefault của dict là nguyên tử -> 2 thread không tạo 2 lock khác nhau
+    return session.setdefault("memory_lock", threading.Lock())
+
+
+def reset(session: dict):
+    with _lock(session):
+        session["history"] = deque(maxlen=HISTORY_TURNS)
+        session["summary"] = ""
+        session["summary_pending"] = []
+
+
+def add_turn(session: dict, role: str, text: str):
+    """role: "user" (TVV) hoặc "assistant" (bot)."""
+    if not text:
+        return
+    if session.get("history") is None:
+        reset(session)
+    with _lock(session):
+        history = session["history"]
+        if len(history) == history.maxlen:
+            pending = session["summary_pending"]
+            pending.append(history[0])
+            del pending[:-PENDING_MAX_TURNS]
+        history.append((role, _clip(text, TURN_MAX_CHARS)))
+
+
+def take_pending(session: dict) -> list[tuple[str, str]] | None:
+    """Lấy các lượt cần tóm tắt nếu đã đủ 1 đợt (và xoá khỏi session)."""
+    with _lock(session):
+        pending = session.get("summary_pending") or []
+        if len(pending) < SUMMARY_BATCH:
+            return None
+        session["summary_pending"] = []
+        return pending
+
+
+def restore_pending(session: dict, turns: list[tuple[str, str]]):
+    """Job tóm tắt thất bại: trả lượt về hàng chờ (trước các lượt mới dồn thêm) để lần sau làm lại."""
+    with _lock(session):
+        pending = turns + (session.get("summary_pending") or [])
+        session["summary_pending"] = pending[-PENDING_MAX_TURNS:]
+
+
+def apply_summary(session: dict, summary: str):
+    with _lock(session):
+        session["summary"] = _clip(summary.strip(), SUMMARY_MAX_CHARS)
+
+
+def history_messages(session: dict, budget: int = HISTORY_TOKEN_BUDGET) -> list[dict]:
+    """
+    Tóm tắt (nếu có) + các lượt gần nhất, mới nhất được ưu tiên giữ lại khi vượt ngân sách.
+    Lượt cuối là tin TVV đang được trả lời thì bỏ qua (đã nằm trong câu hỏi gửi LLM).
+    """
+    with _lock(session):
+        summary = session.get("summary") or ""
+        turns = list(session.get("history") or ())
+
+    messages: list[dict] = []
+    if summary:
+        content = "[TÓM TẮT HỘI THOẠI TRƯỚC ĐÓ]: " + summary
+        budget -= estimate_tokens(content)
+        messages.append({"role": "system", "content": content})
+
+    if turns and turns[-1][0] == "user":
+        turns.pop()
+
+    recent: list[dict] = []
+    for role, text in reversed(turns):
+        cost = estimate_tokens(text)
+        if cost > budget:
+            break
+        budget -= cost
+        recent.append({"role": role, "content": text})
+    return messages + recent[::-1]
@@ -0,0 +1,63 @@
+"""
+Đo bộ nhớ thực của tiến trình (Linux, đọc /proc/<pid>/smaps_rollup).
+
+- rss: trang đang nằm trong RAM (đếm cả trang dùng chung với master/worker khác).
+- pss: rss chia đều trang dùng chung cho các tiến trình cùng dùng -> cộng pss các
+  worker mới ra đúng RAM tốn thật; private = phần riêng của worker (đã bị copy-on-write).
+
+Xem các worker gunicorn:
+    python memstat.py <pid master>
+"""
+import sys
+from pathlib import Path
+
+FIELDS = {
+    "Rss": "rss_kb",
+    "Pss": "pss_kb",
+    "Shared_Clean": "shared_clean_kb",
+    "Shared_Dirty": "shared_dirty_kb",
+    "Private_Clean": "private_clean_kb",
+    "Private_Dirty": "private_dirty_kb",
+}
+
+
+def process_memory(pid: int | str = "self") -> dict:
+    """Số kB theo FIELDS (+ private_kb); {} nếu không đọc được (không phải Linux...)."""
+    try:
+        text = Path(f"/proc/{pid}/smaps_rollup").read_text()
+    except OSError:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        if name in FIELDS:
+            out[FIELDS[name]] = int(rest.split()[0])
+    out["private_kb"] = out.get("private_clean_kb", 0) + out.get("private_dirty_kb", 0)
+    return out
+
+
+def children(pid: int) -> list[int]:
+    pids = []
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        try:
+            pids.extend(int(p) for p in (task / "children").read_text().split())
+        except OSError:
+            continue
+    return sorted(pids)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Dùng: python memstat.py <pid master>")
+        sys.exit(1)
+    master = int(sys.argv[1])
+    rows = [("master", master)] + [("worker", pid) for pid in children(master)]
+    total = {"rss_kb": 0, "pss_kb": 0}
+    print(f"{'':8}{'pid':>8}{'rss_kb':>10}{'pss_kb':>10}{'private_kb':>12}")
+    for role, pid in rows:
+        mem = process_memory(pid)
+        for key in total:
+            total[key] += mem.get(key, 0)
+        print(f"{role:8}{pid:>8}{mem.get('rss_kb', 0):>10}{mem.get('pss_kb', 0):>10}{mem.get('private_kb', 0):>12}")
+    print(f"{'total':8}{'':>8}{total['rss_kb']:>10}{total['pss_kb']:>10}")
+    sys.exit(0)
@@ -0,0 +1,51 @@
+"""
+Số liệu vận hành trong tiến trình (counter, tổng/đếm thời gian), xem qua /metrics.
+
+Không phụ thuộc thư viện ngoài; mỗi worker gunicorn có bộ đếm riêng.
+"""
+import threading
+
+_LOCK = threading.Lock()
+_COUNTERS: dict[str, float] = {}
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{inner}}}"
+
+
+def incr(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Ghi 1 quan sát (thường là ms): cộng dồn _count, _sum và giữ _max."""
+    count_key = _key(name + "_count", labels)
+    sum_key = _key(name + "_sum", labels)
+    max_key = _key(name + "_max", labels)
+    with _LOCK:
+        _COUNTERS[count_key] = _COUNTERS.get(count_key, 0) + 1
+        _COUNTERS[sum_key] = _COUNTERS.get(sum_key, 0) + value
+        if value > _COUNTERS.get(max_key, float("-inf")):
+            _COUNTERS[max_key] = value
+
+
+def get(name: str, default: float = 0, **labels) -> float:
+    with _LOCK:
+        return _COUNTERS.get(_key(name, labels), default)
+
+
+def mean(name: str, default: float = 0, **labels) -> float:
+    with _LOCK:
+        count = _COUNTERS.get(_key(name + "_count", labels), 0)
+        total = _COUNTERS.get(_key(name + "_sum", labels), 0)
+    return total / count if count else default
+
+
+def snapshot() -> dict[str, float]:
+    with _LOCK:
+        return dict(sorted(_COUNTERS.items()))
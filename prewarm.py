@@ -0,0 +1,123 @@
+"""
+Chọn câu hỏi hay gặp nhất từ log hội thoại gần đây để làm nóng cache câu trả lời LLM.
+
+Đọc phần cuối logs/conversations.log (LOG_TAIL_BYTES), ghép mỗi tin của TVV với tin bot
+trả lời ngay sau đó trong cùng chat (meta của bot có need/intent/branch), rồi đếm theo
+(need, intent, branch, câu hỏi đã chuẩn hoá). Bỏ qua lệnh, nút menu và tin quá ngắn;
+truyền branches thì chỉ giữ câu hỏi mà bot đã trả lời ở các nhánh đó (nhánh có gọi LLM).
+
+Chạy tay để xem danh sách:
+    python prewarm.py
+"""
+import json
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+CONV_LOG_PATH = BASE_DIR / "logs" / "conversations.log"
+
+LOG_TAIL_BYTES = 5 * 1024 * 1024
+MIN_QUESTION_CHARS = 8
+MENU_TEXTS = ("Phân tích case khách", "Hỏi combo / sản phẩm", "Chính sách & xử lý từ chối")
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Chuẩn hoá nhẹ (giữ dấu tiếng Việt): chữ thường, gộp khoảng trắng, bỏ dấu câu cuối."""
+    return _SPACES.sub(" ", text.lower()).strip().rstrip("?.!… ")
+
+
+def read_tail(path: Path, tail_bytes: int = LOG_TAIL_BYTES) -> list[dict]:
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(size - tail_bytes, 0))
+            if size > tail_bytes:
+                f.readline()            # bỏ dòng đầu bị cắt dở
+            raw = f.read()
+    except OSError as e:
+        print("Không đọc được log để prewarm:", e)
+        return []
+
+    records = []
+    for line in raw.splitlines():
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(rec, dict):
+            records.append(rec)
+    return records
+
+
+def chat_key(rec: dict) -> tuple:
+    """
+    (bot, chat) của 1 dòng log. Tin bot ghi user_id = chat_id; tin TVV có meta.chat_id
+    (log cũ không có -> coi như chat riêng, chat_id = user_id).
+    """
+    meta = rec.get("meta") or {}
+    if rec.get("direction") == "user":
+        return meta.get("bot"), meta.get("chat_id", rec.get("user_id"))
+    return meta.get("bot"), rec.get("user_id")
+
+
+def is_question(text: str) -> bool:
+    if len(text) < MIN_QUESTION_CHARS or text.startswith("/"):
+        return False
+    return not any(menu in text for menu in MENU_TEXTS)
+
+
+def top_questions(
+    records: list[dict],
+    branches: set[str] | None = None,
+    per_group: int = 5,
+    limit: int = 50,
+) -> list[tuple[str | None, str | None, str | None, str, int]]:
+    """
+    (need, intent, branch, câu hỏi mẫu, số lần), nhiều nhất trước; mỗi (need, intent, branch)
+    tối đa per_group câu. Log cũ chưa có branch thì bị bỏ khi lọc theo branches.
+    Mỗi chat được xử lý tuần tự nên tin bot đầu tiên sau tin TVV trong cùng chat là câu trả lời.
+    """
+    pending: dict = {}                  # (bot, chat) -> câu hỏi chuẩn hoá đang chờ bot trả lời
+    counts: Counter = Counter()
+    samples: dict[str, str] = {}        # câu chuẩn hoá -> 1 câu gốc để gửi LLM
+
+    for rec in records:
+        direction = rec.get("direction")
+        text = str(rec.get("text") or "").strip()
+        if direction == "user":
+            if is_question(text):
+                norm = normalize_question(text)
+                pending[chat_key(rec)] = norm
+                samples.setdefault(norm, text)
+            else:
+                pending.pop(chat_key(rec), None)
+        elif direction == "bot":
+            norm = pending.pop(chat_key(rec), None)
+            if norm:
+                meta = rec.get("meta") or {}
+                branch = meta.get("branch")
+                if branches is None or branch in branches:
+                    counts[(meta.get("need"), meta.get("intent"), branch, norm)] += 1
+
+    picked = []
+    per: Counter = Counter()
+    for (need, intent, branch, norm), n in counts.most_common():
+        group = (need, intent, branch)
+        if per[group] >= per_group:
+            continue
+        per[group] += 1
+        picked.append((need, intent, branch, samples[norm], n))
+        if len(picked) >= limit:
+            break
+    return picked
+
+
+if __name__ == "__main__":
+    for need, intent, branch, question, n in top_questions(read_tail(CONV_LOG_PATH)):
+        print(f"{n:5d}  {need}/{intent}/{branch}  {question}")
+    sys.exit(0)
@@ -0,0 +1,133 @@
+"""
+Chỉ mục trong RAM cho hồ sơ người dùng (users_store) phục vụ export /admin/users.
+
+Giữ song song với store (cập nhật mỗi lần hồ sơ đổi):
+- danh sách (last_seen, uid) đã sắp xếp -> phân trang bằng cursor + lọc theo khoảng last_seen
+- uid theo nhu cầu chính (main_needs nhiều nhất) và intent chính (intents_count nhiều nhất)
+- last_seen / total_messages của từng uid -> lọc không cần đụng tới hồ sơ đầy đủ
+
+Truy vấn chỉ trả về danh sách uid của 1 trang; route tự lấy hồ sơ và stream từng dòng.
+"""
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+
+def top_key(counts: dict | None) -> str | None:
+    """Khoá có số đếm lớn nhất (hoà thì theo tên) – None nếu chưa có."""
+    if not counts:
+        return None
+    return max(sorted(counts), key=lambda k: counts.get(k) or 0)
+
+
+def encode_cursor(last_seen: str, uid: str) -> str:
+    raw = json.dumps([last_seen, uid], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """ValueError nếu cursor hỏng."""
+    try:
+        last_seen, uid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("cursor không hợp lệ") from e
+    return str(last_seen), str(uid)
+
+
+class ProfileIndex:
+    def __init__(self):
+        self._order: list[tuple[str, str]] = []                 # (last_seen, uid) tăng dần
+        self._state: dict[str, tuple[str, int, str | None, str | None]] = {}
+        self._by_need: dict[str, set[str]] = {}
+        self._by_intent: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def rebuild(self, store: dict):
+        with self._lock:
+            self._order.clear()
+            self._state.clear()
+            self._by_need.clear()
+            self._by_intent.clear()
+        for uid, profile in store.items():
+            self.update(uid, profile)
+
+    def update(self, uid: str, profile: dict):
+        state = (
+            str(profile.get("last_seen") or ""),
+            int(profile.get("total_messages") or 0),
+            top_key(profile.get("main_needs")),
+            top_key(profile.get("intents_count")),
+        )
+        with self._lock:
+            old = self._state.get(uid)
+            if old == state:
+                return
+            if old is not None:
+                pos = bisect_left(self._order, (old[0], uid))
+                if pos < len(self._order) and self._order[pos] == (old[0], uid):
+                    del self._order[pos]
+                self._by_need.get(old[2], set()).discard(uid)
+                self._by_intent.get(old[3], set()).discard(uid)
+            insort(self._order, (state[0], uid))
+            if state[2]:
+                self._by_need.setdefault(state[2], set()).add(uid)
+            if state[3]:
+                self._by_intent.setdefault(state[3], set()).add(uid)
+            self._state[uid] = state
+
+    def query(
+        self,
+        limit: int,
+        cursor: str | None = None,
+        last_seen_from: str | None = None,
+        last_seen_to: str | None = None,
+        min_messages: int | None = None,
+        max_messages: int | None = None,
+        need: str | None = None,
+        intent: str | None = None,
+    ) -> tuple[list[str], str | None]:
+        """
+        uid của 1 trang theo thứ tự (last_seen, uid) + cursor trang sau (None = hết).
+        cursor: vị trí cuối của trang trước (encode_cursor). ValueError nếu cursor hỏng.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            # Lọc need/intent: đi từ tập uid nhỏ nhất (đã sắp theo thứ tự phân trang)
+            candidates = None
+            for index, value in ((self._by_need, need), (self._by_intent, intent)):
+                if value is not None:
+                    uids = index.get(value, set())
+                    candidates = uids if candidates is None else candidates & uids
+            if candidates is not None:
+                keys = sorted((self._state[uid][0], uid) for uid in candidates)
+            else:
+                keys = self._order
+
+            start = 0
+            if after:
+                start = bisect_right(keys, after)
+            if last_seen_from:
+                start = max(start, bisect_left(keys, (last_seen_from, "")))
+            stop = len(keys)
+            if last_seen_to:
+                # last_seen_to bao gồm cả ngày/giờ đó (so sánh theo tiền tố ISO)
+                stop = bisect_right(keys, (last_seen_to + "\uffff", ""))
+
+            page: list[str] = []
+            last_key = None
+            for pos in range(start, stop):
+                key = keys[pos]
+                total = self._state[key[1]][1]
+                if min_messages is not None and total < min_messages:
+                    continue
+                if max_messages is not None and total > max_messages:
+                    continue
+                if len(page) == limit:
+                    return page, encode_cursor(*last_key)
+                page.append(key[1])
+                last_key = key
+        return page, None
@@ -0,0 +1,216 @@
+"""
+Profile theo yêu cầu cho traffic thật (bật qua /admin/profile).
+
+Khi tắt, webhook chỉ tốn 1 lần đọc biến (PROFILE is None). Khi bật, N request kế
+tiếp (hoặc trong T giây) được đo và gom theo nhánh xử lý (flask.g.branch):
+
+- mode="cprofile": cProfile cho từng request, gộp thành pstats theo nhánh. Mỗi lúc chỉ 1
+  request được đo (Python 3.12+ không cho 2 profiler cùng bật); request chạy chồng thì bỏ qua,
+  không tính vào N.
+- mode="sample": thread lấy mẫu stack của request mỗi SAMPLE_INTERVAL giây,
+  xuất dạng collapsed stack ("a;b;c 12") để vẽ flamegraph.
+- memory=True: tracemalloc, so snapshot trước/sau mỗi request -> top dòng cấp phát.
+  Nhiều request chạy song song thì số liệu cấp phát chỉ mang tính ước lượng.
+  Hết giờ (timer) hoặc hết N request thì tắt tracemalloc ngay, không chờ request kế tiếp.
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005
+TOP_LINES = 30
+
+# cProfile chỉ bật được 1 profiler mỗi lúc trong cả tiến trình
+_CPROFILE_BUSY = threading.Lock()
+
+
+class ProfileSession:
+    def __init__(self, max_requests: int, seconds: float, mode: str = "cprofile", memory: bool = False):
+        self.mode = mode
+        self.memory = memory
+        self.remaining = max_requests
+        self.deadline = time.monotonic() + seconds
+        self.started_at = time.time()
+        self.stats: dict[str, pstats.Stats] = {}
+        self.stacks: dict[str, Counter] = {}
+        self.allocs: dict[str, Counter] = {}
+        self.requests: Counter = Counter()
+        self.skipped = 0                # request chạy chồng, không đo được bằng cProfile
+        self.finished = False
+        self._lock = threading.Lock()
+        self._own_tracemalloc = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._own_tracemalloc = True
+        self._timer = threading.Timer(seconds, self.stop)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def claim(self) -> bool:
+        """Giữ 1 lượt đo cho request hiện tại; hết lượt/hết giờ thì kết thúc phiên."""
+        with self._lock:
+            if self.finished:
+                return False
+            if self.remaining <= 0 or time.monotonic() > self.deadline:
+                self._finish()
+                return False
+            self.remaining -= 1
+            return True
+
+    def _finish(self):
+        self.finished = True
+        self._timer.cancel()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+
+    def stop(self):
+        with self._lock:
+            self._finish()
+
+    def _skip(self):
+        """Trả lại lượt đo đã giữ cho request không đo được."""
+        with self._lock:
+            self.remaining += 1
+            self.skipped += 1
+
+    def run(self, func, branch_of):
+        """Chạy func() có đo; branch_of() trả về tên nhánh sau khi func chạy xong."""
+        prof = sampler = None
+        if self.mode == "sample":
+            sampler = _Sampler(threading.get_ident())
+        else:
+            if not _CPROFILE_BUSY.acquire(blocking=False):
+                self._skip()
+                return func()
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # công cụ profile khác (debugger, sys.monitoring...) đang chiếm
+                _CPROFILE_BUSY.release()
+                self._skip()
+                return func()
+
+        before = tracemalloc.take_snapshot() if self.memory and tracemalloc.is_tracing() else None
+        if sampler:
+            sampler.start()
+        try:
+            return func()
+        finally:
+            if prof:
+                prof.disable()
+                _CPROFILE_BUSY.release()
+            if sampler:
+                sampler.stop()
+            after = tracemalloc.take_snapshot() if before is not None and tracemalloc.is_tracing() else None
+            self._record(branch_of(), prof, sampler, before, after)
+            if self.remaining <= 0:
+                self.stop()
+
+    def _record(self, branch, prof, sampler, before, after):
+        diffs = after.compare_to(before, "lineno")[:TOP_LINES] if after else []
+        with self._lock:
+            self.requests[branch] += 1
+            if prof:
+                if branch in self.stats:
+                    self.stats[branch].add(prof)
+                else:
+                    self.stats[branch] = pstats.Stats(prof)
+            if sampler:
+                self.stacks.setdefault(branch, Counter()).update(sampler.stacks)
+            if diffs:
+                allocs = self.allocs.setdefault(branch, Counter())
+                for diff in diffs:
+                    frame = diff.traceback[0]
+                    allocs[f"{frame.filename}:{frame.lineno}"] += diff.size_diff
+
+    def report(self) -> dict:
+        with self._lock:
+            branches = {}
+            for branch, count in self.requests.items():
+                entry: dict = {"requests": count}
+                if branch in self.stats:
+                    out = io.StringIO()
+                    stats = self.stats[branch]
+                    stats.stream = out
+                    stats.sort_stats("cumulative").print_stats(TOP_LINES)
+                    entry["pstats"] = out.getvalue()
+                if branch in self.stacks:
+                    entry["collapsed"] = "\n".join(
+                        f"{stack} {n}" for stack, n in self.stacks[branch].most_common()
+                    )
+                if branch in self.allocs:
+                    entry["alloc_top"] = [
+                        {"site": site, "bytes": size}
+                        for site, size in self.allocs[branch].most_common(TOP_LINES)
+                    ]
+                branches[branch] = entry
+            return {
+                "mode": self.mode,
+                "memory": self.memory,
+                "started_at": self.started_at,
+                "active": not self.finished and self.remaining > 0 and time.monotonic() <= self.deadline,
+                "remaining_requests": max(self.remaining, 0),
+                "skipped_concurrent": self.skipped,
+                "branches": branches,
+            }
+
+
+class _Sampler:
+    """Lấy mẫu stack của 1 thread, đếm theo collapsed stack."""
+
+    def __init__(self, ident: int):
+        self.ident = ident
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.ident)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+# Phiên đang chạy (None = tắt) và phiên gần nhất (để xem báo cáo sau khi đã xong)
+PROFILE: ProfileSession | None = None
+LAST: ProfileSession | None = None
+
+
+def start(max_requests: int, seconds: float, mode: str = "cprofile", memory: bool = False) -> ProfileSession:
+    global PROFILE, LAST
+    if PROFILE is not None:
+        PROFILE.stop()
+    PROFILE = LAST = ProfileSession(max_requests, seconds, mode=mode, memory=memory)
+    return PROFILE
+
+
+def profiled(func, branch_of):
+    """Gọi func(); nếu đang có phiên profile thì đo request này."""
+    global PROFILE
+    session = PROFILE
+    if session is None:
+        return func()
+    if not session.claim():
+        if PROFILE is session:
+            PROFILE = None
+        return func()
+    return session.run(func, branch_of)
@@ -0,0 +1,179 @@
+"""
+Prompt & ngữ cảnh gửi OpenAI.
+
+Tách riêng khỏi app.py để các job chạy nền (sinh sẵn coaching...) dùng
+lại đúng prompt của bot mà không cần TELEGRAM_TOKEN / Flask.
+"""
+from catalog import Combo, Product
+
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_TEMPERATURE = 0.4
+
+# ========= PROMPT HỆ THỐNG =========
+BASE_SYSTEM_PROMPT = (
+    "Bạn là TRỢ LÝ AI NỘI BỘ cho đội ngũ TƯ VẤN VIÊN của công ty Con Đường Xanh (WELLLAB).\n"
+    "Người đang nhắn với bạn là TƯ VẤN VIÊN, không phải khách hàng cuối.\n\n"
+    "NHIỆM VỤ CHÍNH:\n"
+    "- Giúp tư vấn viên hiểu rõ từng combo/sản phẩm, đối tượng dùng, cách giải thích đơn giản cho khách.\n"
+    "- Hướng dẫn tư vấn viên đặt câu hỏi khai thác nhu cầu, gợi ý kịch bản tư vấn và kịch bản chốt đơn.\n"
+    "- Gợi ý cách xử lý từ chối/lo lắng của khách một cách tinh tế, tôn trọng, tuân thủ quy định.\n"
+    "- Chỉ sử dụng các combo/sản phẩm có trong ngữ cảnh nội bộ, không bịa thêm.\n\n"
+    "CÁCH TRẢ LỜI:\n"
+    "- Trả lời ngắn gọn, rõ ý, ưu tiên bullet.\n"
+    "- Thường chia thành 3–4 phần: (1) Tóm tắt case khách; "
+    "(2) Gợi ý câu hỏi tư vấn viên nên hỏi; "
+    "(3) Gợi ý combo/sản phẩm phù hợp và cách GIẢI THÍCH CHO KHÁCH; "
+    "(4) Gợi ý 1–2 câu chốt mềm.\n"
+    "- Xưng hô với người đang chat là 'anh/chị' (tư vấn viên). Không nói như đang chat trực tiếp với khách.\n"
+)
+
+# ========= CÂU LỆNH COACHING CỐ ĐỊNH =========
+PRODUCT_COACH_PROMPT = (
+    "Tư vấn viên đang hỏi về *một sản phẩm cụ thể* dưới đây.\n"
+    "Hãy hướng dẫn cách GIẢI THÍCH đơn giản cho khách (đối tượng dùng, lợi ích chính, cách dùng), "
+    "và gợi ý 1–2 câu chốt đơn mềm, không lặp lại toàn bộ thông tin chi tiết y nguyên.\n"
+)
+
+COMBO_COACH_PROMPT = (
+    "Tư vấn viên đang hỏi về *một combo/bộ sản phẩm cụ thể*.\n"
+    "Hãy hướng dẫn cách giải thích cho khách: vấn đề sức khoẻ nào phù hợp, "
+    "ưu điểm của combo, cách dùng tổng quát, và gợi ý 1–2 câu chốt.\n"
+)
+
+
+# ========= CONTEXT GỬI OPENAI =========
+def build_combo_context(combo: Combo | None) -> str:
+    if not combo:
+        return "Hiện chưa xác định được combo cụ thể."
+
+    lines: list[str] = []
+    lines.append(f"Combo: {combo.name}")
+    header = combo.header_text
+    if header:
+        lines.append("\n[Thông tin]:")
+        lines.append(header)
+
+    duration = combo.duration_text
+    if duration:
+        lines.append("\n[Thời gian liệu trình khuyến nghị]:")
+        lines.append(duration)
+
+    prods = combo.products
+    if prods:
+        lines.append("\n[Thành phần combo]:")
+        for idx, p in enumerate(prods, start=1):
+            name = p.name
+            text = p.text
+            code = p.code
+            url_p = p.url
+            line = f"{idx}. {name}"
+            if code:
+                line += f" ({code})"
+            if text:
+                line += f": {text}"
+            if url_p:
+                line += f" [LINK: {url_p}]"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def build_product_context(prod: Product | None) -> str:
+    if not prod:
+        return "Chưa có sản phẩm cụ thể."
+    name = prod.name
+    code = prod.code
+    price = prod.price
+    ingredients = prod.ingredients
+    usage = prod.usage
+    benefits = prod.benefits
+    link = prod.url
+    lines = [
+        f"Tên: {name}",
+        f"Mã: {code}",
+        f"Giá: {price}",
+        f"Thành phần: {ingredients}",
+        f"Cách dùng: {usage}",
+        f"Lợi ích chính: {benefits}",
+        f"Link: {link}",
+    ]
+    return "\n".join(lines)
+
+
+def build_profile_context(profile: dict) -> str:
+    if not profile:
+        return "Chưa có thêm thông tin cụ thể về tuổi, giới tính hay bệnh nền."
+    parts: list[str] = []
+    if profile.get("age"):
+        parts.append(f"Tuổi khoảng: {profile['age']}.")
+    if profile.get("gender"):
+        parts.append(f"Giới tính: {profile['gender']}.")
+    if profile.get("has_chronic") is True:
+        parts.append("Có bệnh nền (chi tiết chưa rõ).")
+    elif profile.get("has_chronic") is False:
+        parts.append("Không có bệnh nền.")
+    return " ".join(parts)
+
+
+def build_openai_messages(
+    user_text: str,
+    session: dict,
+    combo: Combo | None = None,
+    product: Product | None = None,
+    system_prompt: str = BASE_SYSTEM_PROMPT,
+    history: list[dict] | None = None,
+) -> list[dict]:
+    """
+    Dựng đúng danh sách messages gửi chat.completions cho 1 câu hỏi.
+    history: tóm tắt + các lượt gần đây (memory.history_messages), chèn trước câu hỏi.
+    """
+    intent = session.get("intent")
+    profile = session.get("profile", {})
+
+    combo_ctx = build_combo_context(combo)
+    product_ctx = build_product_context(product)
+    profile_ctx = build_profile_context(profile)
+    intent_text = f"Intent hiện tại (ước đoán vấn đề sức khỏe): {intent or 'chưa rõ'}."
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "system",
+            "content": (
+                "Dữ liệu nội bộ của WELLLAB cho case này:\n"
+                + intent_text
+                + "\n\n[HỒ SƠ KHÁCH HÀNG (nếu có)]: "
+                + profile_ctx
+                + "\n\n[COMBO LIÊN QUAN]:\n"
+                + combo_ctx
+                + "\n\n[SẢN PHẨM LIÊN QUAN]:\n"
+                + product_ctx
+            ),
+        },
+        *(history or ()),
+        {"role": "user", "content": user_text},
+    ]
+
+
+# ========= TÓM TẮT HỘI THOẠI =========
+SUMMARY_PROMPT = (
+    "Bạn tóm tắt hội thoại giữa TƯ VẤN VIÊN và trợ lý AI để dùng làm ngữ cảnh cho các câu trả lời sau.\n"
+    "Giữ lại: vấn đề sức khỏe/case khách, thông tin hồ sơ (tuổi, giới tính, bệnh nền, thuốc), "
+    "combo/sản phẩm đã gợi ý, thắc mắc hoặc từ chối còn dang dở.\n"
+    "Viết tối đa 6 bullet ngắn, không thêm thông tin mới."
+)
+
+
+def build_summary_messages(previous_summary: str, turns: list[tuple[str, str]]) -> list[dict]:
+    lines = [("TVV: " if role == "user" else "Trợ lý: ") + text for role, text in turns]
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                "Tóm tắt hiện có:\n"
+                + (previous_summary or "(chưa có)")
+                + "\n\nCác lượt hội thoại cần gộp thêm:\n"
+                + "\n".join(lines)
+            ),
+        },
+    ]
@@ -0,0 +1,259 @@
+"""
+Nhắc follow-up cho TVV ("/nhac 7 ngày gọi lại KH"), lưu bền trong SQLite (data/reminders.sqlite).
+
+- ReminderStore: bảng reminders + index theo due_ts của các nhắc chưa gửi -> mỗi lần nạp
+  chỉ đọc đúng khoảng thời gian cần, không quét toàn bộ dù có hàng chục nghìn nhắc.
+- Scheduler: heap (due_ts, id) chỉ giữ các nhắc đến hạn trong HORIZON_SECONDS tới;
+  gần hết khoảng đã nạp thì nạp tiếp từ SQLite. Restart = nạp lại từ DB (nhắc quá hạn gửi ngay).
+  Nạp theo con trỏ (due_ts, id) -> hơn LOAD_BATCH nhắc trùng due_ts vẫn nạp tiếp được.
+- Gửi: đánh dấu fired_ts trong DB trước (UPDATE ... WHERE fired_ts IS NULL), ai đánh dấu
+  được mới gửi -> nhiều worker gunicorn cùng chạy scheduler cũng không gửi trùng.
+  fire() trả về False (hoặc raise) = gửi lỗi -> bỏ đánh dấu, hẹn gửi lại sau RETRY_DELAYS;
+  hết lượt thử thì bỏ hẳn (giữ fired_ts, attempts = số lần đã thử).
+- clock truyền vào được (mặc định time.time) -> test bằng đồng hồ giả + run_pending().
+"""
+import heapq
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+HORIZON_SECONDS = 3600          # heap chỉ giữ nhắc đến hạn trong 1 giờ tới
+LOAD_BATCH = 5000               # số dòng tối đa mỗi lần nạp từ DB
+MAX_PENDING_PER_CHAT = 50
+RETRY_DELAYS = (60, 300, 1800)  # gửi lỗi: thử lại sau 1 phút, 5 phút, 30 phút
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bot_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER,
+    due_ts REAL NOT NULL,
+    note TEXT NOT NULL DEFAULT '',
+    case_text TEXT,                -- session["first_issue"] lúc tạo
+    combo TEXT,                    -- tên combo gần nhất của case
+    intent TEXT,
+    created_ts REAL NOT NULL,
+    fired_ts REAL,                 -- NULL = chưa gửi
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0   -- số lần gửi lỗi
+);
+CREATE INDEX IF NOT EXISTS reminders_pending_due ON reminders (due_ts)
+    WHERE fired_ts IS NULL AND cancelled = 0;
+CREATE INDEX IF NOT EXISTS reminders_chat ON reminders (bot_id, chat_id)
+    WHERE fired_ts IS NULL AND cancelled = 0;
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class Reminder:
+    id: int
+    bot_id: str
+    chat_id: int
+    user_id: int | None
+    due_ts: float
+    note: str
+    case_text: str | None
+    combo: str | None
+    intent: str | None
+
+
+_COLUMNS = "id, bot_id, chat_id, user_id, due_ts, note, case_text, combo, intent"
+_PENDING = "fired_ts IS NULL AND cancelled = 0"
+
+
+class ReminderStore:
+    def __init__(self, path: Path | str):
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(reminders)")}
+        if "attempts" not in columns:       # DB tạo trước khi có gửi lại
+            self._db.execute("ALTER TABLE reminders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        bot_id: str,
+        chat_id: int,
+        user_id: int | None,
+        due_ts: float,
+        note: str = "",
+        case_text: str | None = None,
+        combo: str | None = None,
+        intent: str | None = None,
+        now: float | None = None,
+    ) -> Reminder:
+        created_ts = time.time() if now is None else now
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO reminders (bot_id, chat_id, user_id, due_ts, note, case_text, combo, intent, created_ts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (bot_id, chat_id, user_id, due_ts, note, case_text, combo, intent, created_ts),
+            )
+            rid = cur.lastrowid
+        return Reminder(rid, bot_id, chat_id, user_id, due_ts, note, case_text, combo, intent)
+
+    def pending_between(
+        self, start: float, end: float, limit: int = LOAD_BATCH, after_id: int = -1
+    ) -> list[Reminder]:
+        """
+        Nhắc chưa gửi có (due_ts, id) > (start, after_id) và due_ts < end, theo thứ tự (due_ts, id)
+        (đi theo index due_ts; id là rowid nên đã nằm sẵn trong index). after_id=-1: due_ts >= start.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_COLUMNS} FROM reminders WHERE {_PENDING}"
+                " AND due_ts >= ? AND due_ts < ? AND (due_ts > ? OR id > ?)"
+                " ORDER BY due_ts, id LIMIT ?",
+                (start, end, start, after_id, limit),
+            ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def pending_for_chat(self, bot_id: str, chat_id: int) -> list[Reminder]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_COLUMNS} FROM reminders WHERE {_PENDING} AND bot_id = ? AND chat_id = ?"
+                " ORDER BY due_ts",
+                (bot_id, chat_id),
+            ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def claim(self, rid: int, now: float) -> bool:
+        """Đánh dấu đã gửi; False nếu đã bị huỷ / tiến trình khác gửi rồi."""
+        with self._lock:
+            cur = self._db.execute(f"UPDATE reminders SET fired_ts = ? WHERE id = ? AND {_PENDING}", (now, rid))
+        return cur.rowcount == 1
+
+    def retry(self, rid: int, now: float) -> Reminder | None:
+        """
+        Nhắc đã claim nhưng gửi lỗi: bỏ đánh dấu, dời due_ts theo RETRY_DELAYS.
+        None nếu đã hết lượt thử (nhắc giữ trạng thái đã gửi, không nạp lại nữa).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM reminders WHERE id = ?", (rid,)).fetchone()
+            if row is None or row[0] >= len(RETRY_DELAYS):
+                if row is not None:
+                    self._db.execute("UPDATE reminders SET attempts = attempts + 1 WHERE id = ?", (rid,))
+                return None
+            due_ts = now + RETRY_DELAYS[row[0]]
+            self._db.execute(
+                "UPDATE reminders SET fired_ts = NULL, due_ts = ?, attempts = attempts + 1 WHERE id = ?",
+                (due_ts, rid),
+            )
+            out = self._db.execute(f"SELECT {_COLUMNS} FROM reminders WHERE id = ?", (rid,)).fetchone()
+        return Reminder(*out)
+
+    def cancel(self, rid: int, bot_id: str, chat_id: int) -> bool:
+        with self._lock:
+            cur = self._db.execute(
+                f"UPDATE reminders SET cancelled = 1 WHERE id = ? AND bot_id = ? AND chat_id = ? AND {_PENDING}",
+                (rid, bot_id, chat_id),
+            )
+        return cur.rowcount == 1
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Scheduler:
+    def __init__(self, store: ReminderStore, fire, clock=time.time, horizon: float = HORIZON_SECONDS):
+        """fire(reminder) được gọi ở thread của scheduler khi nhắc đến hạn; trả về False = gửi lỗi."""
+        self.store = store
+        self.fire = fire
+        self.clock = clock
+        self.horizon = horizon
+        self._heap: list[tuple[float, int, Reminder]] = []
+        self._ids: set[int] = set()
+        # Con trỏ nạp: mọi nhắc có (due_ts, id) <= (_loaded_until, _loaded_id) đã nằm trong heap
+        self._loaded_until = 0.0
+        self._loaded_id = -1
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _push(self, reminder: Reminder):
+        if reminder.id not in self._ids:
+            self._ids.add(reminder.id)
+            heapq.heappush(self._heap, (reminder.due_ts, reminder.id, reminder))
+
+    def _refill(self, now: float):
+        target = now + self.horizon
+        while self._loaded_until < target:
+            rows = self.store.pending_between(self._loaded_until, target, LOAD_BATCH, self._loaded_id)
+            for reminder in rows:
+                self._push(reminder)
+            if len(rows) < LOAD_BATCH:
+                self._loaded_until, self._loaded_id = target, -1
+            else:
+                # Chưa nạp hết khoảng: dừng ở nhắc cuối, lần sau nạp tiếp từ sau nó
+                self._loaded_until, self._loaded_id = rows[-1].due_ts, rows[-1].id
+                break
+
+    def schedule(self, reminder: Reminder):
+        """Nhắc vừa tạo (đã lưu DB): nằm trong khoảng đã nạp thì đưa vào heap ngay."""
+        with self._lock:
+            if (reminder.due_ts, reminder.id) <= (self._loaded_until, self._loaded_id):
+                self._push(reminder)
+        self._wake.set()
+
+    def run_pending(self) -> int:
+        """Gửi mọi nhắc đã đến hạn theo clock; trả về số nhắc đã gửi."""
+        now = self.clock()
+        due: list[Reminder] = []
+        with self._lock:
+            if self._loaded_until < now + self.horizon / 2:
+                self._refill(now)
+            while self._heap and self._heap[0][0] <= now:
+                _, rid, reminder = heapq.heappop(self._heap)
+                self._ids.discard(rid)
+                due.append(reminder)
+
+        fired = 0
+        for reminder in due:
+            if not self.store.claim(reminder.id, now):
+                continue
+            try:
+                ok = self.fire(reminder) is not False
+            except Exception as e:
+                print(f"Lỗi gửi nhắc #{reminder.id}:", e)
+                ok = False
+            if ok:
+                fired += 1
+                continue
+            retry = self.store.retry(reminder.id, now)
+            if retry:
+                self.schedule(retry)
+            else:
+                print(f"Bỏ nhắc #{reminder.id}: gửi lỗi {len(RETRY_DELAYS) + 1} lần")
+        return fired
+
+    def next_delay(self) -> float:
+        """Số giây tới lần cần chạy run_pending kế tiếp (nhắc sớm nhất hoặc lúc nạp thêm)."""
+        now = self.clock()
+        with self._lock:
+            wake_at = self._loaded_until - self.horizon / 2
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+        return max(wake_at - now, 0.0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_pending()
+            self._wake.wait(min(self.next_delay(), self.horizon))
+            self._wake.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="reminders", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
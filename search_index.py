@@ -0,0 +1,369 @@
+"""
+Chỉ mục tìm combo / sản phẩm chịu được lỗi gõ (typo, thiếu dấu).
+
+- Từ (tên, alias) được chuẩn hóa không dấu, tách token theo ký tự chữ/số.
+- Token của câu hỏi khớp theo thứ tự ưu tiên:
+    trùng hẳn (1.0) > là chuỗi con của 1 từ (0.9) > sai khác ≤ k lỗi (0.7 / 0.5),
+  lỗi = thêm / bớt / thay 1 ký tự hoặc đảo 2 ký tự liền nhau.
+  k phụ thuộc độ dài token: < 4 ký tự: 0, 4–7: 1, ≥ 8: 2.
+  Token 2 ký tự chỉ khớp từ trùng hẳn (tránh "01", "ho"... khớp nhầm hàng loạt).
+- Khớp fuzzy của từ (không phải mã) phải giữ nguyên ký tự đầu (như prefix_length của
+  FuzzyQuery trong Lucene): đổi phụ âm đầu là ra từ khác hẳn ("xuong" ≠ "duong").
+  Ứng viên lấy qua chỉ mục trigram chia theo (ký tự đầu, độ dài) -> chỉ đếm trigram trên
+  các từ dài chênh ≤ k; phải chung ≥ FUZZY_MIN_SIMILARITY số trigram của từ dài hơn
+  mới chạy bounded Levenshtein.
+- Mã sản phẩm (toàn số) qua bảng "bỏ 1 ký tự" (deletion neighbourhood) – nhanh hơn
+  BK-tree với mã số ngắn.
+- Token phổ biến (xuất hiện ở > 2% tài liệu) chỉ cộng điểm cho ứng viên đã khớp
+  token hiếm hơn, nên câu hỏi dài không phải quét hàng nghìn tài liệu.
+
+Benchmark (catalog giả lập 10k SKU):
+    python search_index.py --bench --size 10000
+"""
+import heapq
+import re
+import unicodedata
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+EXACT_WEIGHT = 1.0
+SUBSTRING_WEIGHT = 0.9
+FUZZY_WEIGHTS = {1: 0.7, 2: 0.5}
+FUZZY_MIN_SIMILARITY = 0.5      # tỉ lệ trigram chung tối thiểu (so với từ dài hơn) để xét fuzzy
+
+
+def normalize_text(s: str) -> str:
+    """Bỏ dấu, về thường để so khớp linh hoạt hơn."""
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    return s.lower().replace("đ", "d").strip()
+
+
+def tokenize(s: str) -> list[str]:
+    return TOKEN_RE.findall(normalize_text(s))
+
+
+def max_edits(token: str) -> int:
+    if len(token) < 4:
+        return 0
+    if len(token) < 8:
+        return 1
+    return 2
+
+
+def _one_edit(a: str, b: str) -> int:
+    """Khoảng cách (0, 1 hoặc 2 = "hơn 1") cho trường hợp k = 1, không cần bảng DP."""
+    if a == b:
+        return 0
+    la, lb = len(a), len(b)
+    if la > lb:
+        a, b, la, lb = b, a, lb, la
+    if lb - la > 1:
+        return 2
+    i = 0
+    while i < la and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        if a[i + 1:] == b[i + 1:]:
+            return 1
+        # Đảo 2 ký tự liền nhau ("exapin" -> "expain")
+        if i + 1 < la and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]:
+            return 1
+        return 2
+    return 1 if a[i:] == b[i + 1:] else 2
+
+
+def bounded_levenshtein(a: str, b: str, k: int) -> int:
+    """
+    Khoảng cách Levenshtein (tính cả đảo 2 ký tự liền nhau) nếu ≤ k,
+    ngược lại trả về k + 1.
+    """
+    if abs(len(a) - len(b)) > k:
+        return k + 1
+    if k == 1:
+        return _one_edit(a, b)
+    # Bỏ phần đầu/cuối giống nhau, chỉ chạy DP trên phần khác biệt
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    a, b = a[i:], b[i:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return len(a) + len(b) if len(a) + len(b) <= k else k + 1
+    # DP chỉ trên dải |i - j| <= k
+    big = k + 1
+    la, lb = len(a), len(b)
+    prev = [j if j <= k else big for j in range(lb + 1)]
+    prev2: list[int] = []
+    for i in range(1, la + 1):
+        lo = max(1, i - k)
+        hi = min(lb, i + k)
+        cur = [big] * (lb + 1)
+        cur[0] = i if i <= k else big
+        ca = a[i - 1]
+        row_min = cur[0]
+        for j in range(lo, hi + 1):
+            v = prev[j - 1] + (ca != b[j - 1])
+            if prev[j] + 1 < v:
+                v = prev[j] + 1
+            if cur[j - 1] + 1 < v:
+                v = cur[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == b[j - 1] and prev2[j - 2] + 1 < v:
+                v = prev2[j - 2] + 1
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > k:
+            return big
+        prev2, prev = prev, cur
+    return prev[lb] if prev[lb] <= k else big
+
+
+class FuzzyIndex:
+    """
+    Chỉ mục trên danh sách tài liệu; mỗi tài liệu là list các chuỗi
+    (tên, alias, mã...). search() trả về (điểm, id tài liệu) theo điểm giảm dần.
+    """
+
+    def __init__(self, docs: list[list[str]]):
+        self.size = len(docs)
+        self.term_ids: dict[str, int] = {}
+        self.terms: list[str] = []
+        self.term_docs: list[list[int]] = []
+        self.grams: dict[str, set[int]] = {}       # trigram (có pad 2 đầu) -> term id
+        # (ký tự đầu, độ dài) -> trigram -> term id: ứng viên fuzzy cho từ không phải mã
+        self.fuzzy_grams: dict[tuple[str, int], dict[str, list[int]]] = {}
+        self.code_deletes: dict[str, set[int]] = {}  # mã số bỏ ≤ 1 ký tự -> term id
+        # Token xuất hiện ở quá nhiều tài liệu chỉ dùng để cộng điểm cho ứng viên sẵn có
+        self.common_df = max(64, self.size // 50)
+
+        for doc_id, fields in enumerate(docs):
+            for field in fields:
+                for tok in tokenize(field):
+                    tid = self.term_ids.get(tok)
+                    if tid is None:
+                        tid = self._add_term(tok)
+                    postings = self.term_docs[tid]
+                    if not postings or postings[-1] != doc_id:
+                        postings.append(doc_id)
+
+        self._cached_search = lru_cache(maxsize=1024)(self._search)
+
+    def _add_term(self, tok: str) -> int:
+        tid = len(self.terms)
+        self.term_ids[tok] = tid
+        self.terms.append(tok)
+        self.term_docs.append([])
+        for gram in _grams(tok):
+            self.grams.setdefault(gram, set()).add(tid)
+        if tok.isdigit():
+            for variant in {tok} | _deletions(tok):
+                self.code_deletes.setdefault(variant, set()).add(tid)
+        else:
+            bucket = self.fuzzy_grams.setdefault((tok[0], len(tok)), {})
+            for gram in _grams(tok):
+                bucket.setdefault(gram, []).append(tid)
+        return tid
+
+    # ----- khớp 1 token -----
+    def _substring_terms(self, tok: str) -> set[int]:
+        if len(tok) < 3:
+            tid = self.term_ids.get(tok)
+            return {tid} if tid is not None else set()
+        postings = []
+        for i in range(len(tok) - 2):
+            p = self.grams.get(tok[i:i + 3])
+            if not p:
+                return set()
+            postings.append(p)
+        postings.sort(key=len)
+        cands = set(postings[0])
+        for p in postings[1:]:
+            cands &= p
+            if not cands:
+                return cands
+        return {tid for tid in cands if tok in self.terms[tid]}
+
+    def _fuzzy_code_terms(self, tok: str) -> list[tuple[int, int]]:
+        cands: set[int] = set()
+        for variant in {tok} | _deletions(tok):
+            cands |= self.code_deletes.get(variant, set())
+        found = []
+        for tid in cands:
+            d = bounded_levenshtein(tok, self.terms[tid], 1)
+            if d == 1:
+                found.append((tid, d))
+        return found
+
+    def _fuzzy_terms(self, tok: str) -> list[tuple[int, int]]:
+        k = max_edits(tok)
+        if not k:
+            return []
+        if tok.isdigit():
+            return self._fuzzy_code_terms(tok)
+
+        grams = _grams(tok)
+        found: list[tuple[int, int]] = []
+        for length in range(max(len(tok) - k, 1), len(tok) + k + 1):
+            bucket = self.fuzzy_grams.get((tok[0], length))
+            if not bucket:
+                continue
+            counts: dict[int, int] = {}
+            for gram in grams:
+                for tid in bucket.get(gram, ()):
+                    counts[tid] = counts.get(tid, 0) + 1
+            # Mỗi lỗi thêm/bớt/thay làm mất tối đa 3 trigram, lỗi đảo ký tự tối đa 4.
+            # Với k = 2 giữ ngưỡng 3/lỗi để lọc ứng viên đủ chặt (bỏ sót rất hiếm).
+            need = max(
+                len(tok) - (4 if k == 1 else 3) * k,
+                FUZZY_MIN_SIMILARITY * max(len(tok), length),
+            )
+            for tid, c in counts.items():
+                if c < need:
+                    continue
+                d = bounded_levenshtein(tok, self.terms[tid], k)
+                if 0 < d <= k:
+                    found.append((tid, d))
+        return found
+
+    def _token_matches(self, tok: str) -> dict[float, list[list[int]]]:
+        """Trọng số -> danh sách postings của các từ khớp với token."""
+        groups: dict[float, list[list[int]]] = {}
+        for tid in self._substring_terms(tok):
+            w = EXACT_WEIGHT if self.terms[tid] == tok else SUBSTRING_WEIGHT
+            groups.setdefault(w, []).append(self.term_docs[tid])
+        # Mã số gõ nhầm 1 chữ số vẫn có thể là chuỗi con của mã khác -> xét thêm fuzzy
+        if not groups or tok.isdigit():
+            for tid, d in self._fuzzy_terms(tok):
+                groups.setdefault(FUZZY_WEIGHTS[d], []).append(self.term_docs[tid])
+        return groups
+
+    # ----- tìm kiếm -----
+    def _search(self, query_tokens: tuple[str, ...], top_k: int) -> tuple[tuple[float, int], ...]:
+        matched = []
+        for tok in query_tokens:
+            groups = self._token_matches(tok)
+            if groups:
+                df = sum(len(p) for postings in groups.values() for p in postings)
+                matched.append((df, groups))
+        matched.sort(key=lambda x: x[0])
+
+        scores: dict[int, float] = {}
+        for df, groups in matched:
+            weights = sorted(groups, reverse=True)
+            if scores and df > self.common_df:
+                # Token phổ biến: chỉ cộng điểm cho ứng viên đã khớp token hiếm hơn
+                doc_sets = [(w, set().union(*groups[w])) for w in weights]
+                for doc_id in scores:
+                    for w, docs in doc_sets:
+                        if doc_id in docs:
+                            scores[doc_id] += w
+                            break
+                continue
+
+            seen: set[int] = set()
+            for w in weights:
+                docs = set().union(*groups[w]) - seen
+                seen |= docs
+                for doc_id in docs:
+                    scores[doc_id] = scores.get(doc_id, 0) + w
+
+        ranked = heapq.nsmallest(top_k, scores.items(), key=lambda x: (-x[1], x[0]))
+        return tuple((score, doc_id) for doc_id, score in ranked)
+
+    def search(self, query: str, top_k: int = 1) -> list[tuple[float, int]]:
+        tokens = tuple(t for t in dict.fromkeys(tokenize(query)) if len(t) > 1)
+        if not tokens or not self.size:
+            return []
+        return list(self._cached_search(tokens, top_k))
+
+
+def _grams(tok: str) -> list[str]:
+    """Trigram của token, pad 1 dấu cách 2 đầu (token n ký tự -> n trigram)."""
+    padded = f" {tok} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _deletions(tok: str) -> set[str]:
+    return {tok[:i] + tok[i + 1:] for i in range(len(tok))}
+
+
+# ========= BENCHMARK =========
+def _bench(size: int, rounds: int):
+    import json
+    import random
+    import statistics
+    import time
+    from pathlib import Path
+
+    data_dir = Path(__file__).resolve().parent / "data"
+    with open(data_dir / "welllab_products.json", "r", encoding="utf-8") as f:
+        products = json.load(f)
+
+    # Tên giả lập: 1 "tên thương hiệu" ít gặp + 1–2 từ phổ biến lấy từ catalog thật + số
+    rng = random.Random(42)
+    common = sorted({w for p in products for w in p["name"].split() if len(w) > 2})
+    syllables = ["ta", "vi", "lon", "gel", "max", "cor", "neo", "fit", "zin", "ra", "mu", "sel", "pro", "ka"]
+    brands = sorted({"".join(rng.sample(syllables, 3)) for _ in range(size)})
+    docs: list[list[str]] = []
+    for p in products:
+        docs.append([p["name"], p["code"]])
+    while len(docs) < size:
+        name = " ".join([rng.choice(brands)] + rng.sample(common, rng.randint(1, 2))) + f" {rng.randint(1, 99):02d}"
+        docs.append([name, f"{rng.randint(0, 999999):06d}"])
+
+    started = time.perf_counter()
+    index = FuzzyIndex(docs)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def typo(s: str) -> str:
+        i = rng.randrange(len(s))
+        if rng.random() < 0.5:
+            return s[:i] + s[i + 1:]
+        return s[:i] + rng.choice("abcdeghiklmnoprstuvxy") + s[i + 1:]
+
+    def typo_digit(s: str) -> str:
+        i = rng.randrange(len(s))
+        return s[:i] + str((int(s[i]) + 1) % 10) + s[i + 1:]
+
+    sample = [rng.choice(docs) for _ in range(rounds)]
+    cases = {
+        "exact_name": [d[0] for d in sample],
+        "no_diacritics": [normalize_text(d[0]) for d in sample],
+        "typo_name": [" ".join(typo(w) if len(w) > 4 else w for w in d[0].split()) for d in sample],
+        "code": [d[1] for d in sample],
+        "typo_code": [typo_digit(d[1]) for d in sample],
+    }
+
+    print(f"docs={len(docs)} terms={len(index.terms)} build={build_ms:.0f}ms")
+    for label, queries in cases.items():
+        index._cached_search.cache_clear()
+        timings = []
+        hits = 0
+        for q, d in zip(queries, sample):
+            t0 = time.perf_counter()
+            res = index.search(q, top_k=5)
+            timings.append((time.perf_counter() - t0) * 1000)
+            hits += any(docs[doc_id] == d for _, doc_id in res)
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(
+            f"{label:14s} mean={statistics.mean(timings):.3f}ms "
+            f"p50={timings[len(timings) // 2]:.3f}ms p99={p99:.3f}ms top5_recall={hits / len(queries):.2%}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark chỉ mục tìm kiếm combo / sản phẩm")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.size, args.rounds)
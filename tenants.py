@@ -0,0 +1,108 @@
+"""
+Nhiều bot Telegram (team / vùng) chạy chung 1 tiến trình.
+
+Cấu hình ở data/bots.json (không có file = chỉ bot "default" dùng TELEGRAM_TOKEN):
+
+    {
+      "mien_bac": {
+        "token_env": "TELEGRAM_TOKEN_MIEN_BAC",
+        "system_prompt_file": "data/bots/mien_bac/system_prompt.txt",
+        "data_dir": "data/bots/mien_bac",
+        "secret_token_env": "TELEGRAM_SECRET_MIEN_BAC"
+      }
+    }
+
+- Webhook của bot: /webhook/<bot_id>  (bot "default" vẫn là /webhook).
+- data_dir: chỉ chứa file muốn ghi đè (symptoms_mapping.json, faq.json, objections.json);
+  combo, sản phẩm và chỉ mục tìm kiếm luôn dùng chung (xem catalog.with_overrides).
+- Session và hồ sơ người dùng (kèm chỉ mục export) tách riêng theo bot (data/users_store.<bot_id>.json).
+- secret_token_env: nếu có, update phải mang header X-Telegram-Bot-Api-Secret-Token khớp.
+"""
+import json
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from catalog import CatalogData, with_overrides
+from profile_index import ProfileIndex
+
+BASE_DIR = Path(__file__).resolve().parent
+BOTS_CONFIG_PATH = BASE_DIR / "data" / "bots.json"
+DEFAULT_BOT_ID = "default"
+
+
+@dataclass(eq=False)
+class Tenant:
+    bot_id: str
+    token: str
+    system_prompt: str
+    data: CatalogData
+    users_path: Path
+    data_dir: Path | None = None
+    secret_token: str | None = None
+    sessions: dict[int, dict] = field(default_factory=dict)
+    users_store: dict = field(default_factory=dict)
+    profile_index: ProfileIndex = field(default_factory=ProfileIndex)
+    users_dirty: bool = False
+
+    @property
+    def api_url(self) -> str:
+        return f"https://api.telegram.org/bot{self.token}"
+
+    def refresh_data(self, shared: CatalogData):
+        self.data = with_overrides(shared, self.data_dir) if self.data_dir else shared
+
+
+def _path(value: str) -> Path:
+    path = Path(value)
+    return path if path.is_absolute() else BASE_DIR / path
+
+
+def load_tenants(
+    default: Tenant,
+    shared: CatalogData,
+    config_path: Path = BOTS_CONFIG_PATH,
+) -> dict[str, Tenant]:
+    """Bot mặc định + các bot trong bots.json. Bot thiếu token bị bỏ qua (có cảnh báo)."""
+    tenants = {default.bot_id: default}
+    if not config_path.exists():
+        return tenants
+    try:
+        config = json.loads(config_path.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"Không load được {config_path}: {e}")
+        return tenants
+
+    for bot_id, cfg in config.items():
+        if bot_id in tenants or not isinstance(cfg, dict):
+            print(f"bots.json: bỏ qua bot '{bot_id}' (trùng id / sai định dạng)")
+            continue
+        token = os.environ.get(cfg.get("token_env") or "")
+        if not token:
+            print(f"bots.json: bot '{bot_id}' chưa có token ({cfg.get('token_env')}), bỏ qua")
+            continue
+
+        system_prompt = cfg.get("system_prompt") or default.system_prompt
+        if cfg.get("system_prompt_file"):
+            try:
+                system_prompt = _path(cfg["system_prompt_file"]).read_text(encoding="utf-8").strip()
+            except OSError as e:
+                print(f"bots.json: bot '{bot_id}' không đọc được system prompt: {e}")
+
+        tenant = Tenant(
+            bot_id=bot_id,
+            token=token,
+            system_prompt=system_prompt,
+            data=shared,
+            users_path=default.users_path.with_name(f"users_store.{bot_id}.json"),
+            data_dir=_path(cfg["data_dir"]) if cfg.get("data_dir") else None,
+            secret_token=os.environ.get(cfg.get("secret_token_env") or "") or None,
+        )
+        tenant.refresh_data(shared)
+        tenants[bot_id] = tenant
+    return tenants
+
+
+# Bot đang xử lý request hiện tại. Luồng nền (warm-up, prewarm...) không set -> bot mặc định.
+CURRENT: ContextVar[Tenant] = ContextVar("tenant")
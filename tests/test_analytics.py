@@ -0,0 +1,108 @@
+"""Thống kê tăng dần (analytics.py): checkpoint theo đoạn log + log xoay vòng / nén gz."""
+import gzip
+import json
+
+import pytest
+
+import analytics
+
+
+def line(i: int, direction: str = "user", day: int = 1, **meta) -> bytes:
+    rec = {"ts": f"2026-01-{day:02d}T08:00:{i % 60:02d}", "user_id": 100 + i % 2, "direction": direction}
+    if meta:
+        rec["meta"] = meta
+    return (json.dumps(rec) + "\n").encode("utf-8")
+
+
+def totals(conn) -> dict:
+    return dict(conn.execute("SELECT direction, SUM(n) FROM daily_counts GROUP BY direction"))
+
+
+@pytest.fixture
+def conn(tmp_path):
+    c = analytics.connect(tmp_path / "analytics.sqlite")
+    yield c
+    c.close()
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    d = tmp_path / "logs"
+    d.mkdir()
+    return d
+
+
+def test_second_run_reads_only_new_lines(conn, log_dir):
+    active = log_dir / analytics.LOG_NAME
+    active.write_bytes(b"".join(line(i) for i in range(3)) + line(3, "bot", intent="ask_product", need="sleep"))
+    assert analytics.ingest(conn, log_dir) == 4
+    assert analytics.ingest(conn, log_dir) == 0                 # không đếm trùng
+
+    with open(active, "ab") as f:
+        f.write(line(4) + line(5, "bot", intent="ask_product")[:-10])   # dòng cuối đang ghi dở
+    assert analytics.ingest(conn, log_dir) == 1
+    assert totals(conn) == {"user": 4, "bot": 1}
+
+    with open(active, "ab") as f:
+        f.write(line(5, "bot", intent="ask_product")[-10:])
+    assert analytics.ingest(conn, log_dir) == 1
+    assert totals(conn) == {"user": 4, "bot": 2}
+    assert conn.execute("SELECT n FROM intent_counts WHERE intent = 'ask_product'").fetchone() == (2,)
+    assert conn.execute("SELECT n FROM need_counts WHERE need = 'sleep'").fetchone() == (1,)
+
+
+def test_rotation_and_gzip_do_not_recount(conn, log_dir):
+    active = log_dir / analytics.LOG_NAME
+    active.write_bytes(b"".join(line(i) for i in range(4)))
+    assert analytics.ingest(conn, log_dir) == 4
+
+    # Xoay vòng: log cũ ghi thêm 1 dòng trước khi đổi tên -> .1 rồi nén thành .2.gz
+    with open(active, "ab") as f:
+        f.write(line(4))
+    active.rename(log_dir / (analytics.LOG_NAME + ".1"))
+    active.write_bytes(b"".join(line(i, "bot", day=2) for i in range(10, 12)))
+    assert analytics.ingest(conn, log_dir) == 3                 # dòng còn lại của .1 + 2 dòng mới
+    assert totals(conn) == {"user": 5, "bot": 2}
+
+    rotated = log_dir / (analytics.LOG_NAME + ".1")
+    with gzip.open(log_dir / (analytics.LOG_NAME + ".2.gz"), "wb") as f:
+        f.write(rotated.read_bytes())
+    rotated.unlink()
+    active.rename(rotated)
+    active.write_bytes(line(20, day=3))
+    assert analytics.ingest(conn, log_dir) == 1
+    assert totals(conn) == {"user": 6, "bot": 2}
+    # Mỗi đoạn 1 checkpoint; đoạn đã xong không mở lại nên path cũ giữ nguyên
+    done = sorted(conn.execute("SELECT done FROM checkpoint"))
+    assert done == [(0,), (1,), (1,)]
+
+
+def test_gz_segment_read_from_checkpoint(conn, log_dir):
+    # Đoạn đang đọc dở lúc bị nén: đọc tiếp từ offset (theo byte đã giải nén)
+    active = log_dir / analytics.LOG_NAME
+    active.write_bytes(line(0) + line(1))
+    analytics.ingest(conn, log_dir)
+    data = active.read_bytes() + line(2) + line(3)
+    active.unlink()
+    with gzip.open(log_dir / (analytics.LOG_NAME + ".1.gz"), "wb") as f:
+        f.write(data)
+    assert analytics.ingest(conn, log_dir) == 2
+    assert totals(conn) == {"user": 4}
+
+
+def test_truncated_active_log_restarts_from_zero(conn, log_dir):
+    active = log_dir / analytics.LOG_NAME
+    first = line(0)
+    active.write_bytes(first + b"".join(line(i) for i in range(1, 6)))
+    analytics.ingest(conn, log_dir)
+    active.write_bytes(first)                                   # copytruncate rồi ghi lại đúng dòng đầu
+    assert analytics.ingest(conn, log_dir) == 1
+
+
+def test_batches_commit_checkpoint_midway(conn, log_dir, monkeypatch):
+    monkeypatch.setattr(analytics, "BATCH_LINES", 2)
+    active = log_dir / analytics.LOG_NAME
+    active.write_bytes(b"".join(line(i) for i in range(5)) + "{hỏng\n".encode("utf-8"))
+    assert analytics.ingest(conn, log_dir) == 6                 # dòng hỏng vẫn tiến offset
+    assert totals(conn) == {"user": 5}
+    assert conn.execute("SELECT offset FROM checkpoint").fetchone() == (active.stat().st_size,)
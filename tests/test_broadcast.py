@@ -0,0 +1,154 @@
+"""Broadcast (broadcast.py) với sender giả: không gọi Telegram."""
+import threading
+import time
+
+import pytest
+
+from broadcast import BLOCKED, SENT, Broadcaster, BroadcastStore, RateLimiter, SendResult
+from delivery import split_message
+
+LONG_TEXT = "\n\n".join(f"Đoạn {i}: " + "x" * 1500 for i in range(5))      # > 4096 -> nhiều đoạn
+
+
+class FakeClock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class FakeSender:
+    """Ghi lại (chat_id, text, lúc gửi); replies: chat_id -> list SendResult trả lần lượt."""
+
+    def __init__(self, replies: dict | None = None):
+        self.replies = replies or {}
+        self.calls: list[tuple[int, str, float]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, bot_id: str, chat_id: int, text: str) -> SendResult:
+        with self._lock:
+            self.calls.append((chat_id, text, time.monotonic()))
+            queued = self.replies.get(chat_id)
+            return queued.pop(0) if queued else SendResult(True, 200)
+
+    def texts(self, chat_id: int) -> list[str]:
+        return [text for cid, text, _ in self.calls if cid == chat_id]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BroadcastStore(tmp_path / "broadcasts.sqlite")
+
+
+def run_job(broadcaster: Broadcaster, job_id: int, timeout: float = 10):
+    assert broadcaster.start(job_id)
+    deadline = time.monotonic() + timeout
+    while job_id in broadcaster._running:
+        assert time.monotonic() < deadline, "job không xong"
+        time.sleep(0.01)
+
+
+def make_broadcaster(store, sender, **kw):
+    kw.setdefault("rate", 1000)
+    kw.setdefault("concurrency", 2)
+    kw.setdefault("chat_interval", 0)
+    return Broadcaster(store, sender, **kw)
+
+
+# ----- RateLimiter -----
+def test_limiter_spaces_sends_evenly():
+    clock = FakeClock()
+    limiter = RateLimiter(10, clock=clock, sleep=clock.sleep)
+    times = []
+    for _ in range(3):
+        limiter.acquire()
+        times.append(clock.now)
+    assert times == pytest.approx([100.0, 100.1, 100.2])
+
+
+def test_limiter_pause_and_live_sends_push_next_slot():
+    clock = FakeClock()
+    limiter = RateLimiter(10, clock=clock, sleep=clock.sleep)
+    limiter.acquire()
+    limiter.pause(2)                # 429 retry_after=2
+    limiter.acquire()
+    assert clock.now == pytest.approx(102.0)
+    limiter.note(5)                 # 5 tin trả lời thường của cùng bot
+    limiter.acquire()
+    assert clock.now == pytest.approx(102.6)
+
+
+# ----- Broadcaster -----
+def test_sends_every_recipient_once_and_finishes(store):
+    sender = FakeSender()
+    job_id = store.create("bot", "Thông báo", {}, [1, 2, 3, 2], now=0)
+    run_job(make_broadcaster(store, sender), job_id)
+    assert sorted(cid for cid, _, _ in sender.calls) == [1, 2, 3]
+    job = store.get(job_id)
+    assert (job["status"], job["sent"], job["total"]) == ("done", 3, 4)
+
+
+def test_resume_sends_only_remaining_chunks(store):
+    chunks = split_message(LONG_TEXT)
+    assert len(chunks) > 2
+    job_id = store.create("bot", LONG_TEXT, {}, [7, 8], now=0)
+    store.save_chunks(job_id, 7, 2)         # lần chạy trước đã gửi 2 đoạn cho chat 7
+    sender = FakeSender()
+    run_job(make_broadcaster(store, sender), job_id)
+    assert sender.texts(7) == list(chunks[2:])
+    assert sender.texts(8) == list(chunks)
+
+
+def test_429_pauses_then_retries(store):
+    sender = FakeSender({5: [SendResult(False, 429, "Too Many Requests", retry_after=0.2)]})
+    job_id = store.create("bot", "Thông báo", {}, [5], now=0)
+    run_job(make_broadcaster(store, sender), job_id)
+    (first, _, t1), (second, _, t2) = sender.calls
+    assert first == second == 5
+    assert t2 - t1 >= 0.2
+    job = store.get(job_id)
+    assert (job["sent"], job["retries"]) == (1, 1)
+
+
+def test_403_marks_blocked_without_retry(store):
+    sender = FakeSender({5: [SendResult(False, 403, "Forbidden: bot was blocked by the user")]})
+    job_id = store.create("bot", "Thông báo", {}, [5], now=0)
+    run_job(make_broadcaster(store, sender), job_id)
+    assert len(sender.calls) == 1
+    assert store.get(job_id)["blocked"] == 1
+    assert store.pending(job_id, None) == []
+
+
+def test_chunks_to_one_chat_are_paced(store):
+    chunks = split_message(LONG_TEXT)
+    sender = FakeSender()
+    job_id = store.create("bot", LONG_TEXT, {}, [9], now=0)
+    run_job(make_broadcaster(store, sender, chat_interval=0.1), job_id)
+    times = [t for _, _, t in sender.calls]
+    assert len(times) == len(chunks)
+    assert all(b - a >= 0.1 for a, b in zip(times, times[1:]))
+
+
+def test_lease_blocks_second_owner_and_finish_keeps_pause(store):
+    job_id = store.create("bot", "Thông báo", {}, [1], now=0)
+    assert store.lease(job_id, "worker-a", now=10)
+    assert not store.lease(job_id, "worker-b", now=20)               # a còn giữ
+    assert not make_broadcaster(store, FakeSender(), clock=lambda: 20).start(job_id)
+    assert store.lease(job_id, "worker-a", now=20, renew=True)
+
+    assert store.set_status(job_id, "paused")
+    assert not store.lease(job_id, "worker-a", now=25, renew=True)   # pause -> gia hạn thất bại
+    assert not store.finish(job_id, "worker-a", now=30)              # không ghi đè paused
+    assert store.get(job_id)["status"] == "paused"
+
+
+def test_mark_counts_once(store):
+    job_id = store.create("bot", "Thông báo", {}, [1], now=0)
+    store.mark(job_id, 1, SENT)
+    store.mark(job_id, 1, BLOCKED)          # đã xong rồi: không đếm lại
+    job = store.get(job_id)
+    assert (job["sent"], job["blocked"]) == (1, 0)
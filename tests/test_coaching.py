@@ -0,0 +1,58 @@
+"""Job sinh sẵn coaching (coaching.py) với LLM giả: không gọi mạng."""
+import pytest
+
+from catalog import load_catalog
+from coaching import (
+    COMBO_SESSION,
+    PRODUCT_SESSION,
+    build_artifact,
+    coaching_jobs,
+    coaching_session,
+    fingerprint,
+    stub_llm,
+)
+from prompts import COMBO_COACH_PROMPT, PRODUCT_COACH_PROMPT, build_openai_messages
+
+
+@pytest.fixture(scope="module")
+def data():
+    return load_catalog()
+
+
+def counting_llm(calls: list):
+    def llm(messages):
+        calls.append(messages)
+        return stub_llm(messages)
+
+    return llm
+
+
+def test_stub_artifact_covers_every_job(data):
+    artifact = build_artifact(data, stub_llm)
+    fps = {fingerprint(messages) for _, messages in coaching_jobs(data)}
+    assert set(artifact["entries"]) == fps
+    assert all(e["text"].startswith("[stub coaching ") for e in artifact["entries"].values())
+
+
+def test_rebuild_reuses_previous_entries(data):
+    previous = build_artifact(data, stub_llm)
+    calls: list = []
+    artifact = build_artifact(data, counting_llm(calls), previous=previous)
+    assert calls == []
+    assert artifact["entries"] == previous["entries"]
+
+
+def test_live_session_hits_artifact(data):
+    """Session thật đã có intent / hồ sơ KH (vd. "Việt Nam có combo..." -> gender) vẫn khớp entry."""
+    entries = build_artifact(data, stub_llm)["entries"]
+    live = {"user_id": 1, "intent": "diabetes", "profile": {"gender": "nam", "age": 52}, "stage": "advise"}
+
+    prod, combo = data.products[0], data.combos[0]
+    messages = build_openai_messages(PRODUCT_COACH_PROMPT, coaching_session(live, PRODUCT_SESSION), product=prod)
+    assert fingerprint(messages) in entries
+    messages = build_openai_messages(COMBO_COACH_PROMPT, coaching_session(live, COMBO_SESSION), combo=combo)
+    assert fingerprint(messages) in entries
+
+    # Bản sao nông: session gốc không bị sửa, user_id vẫn còn cho hạn mức LLM
+    assert coaching_session(live, COMBO_SESSION)["user_id"] == 1
+    assert live["profile"] == {"gender": "nam", "age": 52}
@@ -0,0 +1,128 @@
+"""Chia / ghép / gửi tin nhắn (delivery.py) với HTTP giả: không gọi Telegram."""
+from delivery import (
+    MAX_RETRY_AFTER_SECONDS,
+    TELEGRAM_TEXT_LIMIT,
+    join_chunks,
+    send_chunks,
+    split_message,
+    tg_len,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200, body: dict | None = None):
+        self.status_code = status_code
+        self._body = body if body is not None else {"ok": True}
+
+    def json(self) -> dict:
+        return self._body
+
+
+class FakeHttp:
+    """Ghi lại payload đã post; replies: list FakeResponse trả lần lượt (hết thì 200)."""
+
+    def __init__(self, replies: list | None = None):
+        self.replies = list(replies or [])
+        self.posts: list[dict] = []
+
+    def post(self, url: str, json=None, timeout=None):
+        self.posts.append(dict(json))
+        return self.replies.pop(0) if self.replies else FakeResponse()
+
+
+def rate_limited(seconds: float) -> FakeResponse:
+    return FakeResponse(429, {"ok": False, "description": "Too Many Requests", "parameters": {"retry_after": seconds}})
+
+
+# ----- split_message / join_chunks -----
+def test_short_text_is_one_chunk():
+    assert split_message("Chào bạn") == ("Chào bạn",)
+    assert split_message("") == ()
+
+
+def test_split_prefers_paragraphs_and_respects_limit():
+    text = "\n\n".join(f"Đoạn {i}. " + "x" * 1500 for i in range(5))
+    chunks = split_message(text)
+    assert len(chunks) > 1
+    assert all(tg_len(c) <= TELEGRAM_TEXT_LIMIT for c in chunks)
+    assert all(c.startswith("Đoạn") for c in chunks)                 # cắt ở đoạn trống
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+
+def test_split_counts_emoji_as_two_units():
+    text = "😴" * 3000                                                 # 6000 đơn vị UTF-16
+    chunks = split_message(text, limit=4096)
+    assert all(tg_len(c) <= 4096 for c in chunks)
+    assert "".join(chunks) == text
+
+
+def test_split_never_breaks_markdown_pairs():
+    bold = "*" + "rất dài " * 80 + "*"
+    text = "Mở đầu. " * 40 + bold + " kết thúc. " * 40
+    for chunk in split_message(text, limit=700):
+        assert chunk.count("*") % 2 == 0
+
+
+def test_hard_cut_closes_and_reopens_bold():
+    text = "*" + "x" * 250 + "*"
+    chunks = split_message(text, limit=100)
+    assert len(chunks) > 1
+    assert all(c.startswith("*") and c.endswith("*") for c in chunks)
+    assert all(tg_len(c) <= 100 for c in chunks)
+
+
+def test_join_chunks_packs_until_limit():
+    parts = [("a" * 40,), ("b" * 40,), ("c" * 40,)]
+    assert join_chunks(parts, "\n\n", limit=100) == ("a" * 40 + "\n\n" + "b" * 40, "c" * 40)
+    # Phần đã bị chia nhiều đoạn: chỉ đoạn đầu được ghép vào tin trước
+    assert join_chunks([("a",), ("b1", "b2")], " ", limit=100) == ("a b1", "b2")
+
+
+# ----- send_chunks -----
+def test_send_keeps_order_and_markup_on_last_chunk():
+    http = FakeHttp()
+    markup = {"keyboard": [["Menu"]]}
+    delivery = send_chunks(http, "api", 7, ("1", "2", "3"), reply_markup=markup)
+    assert delivery.sent == 3 and delivery.retry_after is None
+    assert [p["text"] for p in http.posts] == ["1", "2", "3"]
+    assert [("reply_markup" in p) for p in http.posts] == [False, False, True]
+    assert all(p["parse_mode"] == "Markdown" for p in http.posts)
+
+
+def test_markdown_error_resends_as_plain_text():
+    http = FakeHttp([FakeResponse(400, {"ok": False, "description": "Bad Request: can't parse entities"})])
+    delivery = send_chunks(http, "api", 7, ("*lỗi",))
+    assert delivery.sent == 1
+    assert [("parse_mode" in p) for p in http.posts] == [True, False]
+
+
+def test_other_error_stops_remaining_chunks():
+    http = FakeHttp([FakeResponse(), FakeResponse(403, {"ok": False, "description": "Forbidden"})])
+    delivery = send_chunks(http, "api", 7, ("1", "2", "3"))
+    assert delivery.sent == 1 and delivery.retry_after is None
+    assert len(http.posts) == 2
+
+
+def test_short_rate_limit_waits_full_retry_after():
+    slept = []
+    http = FakeHttp([rate_limited(3)])
+    delivery = send_chunks(http, "api", 7, ("1", "2"), sleep=slept.append)
+    assert slept == [3]
+    assert delivery.sent == 2
+    assert [p["text"] for p in http.posts] == ["1", "1", "2"]
+
+
+def test_long_rate_limit_is_reported_not_dropped():
+    slept = []
+    http = FakeHttp([FakeResponse(), rate_limited(MAX_RETRY_AFTER_SECONDS + 25)])
+    delivery = send_chunks(http, "api", 7, ("1", "2", "3"), sleep=slept.append)
+    assert slept == []
+    assert delivery.sent == 1
+    assert delivery.retry_after == MAX_RETRY_AFTER_SECONDS + 25
+
+
+def test_rate_limit_without_budget_is_reported():
+    slept = []
+    http = FakeHttp([rate_limited(1)])
+    delivery = send_chunks(http, "api", 7, ("1",), can_wait=lambda: False, sleep=slept.append)
+    assert slept == [] and delivery.sent == 0 and delivery.retry_after == 1
@@ -0,0 +1,114 @@
+"""Làn xử lý + token bucket theo TVV (lanes.py) với đồng hồ giả."""
+import threading
+
+import pytest
+
+from lanes import Lane, ThreadBudget, UserBuckets, chat_lock
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# ----- UserBuckets -----
+def test_burst_then_wait_time():
+    clock = FakeClock()
+    buckets = UserBuckets(clock=clock)
+    assert [buckets.take("u", 6, 3) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("u", 6, 3) == pytest.approx(10.0)         # 6 token/phút -> 10 s/token
+
+
+def test_refill_after_waiting():
+    clock = FakeClock()
+    buckets = UserBuckets(clock=clock)
+    buckets.take("u", 6, 1)
+    wait = buckets.take("u", 6, 1)
+    assert wait == pytest.approx(10.0)
+    clock.now += 4
+    assert buckets.take("u", 6, 1) == pytest.approx(6.0)           # đã hồi 0.4 token
+    clock.now += 6
+    assert buckets.take("u", 6, 1) == 0
+
+
+def test_refill_capped_at_burst():
+    clock = FakeClock()
+    buckets = UserBuckets(clock=clock)
+    buckets.take("u", 60, 2)
+    clock.now += 3600
+    assert [buckets.take("u", 60, 2) for _ in range(3)][2] > 0
+
+
+def test_refund_returns_token_up_to_burst():
+    clock = FakeClock()
+    buckets = UserBuckets(clock=clock)
+    buckets.take("u", 6, 1)
+    buckets.refund("u", 1)                  # làn LLM từ chối -> trả token
+    assert buckets.take("u", 6, 1) == 0
+    buckets.refund("u", 1)
+    buckets.refund("u", 1)                  # không vượt burst
+    assert buckets.take("u", 6, 1) == 0
+    assert buckets.take("u", 6, 1) > 0
+
+
+def test_users_are_independent_and_zero_rate_rejects():
+    clock = FakeClock()
+    buckets = UserBuckets(clock=clock)
+    buckets.take("a", 6, 1)
+    assert buckets.take("b", 6, 1) == 0
+    buckets.take("z", 0, 1)
+    assert buckets.take("z", 0, 1) == float("inf")
+
+
+# ----- Lane -----
+def test_lane_sheds_when_full():
+    lane = Lane("llm", max_active=1, max_waiting=0)
+    with lane.admit() as first:
+        assert first
+        assert lane.would_shed()
+        with lane.admit() as second:
+            assert not second
+    assert not lane.would_shed()
+
+
+def test_lane_reserve_keeps_slot_for_foreground():
+    lane = Lane("llm", max_active=2, max_waiting=1, wait_timeout=0.1)
+    with lane.admit():
+        assert lane.would_shed(reserve=1, wait=False)      # prefetch không lấy slot cuối
+        with lane.admit() as ok:
+            assert ok
+
+
+# ----- ThreadBudget / chat_lock -----
+def test_thread_budget_only_counts_threads_in_scope():
+    budget = ThreadBudget("blocking", 1)
+    assert budget.try_block()               # ngoài scope (thread nền): luôn được
+    results = []
+    entered, release = threading.Event(), threading.Event()
+
+    def holder():
+        with budget.scope():
+            results.append(budget.try_block())
+            entered.set()
+            release.wait(5)
+
+    t = threading.Thread(target=holder)
+    t.start()
+    entered.wait(5)
+    with budget.scope():
+        results.append(budget.try_block())  # hết suất
+    release.set()
+    t.join()
+    with budget.scope():
+        results.append(budget.try_block())  # suất đã được trả
+    assert results == [True, False, True]
+
+
+def test_chat_lock_sheds_waiter_without_budget():
+    with chat_lock("chat", max_waiting=1) as held:
+        assert held
+        with chat_lock("chat", max_waiting=1, can_wait=lambda: False) as ok:
+            assert not ok
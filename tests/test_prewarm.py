@@ -0,0 +1,52 @@
+"""Chọn câu hỏi để làm nóng cache (prewarm.py): ghép tin TVV với tin bot theo chat."""
+from prewarm import top_questions
+
+
+def user(uid: int, text: str, chat: int | None = None, bot: str | None = None) -> dict:
+    meta = {"chat_id": chat if chat is not None else uid}
+    if bot:
+        meta["bot"] = bot
+    return {"user_id": uid, "direction": "user", "text": text, "meta": meta}
+
+
+def bot(chat: int, branch: str = "need", intent: str = "ask_product", bot_id: str | None = None) -> dict:
+    meta = {"need": "sleep", "intent": intent, "branch": branch}
+    if bot_id:
+        meta["bot"] = bot_id
+    return {"user_id": chat, "direction": "bot", "text": "...", "meta": meta}
+
+
+def test_group_chat_questions_are_paired_by_chat():
+    group = -100500
+    records = [
+        user(11, "Khách mất ngủ lâu năm dùng gì?", chat=group), bot(group),
+        user(12, "khách mất ngủ lâu năm dùng gì", chat=group), bot(group),
+        user(13, "Khách bị gan nhiễm mỡ tư vấn sao?", chat=group), bot(group, intent="liver"),
+    ]
+    picked = top_questions(records)
+    assert picked[0] == ("sleep", "ask_product", "need", "Khách mất ngủ lâu năm dùng gì?", 2)
+    assert [p[3] for p in picked[1:]] == ["Khách bị gan nhiễm mỡ tư vấn sao?"]
+
+
+def test_only_first_bot_reply_counts_and_other_chats_do_not_mix():
+    records = [
+        user(11, "Combo cho người mất ngủ?"),
+        user(22, "Khách đau dạ dày dùng gì?"),
+        bot(22, intent="stomach"),
+        bot(11), bot(11),                               # 2 tin bot cho 1 câu hỏi -> đếm 1 lần
+        user(11, "/start"), bot(11),                    # lệnh không phải câu hỏi
+    ]
+    picked = {p[3]: (p[1], p[4]) for p in top_questions(records)}
+    assert picked == {"Combo cho người mất ngủ?": ("ask_product", 1), "Khách đau dạ dày dùng gì?": ("stomach", 1)}
+
+
+def test_same_chat_on_two_bots_is_separate_and_branch_filter():
+    records = [
+        user(11, "Khách mất ngủ dùng gì ạ?", bot="b2"),
+        bot(11, branch="faq"),                          # bot mặc định trả lời chat 11 -> không ghép
+        bot(11, branch="need", bot_id="b2"),
+        {"user_id": 33, "direction": "user", "text": "Log cũ chưa có chat_id?"},
+        bot(33, branch="faq"),
+    ]
+    assert [p[3] for p in top_questions(records, branches={"need"})] == ["Khách mất ngủ dùng gì ạ?"]
+    assert len(top_questions(records)) == 2
@@ -0,0 +1,80 @@
+"""Chỉ mục hồ sơ cho /admin/users (profile_index.py): phân trang cursor + lọc."""
+import pytest
+
+from profile_index import ProfileIndex, decode_cursor, encode_cursor, top_key
+
+
+def profile(day: int, total: int = 1, need: str | None = None, intent: str | None = None) -> dict:
+    return {
+        "last_seen": f"2026-01-{day:02d}T08:00:00",
+        "total_messages": total,
+        "main_needs": {need: 3} if need else {},
+        "intents_count": {intent: 2} if intent else {},
+    }
+
+
+def all_pages(index: ProfileIndex, limit: int, **filters) -> list[list[str]]:
+    pages, cursor = [], None
+    while True:
+        page, cursor = index.query(limit, cursor=cursor, **filters)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+@pytest.fixture
+def index():
+    idx = ProfileIndex()
+    idx.rebuild({
+        "u1": profile(1, 5, "sleep", "ask_product"),
+        "u2": profile(2, 1, "sleep", "objection"),
+        "u3": profile(3, 9, "liver", "ask_product"),
+        "u4": profile(4, 12, "sleep", "ask_product"),
+        "u5": profile(5, 3, "sleep", "ask_product"),
+        "u6": profile(5, 7, "liver", None),                  # cùng last_seen với u5 -> xếp theo uid
+        "u7": profile(6, 20, "sleep", "ask_product"),
+    })
+    return idx
+
+
+def test_top_key_and_cursor_roundtrip():
+    assert top_key({"b": 2, "a": 2, "c": 1}) == "a"
+    assert top_key({}) is None
+    assert decode_cursor(encode_cursor("2026-01-01", "u1")) == ("2026-01-01", "u1")
+    with pytest.raises(ValueError):
+        decode_cursor("không-phải-cursor")
+
+
+def test_pagination_covers_all_once_in_order(index):
+    assert len(index) == 7
+    assert all_pages(index, 3) == [["u1", "u2", "u3"], ["u4", "u5", "u6"], ["u7"]]
+    # Trang vừa khít: trang cuối không trả cursor thừa
+    assert all_pages(index, 7) == [["u1", "u2", "u3", "u4", "u5", "u6", "u7"]]
+
+
+def test_pagination_with_combined_filters(index):
+    pages = all_pages(index, 2, need="sleep", intent="ask_product", min_messages=4)
+    assert pages == [["u1", "u4"], ["u7"]]
+    pages = all_pages(
+        index, 1, need="sleep", last_seen_from="2026-01-02", last_seen_to="2026-01-05", max_messages=10
+    )
+    assert pages == [["u2"], ["u5"]]                          # last_seen_to gồm cả ngày 05
+
+
+def test_cursor_stays_valid_when_profiles_change(index):
+    page, cursor = index.query(2)
+    assert page == ["u1", "u2"]
+    index.update("u1", profile(7, 6, "sleep", "ask_product"))  # u1 vừa nhắn lại -> cuối danh sách
+    index.update("u8", profile(1, 1, "sleep"))                 # hồ sơ mới nằm trước cursor -> trang sau không có
+    rest = []
+    while cursor:
+        page, cursor = index.query(2, cursor=cursor)
+        rest += page
+    assert rest == ["u3", "u4", "u5", "u6", "u7", "u1"]
+
+
+def test_update_moves_need_and_intent_buckets(index):
+    index.update("u3", profile(3, 9, "sleep", "objection"))
+    assert index.query(10, need="liver")[0] == ["u6"]
+    assert index.query(10, intent="objection")[0] == ["u2", "u3"]
+    assert index.query(10, need="unknown") == ([], None)
@@ -0,0 +1,129 @@
+"""Scheduler nhắc follow-up (reminders.py) chạy bằng đồng hồ giả: không có thread, không sleep."""
+import pytest
+
+import reminders
+from reminders import ReminderStore, Scheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = ReminderStore(tmp_path / "reminders.sqlite")
+    yield s
+    s.close()
+
+
+def make_scheduler(store, clock, fired: list, horizon: float = 3600):
+    return Scheduler(store, fired.append, clock=clock, horizon=horizon)
+
+
+def test_fires_in_due_order_only_when_due(store):
+    clock, fired = FakeClock(), []
+    sched = make_scheduler(store, clock, fired)
+    late = store.add("bot", 1, 1, clock.now + 120, note="sau")
+    early = store.add("bot", 1, 1, clock.now + 60, note="trước")
+    sched.schedule(late)
+    sched.schedule(early)
+
+    assert sched.run_pending() == 0
+    clock.now += 60
+    assert sched.run_pending() == 1
+    clock.now += 60
+    assert sched.run_pending() == 1
+    assert [r.id for r in fired] == [early.id, late.id]
+    assert store.pending_for_chat("bot", 1) == []
+
+
+def test_beyond_horizon_loaded_later(store):
+    clock, fired = FakeClock(), []
+    sched = make_scheduler(store, clock, fired, horizon=100)
+    far = store.add("bot", 1, 1, clock.now + 7 * 86400)
+    sched.schedule(far)
+    sched.run_pending()
+    assert len(sched) == 0          # ngoài horizon: chưa vào heap
+
+    clock.now = far.due_ts
+    assert sched.run_pending() == 1
+    assert fired[0].id == far.id
+
+
+def test_restart_fires_overdue_once(store):
+    clock, fired = FakeClock(), []
+    store.add("bot", 1, 1, clock.now - 10)
+    first = make_scheduler(store, clock, fired)
+    second = make_scheduler(store, clock, fired)   # worker khác / sau restart cùng DB
+    assert first.run_pending() + second.run_pending() == 1
+    assert len(fired) == 1
+
+
+def test_cancelled_not_fired(store):
+    clock, fired = FakeClock(), []
+    sched = make_scheduler(store, clock, fired)
+    r = store.add("bot", 1, 1, clock.now + 5)
+    sched.schedule(r)
+    assert store.cancel(r.id, "bot", 1)
+    clock.now += 5
+    assert sched.run_pending() == 0
+    assert fired == []
+
+
+def test_same_due_ts_beyond_batch_does_not_stall(store, monkeypatch):
+    monkeypatch.setattr(reminders, "LOAD_BATCH", 3)
+    clock, fired = FakeClock(), []
+    due = clock.now + 30
+    ids = [store.add("bot", 1, 1, due).id for _ in range(8)]
+    sched = make_scheduler(store, clock, fired)
+
+    clock.now = due
+    for _ in range(5):
+        sched.run_pending()
+    assert sorted(r.id for r in fired) == ids
+
+
+def test_add_keeps_explicit_zero_now(store):
+    r = store.add("bot", 1, 1, 10.0, now=0.0)
+    created = store._db.execute("SELECT created_ts FROM reminders WHERE id = ?", (r.id,)).fetchone()[0]
+    assert created == 0.0
+
+
+def test_failed_send_is_retried(store):
+    clock, attempts = FakeClock(), []
+
+    def flaky(reminder):
+        attempts.append(clock.now)
+        return len(attempts) > 1            # lần đầu Telegram lỗi
+
+    sched = Scheduler(store, flaky, clock=clock)
+    r = store.add("bot", 1, 1, clock.now + 5)
+    sched.schedule(r)
+    clock.now += 5
+    assert sched.run_pending() == 0
+    assert [x.id for x in store.pending_for_chat("bot", 1)] == [r.id]   # chưa mất nhắc
+
+    clock.now += reminders.RETRY_DELAYS[0]
+    assert sched.run_pending() == 1
+    assert len(attempts) == 2
+    assert store.pending_for_chat("bot", 1) == []
+
+
+def test_retry_budget_exhausted(store):
+    clock, attempts = FakeClock(), []
+
+    def broken(reminder):
+        attempts.append(clock.now)
+        raise RuntimeError("telegram down")
+
+    sched = Scheduler(store, broken, clock=clock)
+    sched.schedule(store.add("bot", 1, 1, clock.now))
+    for delay in (0, *reminders.RETRY_DELAYS, 86400):
+        clock.now += delay
+        sched.run_pending()
+    assert len(attempts) == len(reminders.RETRY_DELAYS) + 1
+    assert store.pending_for_chat("bot", 1) == []